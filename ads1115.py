@@ -0,0 +1,489 @@
+"""
+Register level access to the ADS1115, a lean single shot driver and acquisition in continuous 
+conversion mode.
+The I2C bus and the GPIO module are received as arguments, so this module doesn't depend on the
+hardware and the drivers can be tested with the simulated chip (and FakeSMBus) on any computer.
+"""
+import threading
+import time
+
+# Register pointers
+REG_CONVERSION = 0x00
+REG_CONFIG = 0x01
+REG_LO_THRESH = 0x02
+REG_HI_THRESH = 0x03
+
+# Config register fields (datasheet SBAS444, table 8)
+# Operational status, writing 1 starts a single conversion, reading 1 means it's not converting
+CONFIG_OS = 0x8000
+# Input multiplexer. Single-ended channels are AINx vs GND, the differential ones use the same
+# numbers as Adafruit's read_adc_difference: 0 = AIN0-AIN1, 1 = AIN0-AIN3, 2 = AIN1-AIN3,
+# 3 = AIN2-AIN3
+MUX_SINGLE = {0: 0x4000, 1: 0x5000, 2: 0x6000, 3: 0x7000}
+MUX_DIFFERENTIAL = {0: 0x0000, 1: 0x1000, 2: 0x2000, 3: 0x3000}
+MUX_MASK = 0x7000
+# Programmable gain, same keys as pressure_gauge.gains
+PGA = {2/3: 0x0000, 1: 0x0200, 2: 0x0400, 4: 0x0600, 8: 0x0800, 16: 0x0A00}
+PGA_MASK = 0x0E00
+# Full scale voltage of each PGA setting
+PGA_VOLTS = {0x0000: 6.144, 0x0200: 4.096, 0x0400: 2.048, 0x0600: 1.024, 0x0800: 0.512,
+             0x0A00: 0.256, 0x0C00: 0.256, 0x0E00: 0.256}
+CONFIG_MODE_SINGLE = 0x0100
+# Data rate in samples per second
+DATA_RATE = {8: 0x0000, 16: 0x0020, 32: 0x0040, 64: 0x0060, 128: 0x0080, 250: 0x00A0,
+             475: 0x00C0, 860: 0x00E0}
+DATA_RATE_MASK = 0x00E0
+# Comparator queue. 00 asserts ALERT/RDY after one conversion, 11 disables the pin
+COMP_QUE_ONE = 0x0000
+COMP_QUE_DISABLE = 0x0003
+COMP_QUE_MASK = 0x0003
+
+def mux_bits(channel, mode):
+    """
+    Returns the multiplexer bits of a channel, mode is "differential" or "single-ended"
+    """
+    if mode == "differential":
+        return MUX_DIFFERENTIAL[channel]
+    return MUX_SINGLE[channel]
+
+def config_word(channel, gain, data_rate, mode, continuous=False, ready_pin=False):
+    """
+    Builds the value of the config register for a channel. In single shot mode the OS bit is set,
+    so that writing the word starts a conversion.
+    """
+    word = mux_bits(channel, mode) | PGA[gain] | DATA_RATE[data_rate]
+    if not continuous:
+        word |= CONFIG_OS | CONFIG_MODE_SINGLE
+    if ready_pin:
+        word |= COMP_QUE_ONE
+    else:
+        word |= COMP_QUE_DISABLE
+    return word
+
+def to_signed(msb, lsb):
+    """
+    Converts the two bytes of the conversion register to a signed integer
+    """
+    value = (msb << 8) | lsb
+    if value & 0x8000:
+        value -= 1 << 16
+    return value
+
+class ADS1115():
+    """
+    Minimal register access to the ADS1115 through an smbus2.SMBus compatible bus
+    """
+    def __init__(self, bus, address=0x48):
+        self.bus = bus
+        self.address = address
+
+    def write_register(self, register, value):
+        self.bus.write_i2c_block_data(self.address, register, [(value >> 8) & 0xFF, value & 0xFF])
+
+    def read_register(self, register):
+        msb, lsb = self.bus.read_i2c_block_data(self.address, register, 2)
+        return (msb << 8) | lsb
+
+    def read_conversion(self):
+        """
+        Reads the last conversion result as signed counts
+        """
+        msb, lsb = self.bus.read_i2c_block_data(self.address, REG_CONVERSION, 2)
+        return to_signed(msb, lsb)
+
+    def enable_ready_pin(self):
+        """
+        Configures the ALERT/RDY pin to pulse at the end of every conversion. This happens when the
+        MSB of the high threshold is 1 and the MSB of the low threshold is 0.
+        """
+        self.write_register(REG_HI_THRESH, 0x8000)
+        self.write_register(REG_LO_THRESH, 0x0000)
+
+class SingleShotADS1115(ADS1115):
+    """
+    Lean single shot driver for the channels used by the ventilator, replacing the hot path of 
+    Adafruit_ADS1x15. The config words are calculated once per channel and gain, the I2C messages
+    are built once and reused, the write of the register pointer and the read are combined in one
+    i2c_rdwr call (repeated start) and the end of the conversion is detected by polling the OS bit,
+    instead of sleeping a fixed time based on the data rate.
+    msg is the module or class that creates the messages, smbus2.i2c_msg or FakeI2CMsg.
+    The duration of every read is stored, see latency_stats.
+    """
+    def __init__(self, bus, msg, address=0x48, data_rate=128, clock=time.perf_counter):
+        super().__init__(bus, address)
+        self.msg = msg
+        self.data_rate = data_rate
+        self.clock = clock
+        # The conversion takes 1 / data_rate +-10% (oscillator tolerance). The bus is shared with
+        # the BME280, so the OS bit is only polled after the shortest possible conversion time,
+        # and after a few periods without the OS bit something is wrong. Between polls it sleeps a
+        # small fraction of the period, so the bus stays free for the other devices.
+        self.min_conversion_time = 0.85 / data_rate
+        self.poll_interval = 0.05 / data_rate
+        self.timeout = 4.0 / data_rate
+        # Cache of the config write messages for each (channel, gain, mode)
+        self.config_msgs = {}
+        # After writing the config, the pointer stays in the config register, so polling the OS bit
+        # is a single read. The conversion is read with the pointer write and the read combined.
+        self.read_config_msg = self.msg.read(self.address, 2)
+        self.pointer_conversion_msg = self.msg.write(self.address, [REG_CONVERSION])
+        self.read_conversion_msg = self.msg.read(self.address, 2)
+        # Latency statistics in s
+        self.last_latency = 0.0
+        self.reads = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.polls = 0
+
+    def config_msg(self, channel, gain, mode):
+        key = (channel, gain, mode)
+        if key not in self.config_msgs:
+            word = config_word(channel, gain, self.data_rate, mode)
+            self.config_msgs[key] = self.msg.write(self.address,
+                                                   [REG_CONFIG, (word >> 8) & 0xFF, word & 0xFF])
+        return self.config_msgs[key]
+
+    def read_counts(self, channel, gain, mode):
+        """
+        Starts a conversion, waits for it to finish and returns the signed counts
+        """
+        start = self.clock()
+        self.bus.i2c_rdwr(self.config_msg(channel, gain, mode))
+        # The conversion starts with the config write, the thread could be preempted before it
+        started = self.clock()
+        time.sleep(self.min_conversion_time)
+        while True:
+            self.bus.i2c_rdwr(self.read_config_msg)
+            self.polls += 1
+            if next(iter(self.read_config_msg)) & 0x80:
+                break
+            if self.clock() - started > self.timeout:
+                raise TimeoutError("The ADS1115 didn't finish the conversion")
+            time.sleep(self.poll_interval)
+        self.bus.i2c_rdwr(self.pointer_conversion_msg, self.read_conversion_msg)
+        msb, lsb = list(self.read_conversion_msg)
+        # Statistics
+        self.last_latency = self.clock() - start
+        self.reads += 1
+        self.total_latency += self.last_latency
+        if self.last_latency > self.max_latency:
+            self.max_latency = self.last_latency
+        return to_signed(msb, lsb)
+
+    def latency_stats(self):
+        """
+        Returns the number of reads, the mean and maximum latency in s and the mean number of polls
+        of the OS bit per read
+        """
+        if self.reads == 0:
+            return {"reads": 0, "mean": 0.0, "max": 0.0, "polls": 0.0}
+        return {"reads": self.reads, "mean": self.total_latency / self.reads,
+                "max": self.max_latency, "polls": self.polls / self.reads}
+
+class GPIOReadyPin():
+    """
+    Source of conversion ready events using the ALERT/RDY pin connected to a GPIO. The pin is
+    active low and pulses at the end of every conversion. The callbacks receive the instant when
+    the edge was detected.
+    """
+    def __init__(self, gpio, pin, clock=time.time):
+        self.gpio = gpio
+        self.pin = pin
+        self.clock = clock
+        self.callbacks = []
+        # The ALERT/RDY output is open drain
+        self.gpio.setup(self.pin, self.gpio.IN, pull_up_down=self.gpio.PUD_UP)
+        self.gpio.add_event_detect(self.pin, self.gpio.FALLING, callback=self.edge)
+
+    def edge(self, pin):
+        t = self.clock()
+        for callback in self.callbacks:
+            callback(t)
+
+    def add_ready_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def remove_ready_callback(self, callback):
+        self.callbacks.remove(callback)
+
+    def close(self):
+        self.gpio.remove_event_detect(self.pin)
+
+class ContinuousAcquisition():
+    """
+    Runs the ADS1115 in continuous conversion mode and alternates the channels following a fixed
+    schedule. Every conversion ready edge reads the result and, if the next slot of the schedule
+    uses another channel, writes the new configuration right away, so the ADC is never idle waiting
+    for the software.
+    channels is a dict of name: (channel, gain, mode, callback), where callback(t, counts) receives
+    the instant of the conversion ready edge and the raw counts. schedule is a list of names, e.g.
+    ["flow", "flow", "pressure"] reads the flow twice as often as the pressure.
+    settle_conversions is the number of conversions discarded after changing the channel, in case
+    the input filter of the sensor needs time after the multiplexer changes.
+    """
+    def __init__(self, chip, ready_source, channels, schedule, data_rate=860,
+                 settle_conversions=0, clock=time.time):
+        self.chip = chip
+        self.ready_source = ready_source
+        self.channels = channels
+        self.schedule = schedule
+        self.data_rate = data_rate
+        self.settle_conversions = settle_conversions
+        self.clock = clock
+        # Config words are calculated only once
+        self.config_words = {name: config_word(ch, gain, data_rate, mode, continuous=True,
+                                               ready_pin=True)
+                             for name, (ch, gain, mode, callback) in channels.items()}
+        self.slot = 0
+        self.settle = 0
+        # Edges detected before the last config write belong to the previous channel
+        self.config_time = 0.0
+        self.running = False
+        # Statistics
+        self.conversions = 0
+        self.discarded = 0
+
+    def start(self):
+        self.chip.enable_ready_pin()
+        self.slot = 0
+        self.write_config(self.schedule[self.slot])
+        self.running = True
+        self.ready_source.add_ready_callback(self.on_ready)
+
+    def stop(self):
+        self.running = False
+        self.ready_source.remove_ready_callback(self.on_ready)
+        # Puts the ADC back in single shot mode, so that it stops converting
+        name = self.schedule[self.slot]
+        ch, gain, mode, callback = self.channels[name]
+        self.chip.write_register(REG_CONFIG, config_word(ch, gain, self.data_rate, mode) &
+                                 ~CONFIG_OS)
+
+    def write_config(self, name):
+        self.chip.write_register(REG_CONFIG, self.config_words[name])
+        self.config_time = self.clock()
+        self.settle = self.settle_conversions
+
+    def on_ready(self, t):
+        """
+        Called at every conversion ready edge
+        """
+        if not self.running or t < self.config_time:
+            return
+        counts = self.chip.read_conversion()
+        if self.settle > 0:
+            self.settle -= 1
+            self.discarded += 1
+            return
+        name = self.schedule[self.slot]
+        # Moves to the next slot and changes the channel before handling the result
+        self.slot = (self.slot + 1) % len(self.schedule)
+        next_name = self.schedule[self.slot]
+        if self.config_words[next_name] != self.config_words[name]:
+            self.write_config(next_name)
+        self.conversions += 1
+        self.channels[name][3](t, counts)
+
+class SimulatedADS1115():
+    """
+    Simulation of the ADS1115 registers in continuous conversion mode, including the ALERT/RDY
+    pulses, so that the acquisition can be tested without the hardware. signals is a dict of
+    multiplexer bits: function(t) returning the input voltage at the instant t.
+    The conversions happen at exact multiples of the data rate period. They can be generated by a
+    thread in real time (start) or one at a time by calling convert(t), e.g. with a virtual clock.
+    Writing the config register restarts the conversion, as in the real chip.
+    """
+    def __init__(self, signals, clock=time.time):
+        self.signals = signals
+        self.clock = clock
+        self.registers = {REG_CONVERSION: 0, REG_CONFIG: 0x8583, REG_LO_THRESH: 0x8000,
+                          REG_HI_THRESH: 0x7FFF}
+        self.callbacks = []
+        self.lock = threading.Lock()
+        # Instant of the start of the current conversion
+        self.conversion_start = self.clock()
+        # End of the single shot conversion in progress, None if there is none
+        self.single_shot_end = None
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    # Register access, same interface as ADS1115
+    def write_register(self, register, value):
+        with self.lock:
+            self.registers[register] = value & 0xFFFF
+            if register == REG_CONFIG:
+                self.conversion_start = self.clock()
+                self.single_shot_end = None
+                if value & CONFIG_MODE_SINGLE and value & CONFIG_OS:
+                    # Starts a single conversion, the OS bit reads 0 until it's done
+                    self.registers[REG_CONFIG] &= ~CONFIG_OS & 0xFFFF
+                    self.single_shot_end = self.conversion_start + self.period
+
+    def read_register(self, register):
+        with self.lock:
+            self.finish_single_shot(self.clock())
+            return self.registers[register]
+
+    def finish_single_shot(self, now):
+        """
+        Stores the result of the single shot conversion if it's already done
+        """
+        if self.single_shot_end is not None and now >= self.single_shot_end:
+            self.registers[REG_CONVERSION] = self.sample(self.single_shot_end) & 0xFFFF
+            self.registers[REG_CONFIG] |= CONFIG_OS
+            self.single_shot_end = None
+
+    def read_conversion(self):
+        value = self.read_register(REG_CONVERSION)
+        if value & 0x8000:
+            value -= 1 << 16
+        return value
+
+    def enable_ready_pin(self):
+        self.write_register(REG_HI_THRESH, 0x8000)
+        self.write_register(REG_LO_THRESH, 0x0000)
+
+    # Ready source, same interface as GPIOReadyPin
+    def add_ready_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def remove_ready_callback(self, callback):
+        self.callbacks.remove(callback)
+
+    @property
+    def continuous(self):
+        return not self.registers[REG_CONFIG] & CONFIG_MODE_SINGLE
+
+    @property
+    def ready_pin_enabled(self):
+        return ((self.registers[REG_CONFIG] & COMP_QUE_MASK) != COMP_QUE_DISABLE
+                and self.registers[REG_HI_THRESH] & 0x8000
+                and not self.registers[REG_LO_THRESH] & 0x8000)
+
+    @property
+    def period(self):
+        config = self.registers[REG_CONFIG]
+        for rate, bits in DATA_RATE.items():
+            if config & DATA_RATE_MASK == bits:
+                return 1.0 / rate
+
+    def next_conversion_time(self):
+        return self.conversion_start + self.period
+
+    def sample(self, t):
+        """
+        Converts the input voltage at the instant t to counts, using the current configuration
+        """
+        config = self.registers[REG_CONFIG]
+        full_scale = PGA_VOLTS[config & PGA_MASK]
+        counts = int(round(self.signals[config & MUX_MASK](t) / full_scale * 32768))
+        return min(max(counts, -32768), 32767)
+
+    def convert(self, t):
+        """
+        Finishes the conversion that ends at the instant t and pulses ALERT/RDY
+        """
+        with self.lock:
+            self.registers[REG_CONVERSION] = self.sample(t) & 0xFFFF
+            self.conversion_start = t
+            ready = self.ready_pin_enabled
+        if ready:
+            for callback in self.callbacks:
+                callback(t)
+
+    def start(self):
+        """
+        Starts a thread that runs the conversions in real time while in continuous mode
+        """
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.work, daemon=True)
+        self.thread.start()
+
+    def work(self):
+        while not self.stop_event.is_set():
+            t = self.next_conversion_time()
+            delay = t - self.clock()
+            if delay > 0:
+                # Checks again after waiting, since writing the config restarts the conversion
+                self.stop_event.wait(delay)
+                continue
+            if self.continuous:
+                self.convert(t)
+            else:
+                # Nothing to convert, just follows the clock
+                with self.lock:
+                    self.conversion_start = t
+
+    def stop(self):
+        self.stop_event.set()
+
+class FakeI2CMsg():
+    """
+    Replacement of smbus2.i2c_msg for FakeSMBus
+    """
+    def __init__(self, address, read, data):
+        self.addr = address
+        self.is_read = read
+        self.buf = list(data)
+        self.len = len(self.buf)
+
+    @classmethod
+    def write(cls, address, data):
+        return cls(address, False, data)
+
+    @classmethod
+    def read(cls, address, length):
+        return cls(address, True, [0] * length)
+
+    def __iter__(self):
+        return iter(self.buf)
+
+class FakeSMBus():
+    """
+    Replacement of smbus2.SMBus connected to a SimulatedADS1115, so that the drivers can be
+    unit-tested and benchmarked without the hardware. Keeps the register pointer like the real
+    chip. transaction_time is added to every transaction, to emulate the time spent on the bus
+    (e.g. ~0.1 ms for a few bytes at 400 kHz).
+    """
+    def __init__(self, chip, transaction_time=0.0):
+        self.chip = chip
+        self.transaction_time = transaction_time
+        self.pointer = REG_CONVERSION
+        self.transactions = 0
+
+    def transaction(self):
+        self.transactions += 1
+        if self.transaction_time > 0:
+            # Busy wait, sleep isn't precise enough for fractions of a ms
+            end = time.perf_counter() + self.transaction_time
+            while time.perf_counter() < end:
+                pass
+
+    def write(self, data):
+        self.pointer = data[0]
+        if len(data) == 3:
+            self.chip.write_register(self.pointer, (data[1] << 8) | data[2])
+
+    def read(self):
+        value = self.chip.read_register(self.pointer)
+        return [(value >> 8) & 0xFF, value & 0xFF]
+
+    def write_i2c_block_data(self, address, register, data):
+        self.transaction()
+        self.write([register] + list(data))
+
+    def read_i2c_block_data(self, address, register, length):
+        self.transaction()
+        self.pointer = register
+        return self.read()
+
+    def i2c_rdwr(self, *msgs):
+        self.transaction()
+        for msg in msgs:
+            if msg.is_read:
+                msg.buf = self.read()
+            else:
+                self.write(msg.buf)
+
+    def close(self):
+        pass
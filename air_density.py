@@ -0,0 +1,98 @@
+"""
+Density of the ambient air, used to convert the pressure difference of the orifice to flow
+"""
+import threading
+import time
+
+def humid_air_density(temperature, pressure, humidity):
+    """
+    Calculates the density of humid air (Kg/m³) from the temperature (°C), pressure (mbar) and
+    relative humidity (%).
+    The equation used to calculate the density of air was taken from wikipedia's article,
+    and it is from https://wahiduddin.net/calc/density_altitude.htm - An Introduction fo Air
+    Density and Density Altitude Calculations by Richard Shelquist, 2019
+    """
+    T = temperature + 273.15  # Temperature in Kelvin
+    P = pressure * 100  # Pressure in Pa
+    R = 8.31446  # Universal gas constant in J/(K.Mol)
+    M_d = 0.0289652  # Molar mass of dry air in Kg/Mol
+    M_v = 0.018016  # Molar mass of water vapor in Kg/Mol
+
+    # Saturation vapor pressure of water (Tetens' equation) (uses temperatures in C!)
+    P_sat = 610.78 * 10 ** (7.5 * temperature / (temperature + 237.3))  # in Pa
+    phi = humidity / 100  # Relative umidity varying from 0-1
+    P_v = phi * P_sat  # Vapor pressure of water in Pa
+    P_d = P - P_v  # partial pressure of dry air in Pa
+
+    return (P_d * M_d + P_v * M_v) / (R * T)
+
+class AirDensity():
+    """
+    Keeps a cached value of the air density, refreshed by a background thread at a low rate.
+    The ambient temperature and humidity change over minutes, so there is no reason to make a full
+    BME280 transaction (on the same I2C bus as the ADC) for every flow sample. The flow calculation
+    only reads "value", which is a plain attribute.
+    """
+    # Density of dry air at 20 °C and 1013.25 mbar, used until the first measurement
+    default_density = 1.2041  # Kg/m³
+
+    def __init__(self, sensor, period=10.0, max_age=60.0):
+        # Any object with a get_air_density() method, e.g. the bme class
+        self.sensor = sensor
+        # Interval between measurements in s
+        self.period = period
+        # The value is considered stale if it wasn't refreshed during max_age seconds
+        self.max_age = max_age
+        self.value = self.default_density
+        # Instant of the last successful measurement. Zero means it was never measured
+        self.timestamp = 0.0
+        self.warned_stale = False
+
+        # The first measurement is done right away, so that the flow starts with a valid density
+        self.refresh()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.work, daemon=True)
+        self.thread.start()
+
+    def refresh(self):
+        """
+        Reads the sensor and updates the cached value. If the reading fails, keeps the old value.
+        Any error of the driver or of the conversion is caught, so the background thread keeps
+        trying and the value becomes stale instead of freezing.
+        """
+        try:
+            density = self.sensor.get_air_density()
+        except Exception as error:
+            print(f"Could not read the air density: {error!r}")
+            return
+        # The value and the timestamp are replaced as a whole, no lock is needed to read them
+        self.value = density
+        self.timestamp = time.time()
+        self.warned_stale = False
+
+    @property
+    def age(self):
+        """
+        Time since the last successful measurement in s
+        """
+        return time.time() - self.timestamp
+
+    @property
+    def stale(self):
+        """
+        True if the cached value is older than max_age
+        """
+        return self.age > self.max_age
+
+    def work(self):
+        """
+        Refreshes the cached value every period until stop() is called
+        """
+        while not self.stop_event.wait(self.period):
+            self.refresh()
+            if self.stale and not self.warned_stale:
+                print(f"The air density is stale, last measured {self.age:.0f} s ago")
+                self.warned_stale = True
+
+    def stop(self):
+        self.stop_event.set()
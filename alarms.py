@@ -0,0 +1,263 @@
+"""
+Evaluation of the alarms configured in the Alarms tab
+"""
+from collections import namedtuple
+import math
+import threading
+from clock import system_clock
+
+# Priorities of the alarms, the annunciation follows the highest unacknowledged one
+LOW = 0
+MEDIUM = 1
+HIGH = 2
+
+# State of one alarm sent to the interface:
+# - name: key of the alarm, e.g. "paw_high"
+# - message: text shown to the user
+# - priority: MEDIUM or HIGH
+# - active: whether the condition is still present
+# - acknowledged: whether the user silenced it
+# - since: instant when it was raised (s)
+# - value: value that raised it, in the units of the Alarms tab
+AlarmStatus = namedtuple("AlarmStatus", ["name", "message", "priority", "active", "acknowledged",
+                                         "since", "value"])
+
+# Alarms: (name, switch of the Alarms tab, message, priority)
+ALARMS = [("paw_high", "paw", "Paw alta", HIGH),
+          ("flow_high", "flow", "Fluxo alto", HIGH),
+          ("apnea", "apnea", "Apneia", HIGH),
+          ("paw_low", "paw", "Paw baixa", HIGH),
+          ("flow_low", "flow", "Fluxo baixo", MEDIUM),
+          ("tidal_volume_low", "tidal_volume", "Volume corrente baixo", MEDIUM),
+          ("tidal_volume_high", "tidal_volume", "Volume corrente alto", MEDIUM),
+          ("volume_minute_low", "volume_minute", "Volume minuto baixo", MEDIUM),
+          ("volume_minute_high", "volume_minute", "Volume minuto alto", MEDIUM),
+          ("plateau_pressure_low", "plateau_pressure", "Pressao de plato baixa", MEDIUM),
+          ("plateau_pressure_high", "plateau_pressure", "Pressao de plato alta", MEDIUM),
+          ("PEEP_low", "PEEP", "PEEP baixa", MEDIUM),
+          ("PEEP_high", "PEEP", "PEEP alta", MEDIUM),
+          ("frequency_low", "frequency", "Frequencia baixa", MEDIUM),
+          ("frequency_high", "frequency", "Frequencia alta", MEDIUM)]
+
+# Limits checked at the end of every breath: (metric, switch of the Alarms tab). The metric is
+# compared with the min and max spinboxes, the names of the alarms are switch + "_low"/"_high"
+BREATH_LIMITS = [("peak_pressure", "paw"),
+                 ("peak_flow", "flow"),
+                 ("tidal_volume", "tidal_volume"),
+                 ("minute_volume", "volume_minute"),
+                 ("plateau_pressure", "plateau_pressure"),
+                 ("PEEP", "PEEP"),
+                 ("respiratory_rate", "frequency")]
+
+class Alarm():
+    """
+    Mutable state of one alarm, only changed by the AlarmEngine
+    """
+    __slots__ = ("name", "message", "priority", "active", "latched", "acknowledged", "since",
+                 "value")
+
+    def __init__(self, name, message, priority):
+        self.name = name
+        self.message = message
+        self.priority = priority
+        self.clear()
+
+    def clear(self):
+        self.active = False
+        self.latched = False
+        self.acknowledged = False
+        self.since = None
+        self.value = None
+
+    def status(self):
+        return AlarmStatus(self.name, self.message, self.priority, self.active, self.acknowledged,
+                           self.since, self.value)
+
+class AlarmEngine():
+    """
+    Compares the measurements with the limits of the Alarms tab, read from the SettingsStore
+    ("al_<name>_min_spb", "al_<name>_max_spb" and the switch "al_<name>_chkBox"). It runs in the
+    pipeline thread, at the rate of the data, instead of a GUI timer:
+    - check_sample, called with every sample (sample callback of the SamplePipeline), checks the
+      limits that can't wait for the end of the breath: maximum Paw, maximum |flow| and the apnea
+      time, al_apnea_max_spb seconds without the start of a breath
+    - check_breath, called with the metrics of every breath (metrics callback of BreathMetrics),
+      checks the minimum Paw (peak pressure, e.g. a disconnection), the minimum peak flow and both
+      limits of the tidal volume, minute volume, plateau pressure, PEEP and frequency
+    - breath_started, called with every BreathRecord (breath callback), restarts the apnea time
+    The alarms latch: they stay in the list after the condition goes away, until the user
+    acknowledges them. An acknowledged alarm that is still active is silenced until it clears and
+    is raised again. Disabling the switch clears the alarm.
+    The callbacks receive the list of AlarmStatus of the latched alarms whenever it changes, from
+    the thread where the change happened.
+    The detection latency is the time between the sample, or the end of the breath, that violates
+    a limit and the raise of the alarm. For the apnea, it's counted from the instant the apnea time
+    ran out. The worst case is kept for each kind of check and a warning is logged if it's above
+    latency_target.
+    The work per sample is constant, a few comparisons with limits cached per settings version.
+    """
+    def __init__(self, settings, clock=system_clock, latency_target=0.05, log=print):
+        self.settings = settings
+        self.clock = clock
+        self.latency_target = latency_target
+        self.log = log
+        self.alarms = {name: Alarm(name, message, priority)
+                       for name, _, message, priority in ALARMS}
+        # Switch of each alarm
+        self.switches = {name: switch for name, switch, _, _ in ALARMS}
+        self.alarm_callbacks = []
+        # Serializes the changes of state, made by the pipeline thread and by the acknowledge of
+        # the GUI thread. The checks without a change don't take it
+        self.lock = threading.Lock()
+        self.snapshot = None
+        # Start of the last breath, or of the monitoring, for the apnea
+        self.last_breath = None
+        # Detection latency: kind of check: [count, sum, max]
+        self.latency = {"sample": [0, 0.0, 0.0], "breath": [0, 0.0, 0.0], "apnea": [0, 0.0, 0.0]}
+        self.latency_warned = False
+
+    def add_alarm_callback(self, callback):
+        self.alarm_callbacks.append(callback)
+
+    def limits(self):
+        """
+        Returns the snapshot of the settings, updating the cached limits when a new version is
+        published. A disabled limit is None.
+        """
+        snapshot = self.settings.current
+        if snapshot is not self.snapshot:
+            self.snapshot = snapshot
+            self.enabled = {switch: bool(snapshot.get(f"al_{switch}_chkBox", False))
+                            for switch in set(self.switches.values())}
+            self.minimum = {}
+            self.maximum = {}
+            for switch, enabled in self.enabled.items():
+                self.minimum[switch] = snapshot.get(f"al_{switch}_min_spb") if enabled else None
+                self.maximum[switch] = snapshot.get(f"al_{switch}_max_spb") if enabled else None
+            # The disabled alarms are cleared
+            changed = False
+            with self.lock:
+                for alarm in self.alarms.values():
+                    if not self.enabled[self.switches[alarm.name]] and alarm.latched:
+                        alarm.clear()
+                        changed = True
+            if changed:
+                self.notify()
+        return snapshot
+
+    def check_sample(self, t, pressure, flow):
+        """
+        Checks the sample of the instant t: pressure (cm H2O) and flow (l/min)
+        """
+        self.limits()
+        maximum = self.maximum
+        if self.last_breath is None:
+            self.last_breath = t
+        paw_max = maximum["paw"]
+        if paw_max is not None:
+            self.update("paw_high", pressure > paw_max, t, pressure, "sample")
+        flow_max = maximum["flow"]
+        if flow_max is not None:
+            self.update("flow_high", abs(flow) > flow_max, t, flow, "sample")
+        apnea_max = maximum["apnea"]
+        if apnea_max is not None:
+            apnea = t - self.last_breath
+            self.update("apnea", apnea > apnea_max, self.last_breath + apnea_max, apnea, "apnea")
+
+    def breath_started(self, record):
+        """
+        Restarts the apnea time with the start of the breath that follows the record
+        """
+        self.last_breath = record.end
+
+    def check_breath(self, metrics):
+        """
+        Checks the metrics of the breath that ended (see BreathMetrics)
+        """
+        self.limits()
+        t = metrics["breath_end"]
+        for metric, switch in BREATH_LIMITS:
+            value = metrics[metric]
+            if value is None or math.isnan(value):
+                continue
+            low, high = self.minimum[switch], self.maximum[switch]
+            if low is not None:
+                self.update(f"{switch}_low", value < low, t, value, "breath")
+            if high is not None and switch not in ("paw", "flow"):
+                # The maximum Paw and flow are checked at every sample
+                self.update(f"{switch}_high", value > high, t, value, "breath")
+
+    def update(self, name, condition, t, value, kind):
+        """
+        Sets the condition of the alarm, detected with the data of the instant t
+        """
+        alarm = self.alarms[name]
+        if condition == alarm.active:
+            if condition:
+                alarm.value = value
+            return
+        with self.lock:
+            alarm.active = condition
+            if condition:
+                alarm.latched = True
+                alarm.acknowledged = False
+                alarm.since = t
+                alarm.value = value
+        if condition:
+            self.add_latency(kind, self.clock.time() - t)
+        self.notify()
+
+    def add_latency(self, kind, latency):
+        stats = self.latency[kind]
+        stats[0] += 1
+        stats[1] += latency
+        if latency > stats[2]:
+            stats[2] = latency
+        if latency > self.latency_target and not self.latency_warned:
+            self.latency_warned = True
+            self.log(f"Alarm detection latency of {1000 * latency:.1f} ms ({kind}), above the "
+                     f"target of {1000 * self.latency_target:.1f} ms")
+
+    def latency_stats(self):
+        """
+        Returns the mean and maximum detection latency (s) and the number of raises of each kind
+        of check
+        """
+        return {kind: {"raised": count, "mean": total / count if count else math.nan,
+                       "max": worst if count else math.nan}
+                for kind, (count, total, worst) in self.latency.items()}
+
+    def acknowledge(self):
+        """
+        Silences the active alarms and removes the ones that aren't active anymore
+        """
+        with self.lock:
+            for alarm in self.alarms.values():
+                if alarm.latched:
+                    if alarm.active:
+                        alarm.acknowledged = True
+                    else:
+                        alarm.clear()
+        self.notify()
+
+    def status(self):
+        """
+        Returns the AlarmStatus of the latched alarms, by priority and then by age
+        """
+        with self.lock:
+            latched = [alarm.status() for alarm in self.alarms.values() if alarm.latched]
+        return sorted(latched, key=lambda status: (-status.priority, status.since))
+
+    def annunciation(self):
+        """
+        Returns the priority of the sound and light signal: the highest priority of the latched
+        alarms that weren't acknowledged, LOW if there is none
+        """
+        priorities = [status.priority for status in self.status() if not status.acknowledged]
+        return max(priorities, default=LOW)
+
+    def notify(self):
+        if self.alarm_callbacks:
+            status = self.status()
+            for callback in self.alarm_callbacks:
+                callback(status)
@@ -0,0 +1,54 @@
+"""
+Selection of the backend that implements the IO classes used by the ventilator: pressure_gauge,
+bme, pneumatic_piston, buttons, buzzer and led.
+The backend modules are imported only when they are selected, so the drivers of the real hardware
+(RPi GPIO, ADS1115, BME280) are never imported when the simulated backend is used, e.g. on a
+development computer or on CI.
+"""
+import configparser
+import importlib
+import os
+
+# Names of the classes that every backend must define
+IO_CLASSES = ("pressure_gauge", "bme", "pneumatic_piston", "buttons", "buzzer", "led")
+
+# Backend name: module that implements it
+BACKENDS = {"hardware": "hardware",
+            "simulated": "simulated",
+            "replay": "replay"}
+
+# Environment variable that overrides the backend selected in the configuration file
+ENV_VAR = "VENTILADOR_BACKEND"
+
+def register_backend(name, module_name):
+    """
+    Adds a backend to the registry. The module is only imported when the backend is loaded.
+    """
+    BACKENDS[name] = module_name
+
+def backend_name(conf_file="config_file.conf"):
+    """
+    Returns the name of the selected backend. The environment variable has priority over the
+    [Hardware] section of the configuration file and the default is the real hardware.
+    """
+    if os.environ.get(ENV_VAR):
+        return os.environ[ENV_VAR]
+    conf = configparser.ConfigParser()
+    conf.read(conf_file)
+    if conf.has_section("Hardware"):
+        return conf["Hardware"].get("backend", "hardware")
+    return "hardware"
+
+def load_backend(name=None):
+    """
+    Imports and returns the module of the backend. If the name is not given, uses backend_name().
+    """
+    if name is None:
+        name = backend_name()
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend '{name}', the options are: {', '.join(BACKENDS)}")
+    module = importlib.import_module(BACKENDS[name])
+    missing = [cls for cls in IO_CLASSES if not hasattr(module, cls)]
+    if missing:
+        raise ImportError(f"The backend '{name}' doesn't define {', '.join(missing)}")
+    return module
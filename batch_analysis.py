@@ -0,0 +1,253 @@
+"""
+Offline analysis of many recorded sessions, e.g. collected from several units, in a process pool:
+
+python batch_analysis.py collected_sessions --out analysis
+python batch_analysis.py collected_sessions --out analysis --workers 8 --set al_paw_max_spb=35
+
+Every session found in the directory and its subdirectories is segmented in breaths, with the
+metrics of each one, and the alarms are evaluated again with the limits of the configuration
+file, changed by the settings recorded in the session. For each session, a table of the breaths
+(<session>_breaths.csv) and of the alarms raised (<session>_alarms.csv) are written to the output
+directory, in the same subdirectory, and a summary of all the sessions to summary.csv.
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import configparser
+import glob
+import math
+import os
+import time
+import numpy as np
+from alarms import ALARMS, AlarmEngine
+from clock import VirtualClock
+from recorder import RECORDS_EXTENSION
+from session_reader import Session, breath_metrics, format_time, list_sessions
+from settings import SettingsStore, parse_assignments
+
+# Columns of the table of breaths: (metric, format)
+BREATH_COLUMNS = [("breath_number", "%d"),
+                  ("breath_start", "%.3f"),
+                  ("breath_end", "%.3f"),
+                  ("peak_pressure", "%.2f"),
+                  ("plateau_pressure", "%.2f"),
+                  ("PEEP", "%.2f"),
+                  ("peak_flow", "%.1f"),
+                  ("tidal_volume_insp", "%.0f"),
+                  ("tidal_volume_exp", "%.0f"),
+                  ("minute_volume", "%.2f"),
+                  ("respiratory_rate", "%.2f"),
+                  ("breath_IE_ratio", "%.2f"),
+                  ("compliance", "%.1f"),
+                  ("resistance", "%.1f")]
+# Metrics summarized for each session, by the median and the 5th and 95th percentiles
+SUMMARY_METRICS = ("tidal_volume_insp", "peak_pressure", "PEEP", "respiratory_rate",
+                   "minute_volume")
+
+def alarm_settings(conf):
+    """
+    Returns the settings of the Alarms tab at the start of a session, from the [Alarms] section of
+    the configuration, as loaded by the GUI
+    """
+    alarms = conf["Alarms"]
+    settings = {}
+    for switch in sorted({switch for _, switch, _, _ in ALARMS}):
+        settings[f"al_{switch}_chkBox"] = alarms.getboolean(f"{switch}_on", False)
+        settings[f"al_{switch}_min_spb"] = alarms.getfloat(f"{switch}_min", 0.0)
+        settings[f"al_{switch}_max_spb"] = alarms.getfloat(f"{switch}_max", math.inf)
+    return settings
+
+def find_sessions(directory):
+    """
+    Returns the prefixes of the sessions in the directory and its subdirectories
+    """
+    prefixes = []
+    for path, _, files in os.walk(directory):
+        if any(name.endswith(RECORDS_EXTENSION) for name in files):
+            prefixes += list_sessions(path)
+    return sorted(prefixes)
+
+def session_paths(prefix):
+    return glob.glob(prefix + "_[0-9][0-9][0-9][0-9]" + RECORDS_EXTENSION)
+
+class SettingsReplay():
+    """
+    Publishes the changes of the settings recorded in the session when the samples reach their
+    instants (sample callback)
+    """
+    def __init__(self, store, events):
+        self.store = store
+        self.events = [event for event in events if event["kind"] == "setting"]
+        self.next = 0
+        self.next_t = self.events[0]["t"] if self.events else math.inf
+
+    def __call__(self, t, pressure, flow):
+        if t < self.next_t:
+            return
+        while self.next < len(self.events) and self.events[self.next]["t"] <= t:
+            event = self.events[self.next]
+            self.store.set(event["name"], event["value"])
+            self.next += 1
+        self.next_t = self.events[self.next]["t"] if self.next < len(self.events) else math.inf
+
+class AlarmLog():
+    """
+    Keeps the alarms raised (alarm callback): (instant, name, value)
+    """
+    def __init__(self):
+        self.raised = []
+        self.active = set()
+
+    def __call__(self, status):
+        active = set()
+        for alarm in status:
+            if alarm.active:
+                active.add(alarm.name)
+                if alarm.name not in self.active:
+                    self.raised.append((alarm.since, alarm.name, alarm.value))
+        self.active = active
+
+def analyze_session(prefix, directory, out, settings, volume_calibration=5.0, threshold=2.0):
+    """
+    Analyzes one session, in a process of the pool: writes its tables and returns its summary.
+    The segments are mapped in memory and read in chunks, so the memory doesn't depend on the
+    length of the session.
+    """
+    start_time = time.perf_counter()
+    session = Session(session_paths(prefix))
+    name = os.path.relpath(prefix, directory)
+    # The alarms run in the virtual time of the samples, their latency isn't meaningful offline
+    clock = VirtualClock(session.start)
+    store = SettingsStore(settings)
+    engine = AlarmEngine(store, clock, log=lambda message: None)
+    log = AlarmLog()
+    engine.add_alarm_callback(log)
+
+    def check_sample(t, pressure, flow):
+        clock.set(t)
+        engine.check_sample(t, pressure, flow)
+
+    rows = []
+    for metrics in breath_metrics(session.chunks(), volume_calibration, threshold,
+                                  [SettingsReplay(store, session.events()), check_sample],
+                                  [engine.breath_started]):
+        engine.check_breath(metrics)
+        rows.append(tuple(metrics[column] for column, _ in BREATH_COLUMNS))
+
+    path = os.path.join(out, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    table = np.array(rows, dtype=np.float64).reshape(-1, len(BREATH_COLUMNS))
+    np.savetxt(path + "_breaths.csv", table, delimiter=",",
+               fmt=[fmt for _, fmt in BREATH_COLUMNS],
+               header=",".join(column for column, _ in BREATH_COLUMNS), comments="")
+    with open(path + "_alarms.csv", "w") as alarms_file:
+        alarms_file.write("t,name,value\n")
+        for t, alarm, value in log.raised:
+            alarms_file.write(f"{t:.3f},{alarm},{value:.2f}\n")
+
+    summary = {"session": name,
+               "start": session.start,
+               "hours": (session.end - session.start) / 3600 if session.segments else 0.0,
+               "samples": session.count,
+               "breaths": len(rows),
+               "wall_time": time.perf_counter() - start_time}
+    for metric in SUMMARY_METRICS:
+        values = table[:, [column for column, _ in BREATH_COLUMNS].index(metric)]
+        values = values[np.isfinite(values)]
+        for label, q in (("p5", 5), ("median", 50), ("p95", 95)):
+            summary[f"{metric}_{label}"] = (float(np.percentile(values, q)) if len(values)
+                                            else math.nan)
+    raised = [alarm for _, alarm, _ in log.raised]
+    for alarm, _, _, _ in ALARMS:
+        summary[f"alarms_{alarm}"] = raised.count(alarm)
+    return summary
+
+def analyze(directory, out, settings, workers=None, volume_calibration=5.0, threshold=2.0,
+            progress=print):
+    """
+    Analyzes all the sessions of the directory in a process pool and returns their summaries, in
+    the order of the sessions. The longest sessions are submitted first, so a long one doesn't
+    start at the end and leave the other processes idle.
+    """
+    prefixes = find_sessions(directory)
+    sizes = {prefix: sum(os.path.getsize(path) for path in session_paths(prefix))
+             for prefix in prefixes}
+    summaries = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(analyze_session, prefix, directory, out, settings,
+                                   volume_calibration, threshold): prefix
+                   for prefix in sorted(prefixes, key=sizes.get, reverse=True)}
+        for future in as_completed(futures):
+            summary = future.result()
+            summaries[futures[future]] = summary
+            progress(f"{summary['session']}: {summary['hours']:.2f} h, {summary['breaths']} "
+                     f"breaths in {summary['wall_time']:.1f} s")
+    return [summaries[prefix] for prefix in prefixes]
+
+def write_summary(summaries, path):
+    columns = list(summaries[0])
+    with open(path, "w") as summary_file:
+        summary_file.write(",".join(columns) + "\n")
+        for summary in summaries:
+            summary_file.write(",".join(f"{summary[column]:.6g}"
+                                        if isinstance(summary[column], float)
+                                        else str(summary[column]) for column in columns) + "\n")
+
+def print_aggregate(summaries, elapsed):
+    """
+    Prints the totals of all the sessions
+    """
+    hours = sum(summary["hours"] for summary in summaries)
+    breaths = sum(summary["breaths"] for summary in summaries)
+    samples = sum(summary["samples"] for summary in summaries)
+    print(f"{len(summaries)} sessions, {hours:.1f} h, {breaths} breaths, {samples} samples in "
+          f"{elapsed:.1f} s ({samples / elapsed:.0f} samples/s, "
+          f"{3600 * hours / elapsed:.0f}x real time)")
+    starts = [summary["start"] for summary in summaries if summary["samples"]]
+    if starts:
+        print(f"Sessions from {format_time(min(starts))} to {format_time(max(starts))}")
+    for metric in SUMMARY_METRICS:
+        # Median of the sessions, weighted by their breaths
+        values = [(summary[f"{metric}_median"], summary["breaths"]) for summary in summaries
+                  if summary["breaths"] and not math.isnan(summary[f"{metric}_median"])]
+        if values:
+            medians, weights = zip(*values)
+            print(f"  {metric}: {np.average(medians, weights=weights):.2f} (range of the "
+                  f"sessions {min(medians):.2f} to {max(medians):.2f})")
+    for alarm, _, message, _ in ALARMS:
+        raised = [summary[f"alarms_{alarm}"] for summary in summaries]
+        if sum(raised):
+            print(f"  {message}: raised {sum(raised)} times in "
+                  f"{sum(1 for count in raised if count)} sessions")
+
+def main(argv=None):
+    conf = configparser.ConfigParser()
+    conf.read("config_file.conf")
+    for section in ("Config", "Alarms"):
+        if not conf.has_section(section):
+            conf.add_section(section)
+    parser = argparse.ArgumentParser(description="Analyzes the recorded sessions in parallel")
+    parser.add_argument("directory", help="directory with the sessions, also in subdirectories")
+    parser.add_argument("--out", default="analysis", help="directory of the tables")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="processes of the pool, by default one per core")
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE",
+                        help="alarm setting at the start of the sessions, e.g. al_paw_max_spb=35")
+    parser.add_argument("--volume-calibration", type=float,
+                        default=conf["Config"].getfloat("volume_calibration", 5.0))
+    parser.add_argument("--breath-threshold", type=float,
+                        default=conf["Config"].getfloat("breath_flow_threshold", 2.0))
+    args = parser.parse_args(argv)
+
+    settings = dict(alarm_settings(conf), **parse_assignments(args.set))
+    start = time.perf_counter()
+    summaries = analyze(args.directory, args.out, settings, args.workers,
+                        args.volume_calibration, args.breath_threshold)
+    if not summaries:
+        print(f"There are no sessions in {args.directory}")
+        return
+    os.makedirs(args.out, exist_ok=True)
+    write_summary(summaries, os.path.join(args.out, "summary.csv"))
+    print_aggregate(summaries, time.perf_counter() - start)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Compares the time per sample and the bus transactions per sample of the ADS1115 single shot read
+done like Adafruit_ADS1x15 (config write, fixed sleep, read) with SingleShotADS1115 (cached
+messages, polling of the OS bit), both using the simulated chip and FakeSMBus.
+The simulated conversions take exactly the nominal period, so the latencies are close: the fixed
+sleep is only 0.1 ms longer. Polling matters with a real chip, whose conversion can take 10% more
+than the nominal period, when the fixed sleep may read the previous result.
+Run from the root of the repository: python -m benchmarks.bench_ads1115
+"""
+import time
+from ads1115 import (CONFIG_OS, FakeI2CMsg, FakeSMBus, MUX_DIFFERENTIAL, MUX_SINGLE, REG_CONFIG,
+                     REG_CONVERSION, SimulatedADS1115, SingleShotADS1115, config_word, to_signed)
+
+# Time of a short transaction at 400 kHz
+TRANSACTION_TIME = 100e-6
+
+def adafruit_like_read(bus, channel, gain, mode, data_rate):
+    """
+    Same sequence of operations as Adafruit_ADS1x15.ADS1x15._read
+    """
+    word = config_word(channel, gain, data_rate, mode)
+    bus.write_i2c_block_data(0x48, REG_CONFIG, [(word >> 8) & 0xFF, word & 0xFF])
+    time.sleep(1.0 / data_rate + 0.0001)
+    msb, lsb = bus.read_i2c_block_data(0x48, REG_CONVERSION, 2)
+    return to_signed(msb, lsb)
+
+def run(data_rate, n=200):
+    chip = SimulatedADS1115({MUX_SINGLE[0]: lambda t: 1.0, MUX_DIFFERENTIAL[3]: lambda t: 0.03},
+                            clock=time.perf_counter)
+    bus = FakeSMBus(chip, TRANSACTION_TIME)
+    start = time.perf_counter()
+    for i in range(n):
+        adafruit_like_read(bus, 0, 2/3, "single-ended", data_rate)
+        adafruit_like_read(bus, 3, 16, "differential", data_rate)
+    adafruit = (time.perf_counter() - start) / (2 * n)
+    adafruit_transactions = bus.transactions / (2 * n)
+
+    bus = FakeSMBus(chip, TRANSACTION_TIME)
+    adc = SingleShotADS1115(bus, FakeI2CMsg, data_rate=data_rate)
+    for i in range(n):
+        adc.read_counts(0, 2/3, "single-ended")
+        adc.read_counts(3, 16, "differential")
+    stats = adc.latency_stats()
+    print(f"{data_rate:4d} SPS | adafruit-like: {1000 * adafruit:.3f} ms/sample "
+          f"({adafruit_transactions:.1f} transactions) | lean: {1000 * stats['mean']:.3f} "
+          f"ms/sample (max {1000 * stats['max']:.3f} ms, {stats['polls']:.1f} polls, "
+          f"{bus.transactions / stats['reads']:.1f} transactions)")
+
+if __name__ == "__main__":
+    for data_rate in [128, 250, 475, 860]:
+        run(data_rate)
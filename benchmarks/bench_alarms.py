@@ -0,0 +1,85 @@
+"""
+Measures the cost of the alarm evaluation per sample, alone and with the rest of the pipeline
+(segmentation, metrics), with all the alarms enabled and limits that are crossed in every breath,
+and compares it with the period of the sensors. The detection latency of the engine is the time
+between the stamp of the sample and the raise; in the worst case an alarm is detected one sample
+period plus this latency after the limit is crossed.
+Run from the root of the repository: python -m benchmarks.bench_alarms
+"""
+import math
+import time
+import numpy as np
+from alarms import AlarmEngine
+from pipeline import SamplePipeline
+from settings import SettingsStore
+
+SWITCHES = ["tidal_volume", "volume_minute", "flow", "paw", "plateau_pressure", "PEEP",
+            "frequency", "apnea"]
+# Limits crossed by the waveform below, so the alarms are raised and cleared all the time
+LIMITS = {"tidal_volume": (400, 450), "volume_minute": (5, 6), "flow": (10, 25),
+          "paw": (10, 18), "plateau_pressure": (5, 15), "PEEP": (6, 8), "frequency": (10, 20),
+          "apnea": (0, 10)}
+
+def settings():
+    values = {}
+    for switch in SWITCHES:
+        values[f"al_{switch}_chkBox"] = True
+        values[f"al_{switch}_min_spb"], values[f"al_{switch}_max_spb"] = LIMITS[switch]
+    return SettingsStore(values)
+
+def waveform(t):
+    """
+    Breath of 3 s, 1 s of inspiration with a sine flow of up to 30 l/min
+    """
+    phase = t % 3.0
+    if phase < 1.0:
+        flow = 30 * math.sin(math.pi * phase)
+    else:
+        flow = -15 * math.sin(math.pi * (phase - 1.0) / 2.0)
+    pressure = 5 + 15 * max(flow, 0) / 30
+    return pressure, flow
+
+def run(rate, duration=120.0):
+    n = int(rate * duration)
+    samples = [(i / rate,) + waveform(i / rate) for i in range(n)]
+
+    # Engine alone
+    engine = AlarmEngine(settings(), log=lambda message: None)
+    costs = np.empty(n)
+    for i, (t, pressure, flow) in enumerate(samples):
+        start = time.perf_counter()
+        engine.check_sample(t, pressure, flow)
+        costs[i] = time.perf_counter() - start
+    start = time.perf_counter()
+    for i in range(1000):
+        engine.check_breath({"breath_end": i, "peak_pressure": 20, "peak_flow": 30,
+                             "tidal_volume": 500 * (i % 2), "minute_volume": 5.5,
+                             "plateau_pressure": 16, "PEEP": 5, "respiratory_rate": 20})
+    breath = (time.perf_counter() - start) / 1000
+
+    # Whole pipeline, stamped with the real time so the engine measures its detection latency
+    pipeline = SamplePipeline(1000, time.time(), volume_calibration=1.0)
+    engine = AlarmEngine(settings(), log=lambda message: None)
+    pipeline.add_sample_callback(engine.check_sample)
+    pipeline.add_breath_callback(engine.breath_started)
+    pipeline.metrics.add_metrics_callback(engine.check_breath)
+    start = time.perf_counter()
+    for t, pressure, flow in samples:
+        now = time.time()
+        pipeline.add_pressure(now, pressure)
+        pipeline.add_flow(now, flow)
+        pipeline.update_volume(now)
+    total = (time.perf_counter() - start) / n
+    latency = engine.latency_stats()["sample"]
+
+    period = 1.0 / rate
+    print(f"{rate:4d} SPS | check_sample: mean {1e6 * costs.mean():.1f} us, "
+          f"p99 {1e6 * np.percentile(costs, 99):.1f} us, max {1e6 * costs.max():.1f} us "
+          f"({100 * costs.mean() / period:.2f} % of the period) | check_breath: "
+          f"{1e6 * breath:.1f} us | pipeline: {1e6 * total:.1f} us/sample | "
+          f"latency: {latency['raised']} raises, max {1e3 * latency['max']:.3f} ms, "
+          f"worst case {1e3 * (period + latency['max']):.2f} ms")
+
+if __name__ == "__main__":
+    for rate in [128, 250, 475, 860]:
+        run(rate)
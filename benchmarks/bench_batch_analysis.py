@@ -0,0 +1,43 @@
+"""
+Scaling of batch_analysis with the number of processes: records synthetic sessions of 30 min at
+250 SPS, one per unit directory, and analyzes all of them with 1, 2, 4... processes, up to the
+number of cores. Prints the time, the samples per second and the speedup relative to 1 process.
+Run from the root of the repository: python -m benchmarks.bench_batch_analysis
+"""
+import os
+import shutil
+import tempfile
+import time
+from batch_analysis import analyze
+from benchmarks.bench_replay import record_session
+
+# The maximum Paw alarm is raised at every breath of the synthetic sessions
+SETTINGS = {"al_paw_chkBox": True, "al_paw_max_spb": 18.0}
+
+def run(directory):
+    out = os.path.join(directory, "analysis")
+    workers = 1
+    base = None
+    while True:
+        start = time.perf_counter()
+        summaries = analyze(os.path.join(directory, "units"), out, SETTINGS, workers,
+                            progress=lambda message: None)
+        elapsed = time.perf_counter() - start
+        samples = sum(summary["samples"] for summary in summaries)
+        base = base or elapsed
+        print(f"{workers:3d} processes | {len(summaries)} sessions in {elapsed:6.2f} s | "
+              f"{samples / elapsed:8.0f} samples/s | speedup {base / elapsed:5.2f} "
+              f"({100 * base / elapsed / workers:.0f} % of linear)")
+        shutil.rmtree(out)
+        if workers >= os.cpu_count():
+            break
+        workers = min(2 * workers, os.cpu_count())
+
+if __name__ == "__main__":
+    cores = os.cpu_count()
+    sessions = max(4, 2 * cores)
+    print(f"{cores} CPUs, {sessions} sessions")
+    with tempfile.TemporaryDirectory() as directory:
+        for unit in range(sessions):
+            record_session(os.path.join(directory, "units", f"unit{unit:02d}"))
+        run(directory)
@@ -0,0 +1,57 @@
+"""
+Compares the frame time of one graph of update_graphs with all the samples of the time range
+(the previous path) and with the MinMaxDecimator: new samples, data of the window, setData and
+rendering of an 800 px wide PlotWidget, off screen.
+Run from the root of the repository: python -m benchmarks.bench_decimation
+"""
+import math
+import os
+import time
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+import numpy as np
+from PyQt5 import QtWidgets
+import pyqtgraph as pg
+from decimation import MinMaxDecimator
+from ring_buffer import RingBuffer
+
+DATA_POINTS = 5000
+DURATION = 20.0
+WIDTH = 800
+FPS = 50
+
+def run(rate, decimate, frames=200):
+    widget = pg.PlotWidget()
+    widget.resize(WIDTH, 300)
+    widget.setXRange(-DURATION, 0, 0.01)
+    graph = widget.plot(pen=pg.mkPen(color="#FFFFFF", width=3))
+    buffer = RingBuffer(2, DATA_POINTS, fill=(0.0, 0.0))
+    decimator = MinMaxDecimator(buffer, 1, DURATION, WIDTH) if decimate else None
+    t = 1000.0
+    for i in range(int(DURATION * rate)):
+        t += 1.0 / rate
+        buffer.append((t, 20 * math.sin(t)))
+    points = 0
+    start = time.perf_counter()
+    for frame in range(frames):
+        for i in range(int(rate / FPS)):
+            t += 1.0 / rate
+            buffer.append((t, 20 * math.sin(t)))
+        now = t
+        if decimator is not None:
+            x, y = decimator.update(now)
+        else:
+            data = buffer.window(DURATION, now, DATA_POINTS - 1)
+            x, y = data[0], data[1]
+        graph.setData(x - now, y)
+        widget.grab()
+        points += len(x)
+    frame_time = (time.perf_counter() - start) / frames
+    return frame_time, points / frames
+
+if __name__ == "__main__":
+    app = QtWidgets.QApplication([])
+    for rate in [64, 128, 250]:
+        full, full_points = run(rate, False)
+        decimated, decimated_points = run(rate, True)
+        print(f"{rate:4d} SPS | all samples: {1000 * full:.2f} ms/frame ({full_points:.0f} points)"
+              f" | decimated: {1000 * decimated:.2f} ms/frame ({decimated_points:.0f} points)")
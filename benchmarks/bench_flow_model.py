@@ -0,0 +1,33 @@
+"""
+Compares the time per sample of the conversion of raw ADC counts to flow with the scalar path of
+OrificeMeter (flow_from_counts, one reading at a time, as in the sensor loop) and with the NumPy
+path (flow_from_counts_batch, a whole array at once, e.g. an ADC burst), and checks that both give
+the same flows.
+Run from the root of the repository: python -m benchmarks.bench_flow_model
+"""
+import time
+import numpy as np
+from flow_model import OrificeMeter
+
+def run(n, repeat=5):
+    meter = OrificeMeter()
+    # Readings around the offset of the sensor, so both signs of the flow are converted
+    offset = meter.pa_offset / meter.pa_per_count
+    counts = offset + 2000 * np.sin(np.linspace(0, 20 * np.pi, n))
+    values = counts.tolist()
+    scalar = batch = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        flows = [meter.flow_from_counts(value) for value in values]
+        scalar = min(scalar, time.perf_counter() - start)
+        start = time.perf_counter()
+        batch_flows = meter.flow_from_counts_batch(counts)
+        batch = min(batch, time.perf_counter() - start)
+    error = np.max(np.abs(batch_flows - np.array(flows)))
+    print(f"{n:8d} samples | scalar: {1e6 * scalar / n:.3f} us/sample | batch: "
+          f"{1e6 * batch / n:.4f} us/sample ({scalar / batch:.0f}x) | max difference "
+          f"{error:.2e} l/min")
+
+if __name__ == "__main__":
+    for n in [16, 256, 4096, 65536, 1000000]:
+        run(n)
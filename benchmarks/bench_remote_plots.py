@@ -0,0 +1,98 @@
+"""
+Compares the local and remote render modes of the graphs: three 800 px plots updated at 50 FPS
+with decimated data of 250 SPS, off screen, while a 5 ms timer measures how late the GUI thread
+handles its events (the latency seen by the inputs). Prints the frames sent and rendered per
+second, the time of the GUI thread per frame and the lateness of the probe timer.
+The remote mode only helps if there is a free core for the render process.
+Run from the root of the repository: python -m benchmarks.bench_remote_plots
+"""
+import math
+import os
+import time
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+import numpy as np
+from PyQt5 import QtCore, QtWidgets
+import pyqtgraph as pg
+from decimation import MinMaxDecimator
+from remote_plots import RemotePlotWidget
+from ring_buffer import RingBuffer
+
+RATE = 250
+FPS = 50
+DURATION = 20.0
+PROBE_PERIOD = 0.005
+
+def run(app, mode, seconds=5.0):
+    plot_widget = RemotePlotWidget if mode == "remote" else pg.PlotWidget
+    widgets, curves, decimators, rendered = [], [], [], [0]
+    buffer = RingBuffer(4, 5000, fill=(0.0, 0.0, 0.0, 0.0))
+    for row in range(1, 4):
+        widget = plot_widget()
+        widget.resize(800, 300)
+        widget.setXRange(-DURATION, 0, 0.01)
+        widget.show()
+        curves.append(widget.plot(pen={"color": "#FFFFFF", "width": 3}))
+        decimators.append(MinMaxDecimator(buffer, row, DURATION, 800))
+        if mode == "local":
+            widget.scene().sigPrepareForPaint.connect(
+                lambda: rendered.__setitem__(0, rendered[0] + 1))
+        widgets.append(widget)
+    clock = {"t": time.time(), "busy": 0.0, "frames": 0, "late": []}
+
+    def frame():
+        start = time.perf_counter()
+        now = time.time()
+        while clock["t"] < now:
+            clock["t"] += 1.0 / RATE
+            t = clock["t"]
+            buffer.append((t, 20 * math.sin(t), 30 * math.cos(t), 400 * math.sin(t) ** 2))
+        for curve, decimator in zip(curves, decimators):
+            x, y = decimator.update(now)
+            curve.setData(x - now, y)
+        clock["busy"] += time.perf_counter() - start
+        clock["frames"] += 1
+
+    def probe():
+        now = time.perf_counter()
+        clock["late"].append(now - clock["probe"] - PROBE_PERIOD)
+        clock["probe"] = now
+
+    frame_timer = QtCore.QTimer()
+    frame_timer.timeout.connect(frame)
+    probe_timer = QtCore.QTimer()
+    probe_timer.setTimerType(QtCore.Qt.PreciseTimer)
+    probe_timer.timeout.connect(probe)
+    # Time for the remote processes to start
+    end = time.perf_counter() + 1.0
+    while time.perf_counter() < end:
+        app.processEvents()
+    clock["probe"] = time.perf_counter()
+    frame_timer.start(int(1000 / FPS))
+    probe_timer.start(int(1000 * PROBE_PERIOD))
+    start = time.perf_counter()
+    if mode == "remote":
+        start_rendered = sum(widget.rendered for widget in widgets)
+    while time.perf_counter() - start < seconds:
+        app.processEvents(QtCore.QEventLoop.AllEvents, 10)
+    elapsed = time.perf_counter() - start
+    frame_timer.stop()
+    probe_timer.stop()
+    if mode == "remote":
+        rendered[0] = sum(widget.rendered for widget in widgets) - start_rendered
+        dropped = sum(curve.dropped for curve in curves)
+        for widget in widgets:
+            widget.close()
+    else:
+        dropped = 0
+    late = np.array(clock["late"][1:])
+    print(f"{mode:6s} | sent: {clock['frames'] / elapsed:.1f} FPS "
+          f"({dropped} curve updates dropped) | rendered: {rendered[0] / 3 / elapsed:.1f} FPS "
+          f"per plot | GUI thread: {1000 * clock['busy'] / max(clock['frames'], 1):.2f} ms/frame "
+          f"| probe lateness: mean {1000 * late.mean():.2f} ms, p99 "
+          f"{1000 * np.percentile(late, 99):.2f} ms, max {1000 * late.max():.2f} ms")
+
+if __name__ == "__main__":
+    app = QtWidgets.QApplication([])
+    print(f"{os.cpu_count()} CPUs")
+    for mode in ["local", "remote"]:
+        run(app, mode)
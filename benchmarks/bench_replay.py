@@ -0,0 +1,83 @@
+"""
+Throughput of everything downstream of the acquisition: a synthetic session of 250 SPS is
+recorded and replayed as fast as possible by the replay backend into the queues, and processed by
+ProcessData (pipeline, breath segmentation and metrics, alarms and trends) in another thread, as
+in the GUI but without the graphs. Prints the samples and breaths processed per second.
+Run from the root of the repository: python -m benchmarks.bench_replay
+"""
+import math
+import os
+import tempfile
+import threading
+import time
+from queue import Queue
+from pipeline import SamplePipeline
+from recorder import SessionRecorder
+from settings import SettingsStore
+from trends import BREATH_SIGNALS, SAMPLE_SIGNALS, TrendStore
+
+RATE = 250
+MINUTES = 30
+PERIOD = 5.0
+
+def record_session(directory):
+    """
+    Records MINUTES of breaths of PERIOD seconds, 1 s of inhale and the rest of exhale
+    """
+    recorder = SessionRecorder(directory, log=lambda message: None)
+    for i in range(int(MINUTES * 60 * RATE)):
+        t = i / RATE
+        phase_time = t % PERIOD
+        if phase_time < 1.0:
+            recorder.set_phase(1, t)
+            flow = 40.0
+            pressure = 5.0 + 15.0 * phase_time
+        else:
+            recorder.set_phase(2, t)
+            flow = -40.0 * math.exp(-(phase_time - 1.0) / 0.5)
+            pressure = 5.0 + 15.0 * math.exp(-(phase_time - 1.0) / 0.2)
+        recorder.add(t, pressure, pressure, flow, flow, 0.0)
+    recorder.close()
+
+def run(directory):
+    os.environ["VENTILADOR_BACKEND"] = "replay"
+    os.environ["VENTILADOR_REPLAY"] = directory
+    os.environ["VENTILADOR_REPLAY_SPEED"] = "max"
+    # main loads the backend when it's imported
+    import main
+    from alarms import AlarmEngine
+    import replay
+    flw_q, prs_q = Queue(), Queue()
+    pipeline = SamplePipeline(5000, 0.0)
+    # The latency of the alarms is measured in the time of the replay, as fast as possible it's
+    # the backlog of the queues, so its warning isn't printed
+    alarms = AlarmEngine(SettingsStore({"al_paw_chkBox": True, "al_paw_max_spb": 18.0}),
+                         replay.clock, log=lambda message: None)
+    pipeline.add_sample_callback(alarms.check_sample)
+    pipeline.add_breath_callback(alarms.breath_started)
+    pipeline.metrics.add_metrics_callback(alarms.check_breath)
+    trends = TrendStore(SAMPLE_SIGNALS)
+    breath_trends = TrendStore(BREATH_SIGNALS)
+    pipeline.add_sample_callback(
+        lambda t, pressure, flow: trends.add(t, (pressure, flow, pipeline.integrator.volume)))
+    pipeline.metrics.add_metrics_callback(breath_trends.add_metrics)
+    replay.add_stage_callback(pipeline.set_phase)
+    worker = main.ProcessData(pipeline, flw_q, prs_q)
+    gauge = replay.pressure_gauge()
+    gauge.backlog = flw_q.qsize
+    n = int(MINUTES * 60 * RATE)
+    start = time.perf_counter()
+    threading.Thread(target=worker.work, daemon=True).start()
+    gauge.start_continuous(lambda t, pressure: prs_q.put([t, pressure]),
+                           lambda t, flow: flw_q.put([t, flow]))
+    while pipeline.flw_data.count < n:
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - start
+    print(f"{n} samples ({MINUTES} min at {RATE} SPS) in {elapsed:.2f} s: "
+          f"{n / elapsed:.0f} samples/s, {MINUTES * 60 / elapsed:.0f}x real time, "
+          f"{pipeline.segmenter.number / elapsed:.0f} breaths/s")
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as directory:
+        record_session(directory)
+        run(directory)
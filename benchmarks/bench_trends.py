@@ -0,0 +1,57 @@
+"""
+Measures the TrendStore: cost of adding one sample of the three signals, including the buckets
+that end, memory of the levels and time to read and draw 24 h of trends in an 800 px wide
+PlotWidget, off screen, as the trends tab does.
+Run from the root of the repository: python -m benchmarks.bench_trends
+"""
+import math
+import os
+import time
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+import numpy as np
+from PyQt5 import QtWidgets
+import pyqtgraph as pg
+from trends import SAMPLE_SIGNALS, TrendStore
+
+RATE = 250
+HOURS = 24
+WIDTH = 800
+
+def run(app):
+    store = TrendStore(SAMPLE_SIGNALS)
+    n = int(HOURS * 3600 * RATE)
+    start_time = time.time() - HOURS * 3600
+    times = start_time + np.arange(n) / RATE
+    start = time.perf_counter()
+    for t in times.tolist():
+        store.add(t, (20 * math.sin(t), 30 * math.cos(t), 400 * math.sin(t) ** 2))
+    elapsed = time.perf_counter() - start
+    memory = sum(level.data.data.nbytes for level in store.levels)
+    print(f"add: {1e6 * elapsed / n:.2f} us/sample ({n} samples, {HOURS} h at {RATE} SPS) | "
+          f"memory of the levels: {memory / 2 ** 20:.1f} MB")
+
+    widget = pg.PlotWidget()
+    widget.resize(WIDTH, 300)
+    envelope = widget.plot(pen={"color": "#FFFFFF", "width": 1}, connect="pairs")
+    mean = widget.plot(pen={"color": "#FFFF00", "width": 2}, connect="finite")
+    widget.show()
+    now = times[-1]
+    for hours in [1 / 6, 1, 6, 24]:
+        costs = []
+        for _ in range(20):
+            start = time.perf_counter()
+            level, data = store.window(3600 * hours, now, 2 * WIDTH)
+            t = (data[0] + level.bucket / 2 - now) / 60
+            x = np.repeat(t, 2)
+            y = np.empty(x.size)
+            y[0::2] = data[store.row("pressure", "min")]
+            y[1::2] = data[store.row("pressure", "max")]
+            envelope.setData(x, y)
+            mean.setData(t, data[store.row("pressure", "mean")])
+            app.processEvents()
+            costs.append(time.perf_counter() - start)
+        print(f"{hours:5.2f} h | level of {level.bucket:g} s, {data.shape[1]} buckets | read, "
+              f"setData and render: {1000 * np.median(costs):.2f} ms")
+
+if __name__ == "__main__":
+    run(QtWidgets.QApplication([]))
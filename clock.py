@@ -0,0 +1,51 @@
+"""
+Clocks used by the control loop. The controller and the simulated IO receive a clock instead of
+calling the time module, so the same code runs in real time on the ventilator and in virtual time
+in the simulation harness.
+"""
+import time
+
+class SystemClock():
+    """
+    Real time, the same functions of the time module
+    """
+    def time(self):
+        return time.time()
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def sleep(self, duration):
+        time.sleep(duration)
+
+class VirtualClock():
+    """
+    Virtual time, that only advances when someone sleeps or calls advance(). A loop that sleeps
+    for 50 ms runs as fast as the processor allows, so hours of ventilation take seconds.
+    Only one thread should use it, the harness calls every component in turn.
+    """
+    def __init__(self, start=0.0):
+        self.now = start
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, duration):
+        if duration > 0:
+            self.now += duration
+
+    def advance(self, duration):
+        self.sleep(duration)
+
+    def set(self, t):
+        """
+        Moves the clock to the instant t, the time never goes back
+        """
+        if t > self.now:
+            self.now = t
+
+# Clock used by default, the real one
+system_clock = SystemClock()
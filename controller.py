@@ -0,0 +1,211 @@
+"""
+State machine of the ventilation modes (VCV, PCV, PSV and emergency), without Qt, so it can be
+used by the piston control thread of the GUI and by the simulation harness.
+"""
+from clock import system_clock
+
+class BreathController():
+    """
+    Decides the movement of the piston from the newest pressure and volume. step() is called
+    periodically by the control loop and never blocks, except for the emergency movement of the
+    piston.
+    The settings come from a SettingsStore, published by the GUI (or fixed in the simulation),
+    with the same names as gui_items in main.py. Each step reads the current snapshot once, so all
+    the decisions of a step use the same version, which is saved in the cycle data at the start of
+    every inhale. The time comes from the clock, so the controller runs in real or virtual time.
+    Each mode has 3 stages:
+    0 - Wait
+    1 - Inhale
+    2 - Exhale
+    """
+    def __init__(self, piston, settings, cd=None, clock=system_clock, log=print):
+        self.piston = piston
+        self.settings = settings
+        self.clock = clock
+        self.log = log
+        self.mode = 0
+        # Dictionary that stores the cycle data, sent to the interface
+        self.cd = cd if cd is not None else {}
+        # Functions called with (stage, instant) at every transition of the stage: 1 when an
+        # inhale starts, 2 when it ends and 0 when the exhale ends
+        self.stage_callbacks = []
+        self.reset()
+
+    def reset(self):
+        """
+        Initializes the variables at the beginning of the control
+        """
+        self.t_last = 0  # time of the last cycle
+        self.inhale_start = None
+        self.inhale_end = self.clock.time() - 1  # End of the last inhale
+        self.cd["exhale_duration"] = 1
+        self.cd["inhale_duration"] = 1
+        self.VCV_stage = 0
+        self.PCV_stage = 0
+        self.PSV_stage = 0
+        self.emergency_contained = False
+        self.snapshot = self.settings.current
+        self.cd["settings_version"] = self.snapshot.version
+
+    def add_stage_callback(self, callback):
+        self.stage_callbacks.append(callback)
+
+    @property
+    def stage(self):
+        """
+        Stage of the current mode, 0 when stopped or in emergency
+        """
+        return {1: self.VCV_stage, 2: self.PCV_stage, 3: self.PSV_stage}.get(self.mode, 0)
+
+    def step(self, P, V):
+        """
+        Runs one cycle of the control with the newest pressure P and volume V
+        """
+        # Only one read of the shared settings per step
+        self.snapshot = self.settings.current
+        if self.mode == 1:  # 'VCV'
+            self.VCV_stage = self.cycle(self.VCV_stage, P, V,
+                                        frequency=self.snapshot["VCV_frequency_spb"],
+                                        volume_max=self.snapshot["VCV_volume_spb"],
+                                        pressure_max=self.snapshot["VCV_pressure_max_spb"],
+                                        target="volume")
+        elif self.mode == 2:  # 'PCV'
+            self.PCV_stage = self.cycle(self.PCV_stage, P, V,
+                                        frequency=self.snapshot["PCV_frequency_spb"],
+                                        volume_max=self.snapshot["PCV_volume_max_spb"],
+                                        pressure_max=self.snapshot["PCV_pressure_spb"],
+                                        target="pressure")
+        elif self.mode == 3:  # 'PSV'
+            self.PSV_stage = self.psv_cycle(self.PSV_stage, P)
+        elif self.mode == 4:  # 'Emergency'
+            if not self.emergency_contained:
+                self.piston.emergency()
+                self.emergency_contained = True
+            else:
+                self.piston.stop()
+        else:  # Stop
+            self.piston.stop()
+
+        # Sends the maximum pressure and volume in the last cycle to the interface
+        self.cd["IE_ratio"] = self.cd["exhale_duration"] / self.cd["inhale_duration"]
+        return self.cd
+
+    def notify(self, stage, t):
+        for callback in self.stage_callbacks:
+            callback(stage, t)
+
+    def start_inhale(self):
+        self.inhale_start = self.clock.time()
+        # Version of the settings used by this breath
+        self.cd["settings_version"] = self.snapshot.version
+        # It is possible to calculate how long the last exhale took
+        self.cd["exhale_duration"] = self.inhale_start - self.inhale_end
+        self.notify(1, self.inhale_start)
+
+    def end_inhale(self, message):
+        self.log(message)
+        self.piston.stop()
+        self.inhale_end = self.clock.time()
+        self.notify(2, self.inhale_end)
+
+    def end_exhale(self):
+        self.piston.stop()
+        # Saves the last inhale start time to calculate when a new one should start
+        self.t_last = self.inhale_start
+        # It is possible to calculate how long the last inhale took
+        self.cd["inhale_duration"] = self.inhale_end - self.inhale_start
+        self.notify(0, self.clock.time())
+
+    def cycle(self, stage, P, V, frequency, volume_max, pressure_max, target):
+        """
+        Cycle of the modes with a fixed frequency, VCV (target="volume") and PCV
+        (target="pressure"). In VCV the inhale ends at 90 % of the volume and the pressure is
+        limited to pressure_max. In PCV the inhale ends at pressure_max and the volume is limited
+        to volume_max. Returns the new stage.
+        """
+        name = "VCV" if target == "volume" else "PCV"
+        period = 60. / frequency
+        T_inh_max = period / 2
+        if stage == 0:
+            self.piston.stop()
+            # If it's time for a new cycle, volume and pressure are within limits
+            if (self.clock.time() - self.t_last > period
+                and V < volume_max
+                and P < pressure_max):
+                stage = 1
+                self.start_inhale()
+
+        if stage == 1:
+            # Checks the limit of the controlled variable, VCV doesn't exceed the maximum pressure
+            # and PCV doesn't exceed the maximum volume
+            if target == "volume" and P >= pressure_max:
+                self.log("Pressure is too high during VCV cycle!")
+                self.piston.stop()
+            elif target == "pressure" and V >= volume_max:
+                self.log("Volume is too high during PCV cycle!")
+                self.piston.stop()
+            # Checks if it reached the maximum inhale t
+            elif self.clock.time() - self.inhale_start >= T_inh_max:
+                self.end_inhale(
+                    f"{name} cycle is too long: {self.clock.time() - self.inhale_start:.2f} s")
+                stage = 2
+            # Checks whether the piston reached the bottom
+            # TODO Define what happens in this case
+            elif self.piston.piston_at_bottom:
+                self.end_inhale("Reached max piston travel")
+                stage = 2
+            # Checks if the current volume is above target
+            # TODO Implement margin in options
+            elif target == "volume" and V >= volume_max * 0.9:
+                self.end_inhale("Reached target volume")
+                stage = 2
+            # Checks if the current pressure is above target
+            elif target == "pressure" and P >= pressure_max:
+                self.end_inhale("Reached target pressure")
+                stage = 2
+            # if none of the previous limitations occured, may move the piston
+            else:
+                self.piston.pst_down()
+
+        if stage == 2:
+            # While the piston still hasn't reached the top
+            # TODO Put timeout in piston raise time
+            if not self.piston.piston_at_top and self.clock.time() - self.t_last > period:
+                self.piston.pst_up()
+            else:
+                self.end_exhale()
+                stage = 0
+        return stage
+
+    def psv_cycle(self, stage, P):
+        """
+        Cycle of the PSV mode, the inhale starts when the patient makes the pressure drop below the
+        sensitivity and ends at the support pressure. Returns the new stage.
+        """
+        if stage == 0:
+            self.piston.stop()
+            # If the pressure is below the threshold, time to inhale
+            if P < self.snapshot["PSV_sensitivity_spb"]:
+                stage = 1
+                self.start_inhale()
+
+        if stage == 1:
+            # Checks if the current pressure is close to P_target
+            if P >= self.snapshot["PSV_pressure_spb"]:
+                self.end_inhale("Pressure reached target.")
+                stage = 2
+            elif self.piston.piston_at_bottom:
+                self.end_inhale("Reached max piston travel.")
+                stage = 2
+            # if none of the previous limitations occured, may move the piston
+            else:
+                self.piston.pst_down()
+
+        if stage == 2:
+            # While the piston still hasn't reached the top
+            if not self.piston.piston_at_top:
+                self.piston.pst_up()
+            else:
+                self.end_exhale()
+                stage = 0
+        return stage
@@ -0,0 +1,74 @@
+"""
+Reduction of the samples shown in the graphs to the resolution of the screen
+"""
+import numpy as np
+from ring_buffer import RingBuffer
+
+class MinMaxDecimator():
+    """
+    Reduces one row of a RingBuffer to two points per horizontal pixel: the time window is divided
+    in width buckets and each bucket is drawn as its minimum and maximum, at the center of the
+    bucket, so the peaks are never lost, unlike taking one sample out of N.
+    The buckets are aligned to the time (multiples of duration / width since the epoch), so a bucket
+    that was completed never changes and its two points are kept in a small RingBuffer. Each
+    update only processes the samples that arrived since the last one, plus the few samples of the
+    bucket that is still open, whose points are recalculated every time. The cost per frame depends
+    on the new samples, not on the size of the window.
+    If the window has fewer samples than the decimation would have points, e.g. at a low sample
+    rate, the samples are returned unchanged.
+    """
+    def __init__(self, buffer, row, duration, width=800):
+        self.buffer = buffer
+        self.row = row
+        self.duration = duration
+        self.bucket = duration / width
+        # Two points (time, value) of each completed bucket, with room for the whole window
+        self.points = RingBuffer(2, 2 * (width + 2), fill=(-np.inf, np.nan))
+        # Index (see RingBuffer.view_range) of the first sample of the open bucket
+        self.next = None
+        self.x = np.empty(0)
+        self.y = np.empty(0)
+
+    def update(self, now):
+        """
+        Returns the times and values of the decimated points of the last duration seconds before
+        now, arrays that can be passed to setData
+        """
+        buffer = self.buffer
+        # Everything is read up to this count, the pipeline thread can append more meanwhile
+        count = buffer.count
+        # The oldest sample can be overwritten by the pipeline thread while it's read
+        first = max(buffer.searchsorted(now - self.duration, side="right", count=count),
+                    count - buffer.capacity + 1)
+        if self.next is None or self.next < first:
+            # First update, or the GUI fell behind: the cached buckets are already out of the
+            # window, or their samples were lost
+            self.next = first
+        samples = buffer.view_range(self.next, count)
+        if samples is None or samples.shape[1] == 0:
+            # Overwritten while it was read, starts again in the next frame
+            self.next = None
+            return self.x, self.y
+        ids = np.floor(samples[0] / self.bucket)
+        values = samples[self.row]
+        # Samples of the buckets that are complete, the last one is still open
+        n_complete = int(np.searchsorted(ids, ids[-1]))
+        if n_complete > 0:
+            starts = np.flatnonzero(np.diff(ids[:n_complete])) + 1
+            starts = np.concatenate(([0], starts))
+            minimum = np.minimum.reduceat(values[:n_complete], starts)
+            maximum = np.maximum.reduceat(values[:n_complete], starts)
+            centers = (ids[starts] + 0.5) * self.bucket
+            for center, low, high in zip(centers, minimum, maximum):
+                self.points.append((center, low))
+                self.points.append((center, high))
+            self.next += n_complete
+        points = self.points.window(self.duration, now)
+        center = (ids[-1] + 0.5) * self.bucket
+        open_values = values[n_complete:]
+        self.x = np.concatenate((points[0], (center, center)))
+        self.y = np.concatenate((points[1], (open_values.min(), open_values.max())))
+        window = buffer.view_range(first, count)
+        if window is not None and window.shape[1] <= len(self.x):
+            return window[0], window[self.row]
+        return self.x, self.y
@@ -0,0 +1,71 @@
+"""
+Conversion of the pressure difference measured across the orifice tube to flow
+"""
+import math
+import numpy as np
+
+class OrificeMeter():
+    """
+    Orifice flow meter with all the constants that depend only on the geometry and on the ADC
+    configuration calculated once. The constant that depends on the air density is recalculated
+    only when the density changes (set_density).
+    There are two paths with the same result: a scalar one, with plain floats, for the sensor
+    reading loop, and a NumPy one to convert whole arrays of raw ADC counts at once (ADC bursts,
+    recorded sessions).
+    The flow is positive when the pressure difference is positive and negative otherwise, the
+    signed square root is calculated with copysign instead of branching.
+    """
+    # The full span of the MPX10DP is 35 mV, corresponding to 10 kPa
+    pa_per_volt = 10000 / 0.035
+
+    def __init__(self, D_1=0.0185, D_2=0.0040, adc_max=32767.0, volt_max=0.256,
+                 volt_offset=0.0274, density=1.2041):
+        # Diameters of the orifice tube and of the orifice in m
+        self.D_1 = D_1
+        self.D_2 = D_2
+        A_1 = math.pi * (D_1 / 2) * (D_1 / 2)
+        A_2 = math.pi * (D_2 / 2) * (D_2 / 2)
+        C_D = A_2 / A_1  # Area ratio
+        d = D_2 / D_1  # Diameter ratio
+        # q = C_D * (pi / 4) * D_2² * (2 * delta_p / (rho * (1 - d)⁴)) ** 0.5 in m³/s, so everything
+        # but delta_p and rho is constant. 60000 converts m³/s to l/min
+        self.geometry_k = C_D * (math.pi / 4.0) * (D_2 ** 2.0) * math.sqrt(
+            2.0 / ((1.0 - d) ** 4.0)) * 60000
+
+        # ADC counts to pressure difference in Pa: delta_p = counts * pa_per_count - pa_offset
+        self.pa_per_count = volt_max / adc_max * self.pa_per_volt
+        self.set_volt_offset(volt_offset)
+        self.set_density(density)
+
+    def set_density(self, density):
+        """
+        Updates the air density (Kg/m³) and the constant that depends on it
+        """
+        self.density = density
+        self.k = self.geometry_k / math.sqrt(density)
+
+    def set_volt_offset(self, volt_offset):
+        """
+        Updates the voltage read by the ADC when there is no flow
+        """
+        self.volt_offset = volt_offset
+        self.pa_offset = volt_offset * self.pa_per_volt
+
+    def flow_from_dp(self, delta_p):
+        """
+        Converts one pressure difference in Pa to flow in l/min
+        """
+        return self.k * math.copysign(math.sqrt(abs(delta_p)), delta_p)
+
+    def flow_from_counts(self, counts):
+        """
+        Converts one reading of the ADC (raw counts) to flow in l/min
+        """
+        return self.flow_from_dp(counts * self.pa_per_count - self.pa_offset)
+
+    def flow_from_counts_batch(self, counts):
+        """
+        Converts an array of ADC readings (raw counts) to an array of flows in l/min
+        """
+        delta_p = np.asarray(counts, dtype=np.float64) * self.pa_per_count - self.pa_offset
+        return self.k * np.copysign(np.sqrt(np.abs(delta_p)), delta_p)
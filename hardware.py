@@ -3,6 +3,9 @@ Definition of the hardware attached to the RPi: Buzzer, ADC, LED, Buttons, Rotar
 sensor and piston control.
 """
 import Adafruit_ADS1x15
+from ads1115 import ADS1115, ContinuousAcquisition, GPIOReadyPin, SingleShotADS1115
+from air_density import AirDensity, humid_air_density
+from flow_model import OrificeMeter
 import numpy as np
 from PyQt5 import QtCore
 import RPi._GPIO as GPIO
@@ -31,9 +34,17 @@ class pressure_gauge():
     # ADC
     adc_read_max = 32767.0  # 16-bit
 
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, density_period=10.0, density_max_age=60.0, driver="adafruit",
+                 data_rate=128):
         # Create an instance of the ADC
-        self.adc = Adafruit_ADS1x15.ADS1115(address=self.address, busnum=self.busnum)
+        # "adafruit" uses Adafruit's library, "smbus2" uses the lean driver in ads1115.py, that
+        # combines the I2C transactions and polls the end of the conversion
+        self.driver = driver
+        if self.driver == "smbus2":
+            self.adc = SingleShotADS1115(smbus2.SMBus(self.busnum), smbus2.i2c_msg, self.address,
+                                         data_rate)
+        else:
+            self.adc = Adafruit_ADS1x15.ADS1115(address=self.address, busnum=self.busnum)
         # Starts the adc measuring continuously. This doesn't work for two inputs, due to the way 
         # this library ws implemented
         # Starts the pressure measurement channel (MPX5010DP) - Non differential
@@ -61,27 +72,44 @@ class pressure_gauge():
         self.flw_gain = 16
         self.flw_volt_max = self.gains[self.flw_gain]
         self.flw_volt_offset = 0.0274
+        # Mode of the ADC readings used to calculate the flow
+        self.flw_mode = "differential"
 
         # Creating the instance of the temperature, pressure ad humidity sensor, to get air density
+        # The density is read by a background thread every density_period seconds and the flow
+        # calculation only uses the cached value
         self.bme_sensor = bme()
+        self.air_density = AirDensity(self.bme_sensor, density_period, density_max_age)
+
+        # The constants of the orifice flow meter are calculated only once, the part that depends on
+        # the air density is updated when the density changes
+        self.orifice = OrificeMeter(D_1=0.0185, D_2=0.0040, adc_max=self.adc_read_max,
+                                    volt_max=self.flw_volt_max, volt_offset=self.flw_volt_offset,
+                                    density=self.air_density.value)
+
+    def read_counts(self, ch, gain, mode):
+        """
+        Reads the raw value of the adc (counts)
+        """
+        if self.driver == "smbus2":
+            return self.adc.read_counts(ch, gain, mode)
+        if mode == "differential":
+            return self.adc.read_adc_difference(ch, gain)
+        return self.adc.read_adc(ch, gain)
 
     def read_volts(self, ch, gain, adc_max, volt_max, mode):
         """
         Generic function to get voltage read by the adc, withou any kind of offset compensation
         """
-        if mode == "differential":
-            digital = self.adc.read_adc_difference(ch, gain)
-        else:
-            digital = self.adc.read_adc(ch, gain)
+        digital = self.read_counts(ch, gain, mode)
         # calculating the voltage
         return ((digital / adc_max) * volt_max)
 
-    def read_pressure(self):
+    def counts_to_pressure(self, counts):
         """
-        Function that converts the input voltage read by the MPX5010DP to cm H2O
+        Function that converts the counts read by the adc from the MPX5010DP to cm H2O
         """
-        volts = self.read_volts(self.prs_channel, self.prs_gain, self.adc_read_max,
-                                self.prs_volt_max, "single-ended")
+        volts = (counts / self.adc_read_max) * self.prs_volt_max
         # print(f"prs volts: {volts:.4f}")
         # Offset correction (measured at zero pressure)
         # Converting the voltage to pressure, according to the gauge's properties
@@ -89,45 +117,55 @@ class pressure_gauge():
                                         (self.gauge_max_volt - self.gauge_min_volt))
         return(cmh2o)  # Pressure in cmh2o
 
-    def read_flow_from_dp(self):
+    def counts_to_flow(self, counts):
         """
-        Function that converts the sensors voltage to a pressure difference, then to an 
-        airflow based on the conversion equation of the orifice flow meter.
+        Function that converts the counts read by the adc from the MPX10DP to a pressure 
+        difference, then to an airflow based on the conversion equation of the orifice flow meter.
         """
-        # reads the raw voltage from the adc
-        volts = self.read_volts(self.flw_channel, self.flw_gain, self.adc_read_max,
-                                self.flw_volt_max, "differential")
-
-        # print(f"flow volts: {volts:.5f}")
-        offset = 0.0274
-
-        # delta_p must be in N / m² (Pa)
-        # The full span of the sensor is 35 mV, corresponding to 10 kPa
-        delta_p = (volts - self.flw_volt_offset) * 10000 / 0.035  # Pressure in Pa
-        flow_dir = 1
-        if delta_p < 0:
-            flow_dir = -1
-
-
-        # Pressure sensor and orifice parameters used to obtain the flow
-        # Diameters of the orifice tube and ratio (beta)
-        D_1 = 0.0185  # m
-        D_2 = 0.0040  # m
-        A_1 = np.pi * (D_1 / 2) * (D_1 / 2)
-        A_2 = np.pi * (D_2 / 2) * (D_2 / 2)
-        C_D = A_2 / A_1  # Area ratio
-        d = D_2 / D_1  # Diameter ratio
         # The air density must be calculated taking into account the air temperature and humidity,
-        # therefore it is necessary to buy another sensor for this application.
-        rho = self.bme_sensor.get_air_density()
+        # it is cached and refreshed periodically by self.air_density
+        rho = self.air_density.value
+        if rho != self.orifice.density:
+            self.orifice.set_density(rho)
+        return self.orifice.flow_from_counts(counts)  # flow in liters per minute
 
-        # q is the flow in m³/s
-        q = C_D * (np.pi / 4.0) * (D_2 ** 2.0) * (2.0 * delta_p * flow_dir /
-                                                  (rho * ((1.0 - d) ** 4.0))) ** 0.5 
-        # Converting to l / minute
-        flow = q * 60000 * flow_dir
-        # print(f"mV: {1000 * volts:.2f}")
-        return flow  # flow in liters per minute
+    def read_pressure(self):
+        """
+        Function that reads the pressure from the MPX5010DP in cm H2O
+        """
+        return self.counts_to_pressure(self.read_counts(self.prs_channel, self.prs_gain,
+                                                        "single-ended"))
+
+    def read_flow_from_dp(self):
+        """
+        Function that reads the flow from the orifice flow meter in l/min
+        """
+        return self.counts_to_flow(self.read_counts(self.flw_channel, self.flw_gain,
+                                                    self.flw_mode))
+
+    def start_continuous(self, prs_callback, flw_callback, data_rate=860,
+                         schedule=("flow", "pressure"), alert_pin=22):
+        """
+        Starts the acquisition in continuous conversion mode. Instead of paying for a config write,
+        a fixed wait and a read for every sample, the ADC converts all the time and the ALERT/RDY 
+        pin (connected to alert_pin, BCM numbering) signals every conversion. The channels alternate
+        following the schedule. The callbacks are called from the GPIO thread as 
+        callback(t, value), where t is the instant of the conversion ready edge.
+        """
+        GPIO.setmode(GPIO.BCM)
+        self.chip = ADS1115(smbus2.SMBus(self.busnum), self.address)
+        self.ready_pin = GPIOReadyPin(GPIO, alert_pin)
+        channels = {"pressure": (self.prs_channel, self.prs_gain, "single-ended",
+                                 lambda t, counts: prs_callback(t, self.counts_to_pressure(counts))),
+                    "flow": (self.flw_channel, self.flw_gain, self.flw_mode,
+                             lambda t, counts: flw_callback(t, self.counts_to_flow(counts)))}
+        self.acquisition = ContinuousAcquisition(self.chip, self.ready_pin, channels,
+                                                 list(schedule), data_rate)
+        self.acquisition.start()
+
+    def stop_continuous(self):
+        self.acquisition.stop()
+        self.ready_pin.close()
 
     def tare_sensors(self, duration):
         """
@@ -145,11 +183,12 @@ class pressure_gauge():
             prs_volts.append(self.read_volts(self.prs_channel, self.prs_gain, self.adc_read_max,
                                              self.prs_volt_max, "single-ended"))
             flw_volts.append(self.read_volts(self.flw_channel, self.flw_gain, self.adc_read_max,
-                                             self.flw_volt_max, "differential"))
+                                             self.flw_volt_max, self.flw_mode))
             i += 1
         print(f"Took {i} measurements during {duration} seconds to tare the sensor")
         self.prs_volt_offset = np.mean(np.array(prs_volts))
         self.flw_volt_offset = np.mean(np.array(flw_volts))
+        self.orifice.set_volt_offset(self.flw_volt_offset)
 
 class buttons():
     def __init__(self, input_q):
@@ -252,6 +291,9 @@ class pneumatic_piston():
         GPIO.setup(self.pin_sensor_up, GPIO.IN, pull_up_down=GPIO.PUD_UP)
         GPIO.output(self.pin_down, 0)  # garantir zero p/pistao descida
         GPIO.output(self.pin_up, 0)  # garantir zero p/pistao subida
+        # State of the outputs, read by the session recorder
+        self.out_up = 0
+        self.out_down = 0
 
         # In case the movement doesn't complete in this amount of time, stop
         self.timeout = 10000  # ms
@@ -323,9 +365,11 @@ class pneumatic_piston():
         # Send the piston up
         GPIO.output(self.pin_up, 1)
         GPIO.output(self.pin_down, 0)
+        self.out_up, self.out_down = 1, 0
         # After 10 seconds, turn off the up output
         time.sleep(10)
         GPIO.output(self.pin_up, 0)
+        self.out_up = 0
 
     def stop(self):
         """
@@ -333,6 +377,7 @@ class pneumatic_piston():
         """
         GPIO.output(self.pin_up, 0)
         GPIO.output(self.pin_down, 0)
+        self.out_up, self.out_down = 0, 0
 
     def pst_down(self):
         """
@@ -343,6 +388,7 @@ class pneumatic_piston():
         #     return 'bottom'
         GPIO.output(self.pin_up, 0)  # Guarantees the piston is not going up 
         GPIO.output(self.pin_down, 1)  # Makes the piston go down
+        self.out_up, self.out_down = 0, 1
         self.piston_at_top = False  # If the piston is going down, its not at the top
 
     def pst_up(self):
@@ -351,6 +397,7 @@ class pneumatic_piston():
         """
         GPIO.output(self.pin_down, 0)  # Guarantees the piston is not going down
         GPIO.output(self.pin_up, 1)  # Makes the piston go up
+        self.out_up, self.out_down = 1, 0
         self.piston_at_bottom = False  # If the piston is going up, it's not at the bottom
         
     def position_sensor(self, sens):
@@ -385,29 +432,9 @@ class bme():
         # print(f"P: {data.pressure:.2f} mbar")
         # print(f"H: {data.humidity:.2f} %")
 
-        # The equation used to calculate the density of air was taken from wikipedia's article,
-        # and it is from https://wahiduddin.net/calc/density_altitude.htm - An Introduction fo Air 
-        # Density and Density Altitude Calculations by Richard Shelquist, 2019
         # Calculation of the air density based on T, P and H
-        T = data.temperature + 273.15  # Temperature in Kelvin
-        P = data.pressure * 100  # Pressure in Pa
-        R = 8.31446  # Universal gas constant in J/(K.Mol)
-        M_d = 0.0289652  # Molar mass of dry air in Kg/Mol
-        M_v = 0.018016  # Molar mass of water vapor in Kg/Mol
-
-        # Saturation vapor pressure of water (Tetens' equation) (uses temperatures in C!)
-        P_sat = 610.78 * 10 ** (7.5 * data.temperature / (data.temperature + 237.3))  # in Pa
-        phi = data.humidity / 100  # Relative umidity varying from 0-1
-        P_v = phi * P_sat  # Vapor pressure of water in Pa
-        P_d = P - P_v  # partial pressure of dry air in Pa
-
-        # print(f"P_sat: {P_sat} Pa")
-        # print(f"phi: {phi}")
-        # print(f"P_v: {P_v} Pa")
-        # print(f"P_d: {P_d} Pa")
-
-        air_density = (P_d * M_d + P_v * M_v) / (R * T)
+        air_density = humid_air_density(data.temperature, data.pressure, data.humidity)
         # print(f"Density of humid air: {air_density:.4f} Kg/m³\n")
         # there is a handy string representation too
         # print(data)
-        return(air_density)
\ No newline at end of file
+        return(air_density)
@@ -0,0 +1,58 @@
+"""
+Integration of the flow to obtain the volume, one sample at a time
+"""
+
+class VolumeIntegrator():
+    """
+    Integrates the flow (l/min) with the trapezoidal rule, adding one trapezoid for every new
+    sample, so the cost per sample is constant instead of integrating the whole breath again.
+    The volume (ml) is counted since the last reset, which is done by the pipeline at the start of
+    every inhale. The inspired volume is the integral of the positive flow and the expired volume
+    the integral of the negative flow, both positive. A trapezoid that crosses zero is divided at
+    the crossing, so each part is added to the right total.
+    The calibration multiplies the volume, it corrects the flow measured with the orifice meter.
+    """
+    # Converts l/min * s to ml
+    ml_per_l_min_s = 1000.0 / 60.0
+
+    def __init__(self, calibration=1.0):
+        self.calibration = calibration
+        # Last sample, the next trapezoid starts from it
+        self.t = None
+        self.flow = None
+        self.reset()
+
+    def reset(self):
+        """
+        Starts a new integration, from the last sample
+        """
+        self.volume = 0.0
+        self.inspired = 0.0
+        self.expired = 0.0
+
+    def add(self, t, flow):
+        """
+        Adds the sample to the integral and returns the volume
+        """
+        if self.t is not None and t > self.t:
+            dt = (t - self.t) * self.ml_per_l_min_s * self.calibration
+            f0 = self.flow
+            if (f0 >= 0) == (flow >= 0):
+                area = (f0 + flow) / 2 * dt
+                if area >= 0:
+                    self.inspired += area
+                else:
+                    self.expired -= area
+            else:
+                # The flow crosses zero, the areas of the two triangles are proportional to the
+                # square of the flow at each side
+                span = abs(f0) + abs(flow)
+                positive = max(f0, flow) ** 2 / (2 * span) * dt
+                negative = min(f0, flow) ** 2 / (2 * span) * dt
+                self.inspired += positive
+                self.expired += negative
+                area = positive - negative
+            self.volume += area
+        self.t = t
+        self.flow = flow
+        return self.volume
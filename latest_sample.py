@@ -0,0 +1,39 @@
+"""
+Mailbox with the newest processed sample, read by the piston control
+"""
+from collections import namedtuple
+import threading
+from clock import system_clock
+
+# One consistent set of values: sequence number, instant (time.time()), pressure (cm H2O),
+# flow (l/min) and volume (ml)
+Sample = namedtuple("Sample", ["seq", "t", "pressure", "flow", "volume"])
+
+class LatestSample():
+    """
+    Holds only the newest sample. There is a single writer, the pipeline, that creates a new
+    tuple for every sample and swaps the reference, and any number of readers. Assigning and
+    reading an attribute are atomic in Python, so a reader always gets a complete tuple, never
+    values of different samples mixed, without locks and without the queues that had to be
+    emptied to reach the newest value.
+    The sequence number tells the readers whether there is a new sample since the last read and
+    how many were missed. The event is set at every publication, so a reader can sleep until the
+    next sample (see FixedRateScheduler).
+    """
+    def __init__(self, clock=system_clock):
+        self.clock = clock
+        self.sample = Sample(0, None, None, None, None)
+        self.event = threading.Event()
+
+    def publish(self, t, pressure, flow, volume):
+        self.sample = Sample(self.sample.seq + 1, t, pressure, flow, volume)
+        self.event.set()
+
+    def read(self):
+        """
+        Returns the newest sample and its age in seconds (None if nothing was published yet)
+        """
+        sample = self.sample
+        if sample.t is None:
+            return sample, None
+        return sample, self.clock.time() - sample.t
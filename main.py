@@ -2,15 +2,30 @@
 Main function
 """
 import configparser
+import math
 import numpy as np
 import os
 from PyQt5 import QtWidgets, QtCore, uic
 import pyqtgraph as pg
-from queue import Queue, LifoQueue
-from scipy import integrate
+from queue import Queue, Empty
 import sys
 import time
-from hardware import pressure_gauge, pneumatic_piston, buttons, buzzer, led, bme
+from alarms import AlarmEngine, HIGH, MEDIUM
+import backends
+from clock import system_clock
+from controller import BreathController
+from decimation import MinMaxDecimator
+from pipeline import SamplePipeline
+from recorder import SessionRecorder
+from remote_plots import RemotePlotWidget
+from scheduler import FixedRateScheduler
+from settings import SettingsStore
+from sweep import SweepTrace
+from trends import BREATH_SIGNALS, SAMPLE_SIGNALS, TrendStore
+
+# Module with the IO classes, the real hardware or the simulation, as selected by the environment
+# variable VENTILADOR_BACKEND or in the [Hardware] section of the configuration file
+hw = backends.load_backend()
 
 class ReadSensors(QtCore.QObject):
     """
@@ -18,20 +33,47 @@ class ReadSensors(QtCore.QObject):
     The signal "signal_sensors" emits a list that is read by the function "update_sensors". The list
     contains flow, volume and pressure.
     """
-    def __init__(self, flw_q, prs_q):
+    def __init__(self, flw_q, prs_q, conf):
         super().__init__()
         # Classes that creates the instances of IO classes
-        self.gauge = pressure_gauge()
+        # The air density used to calculate the flow is refreshed at a low rate in the background
+        self.gauge = hw.pressure_gauge(density_period=conf.getfloat("density_period"),
+                                       density_max_age=conf.getfloat("density_max_age"),
+                                       driver=conf.get("driver", "adafruit"),
+                                       data_rate=conf.getint("single_shot_data_rate", 128))
         # self.meter = flowmeter()
         # Associates the received queues with local variables
         self.flw_q = flw_q
         self.prs_q = prs_q
+        # "single_shot" reads one channel at a time in this thread, "continuous" lets the ADC
+        # convert continuously and receives the samples from the conversion ready interrupt
+        self.acquisition = conf.get("acquisition", "single_shot")
+        self.data_rate = conf.getint("data_rate", 860)
+        self.schedule = [name.strip() for name in conf.get("schedule", "flow, pressure").split(",")]
+        # The processing thread pairs every flow with the pressure of its reading
+        if sorted(set(self.schedule)) != ["flow", "pressure"]:
+            raise ValueError(f"The schedule of the sensors must have flow and pressure, and only "
+                             f"them: {', '.join(self.schedule)}")
+        self.alert_pin = conf.getint("alert_pin", 22)
+        # The replay backend delivers the recorded samples with their instants, like the continuous
+        # acquisition, and waits while the samples waiting to be processed pile up
+        if getattr(self.gauge, "continuous_only", False):
+            self.acquisition = "continuous"
+            self.gauge.backlog = self.flw_q.qsize
 
     def work(self):
         """
         Continuously reads the data from the sensors and feeds it to the main function through 
         queues.
         """
+        if self.acquisition == "continuous":
+            # The samples are put in the queues by the interrupt callbacks, this thread only has to
+            # start the acquisition
+            self.gauge.start_continuous(lambda t, pressure: self.prs_q.put([t, pressure]),
+                                        lambda t, flow: self.flw_q.put([t, flow]),
+                                        self.data_rate, self.schedule, self.alert_pin)
+            return
+
         while(True):
             debug_print = False
             if debug_print == True:
@@ -56,23 +98,94 @@ class ReadSensors(QtCore.QObject):
                 print(f"Runtime - total: {1000 * runtime:.1f} ms")
                 print(f"Frequency: {1 / runtime:.1f} Hz")
 
+class ProcessData(QtCore.QObject):
+    """
+    This class is used to create a thread that processes the data from the sensors as soon as it
+    arrives in the queues, instead of waiting for a timer in the GUI thread. The tare, buffering and
+    volume integration are done by the SamplePipeline, which publishes the newest values to the 
+    piston control and stores the data that is read by the GUI to update the graphs.
+    The metrics of each breath are sent to the interface as soon as the breath ends, and so are
+    the alarms, which are evaluated in this thread with every sample.
+    """
+    signal_cycle_data = QtCore.pyqtSignal(dict)
+    signal_alarms = QtCore.pyqtSignal(list)
+
+    def __init__(self, pipeline, flw_q, prs_q):
+        super().__init__()
+        self.pipeline = pipeline
+        # The metrics are calculated in this thread, the signal is queued to the GUI thread
+        self.pipeline.metrics.add_metrics_callback(self.signal_cycle_data.emit)
+        self.flw_q = flw_q
+        self.prs_q = prs_q
+        # Flow sample taken from the queue that is newer than the last pressure
+        self.pending = None
+
+    def work(self):
+        """
+        Blocks until there is new data in the queues and processes it
+        """
+        while(True):
+            # The sensors put the flow and then the pressure in the queues, so waiting for the
+            # pressure guarantees that the flow of the same reading is already available
+            try:
+                t, pressure = self.prs_q.get(timeout=0.1)
+            except Empty:
+                # No pressure for a while (e.g. its reading fails), the flows are processed with
+                # the last pressure so the volume, breaths and alarms keep working
+                t = self.process_flows()
+                if t is not None:
+                    self.pipeline.update_volume(t)
+                continue
+            self.pipeline.add_pressure(t, pressure)
+            self.prs_q.task_done()
+            # Processes the flow samples read until this pressure, so each one is combined with
+            # the pressure of its reading even when the samples pile up in the queues (e.g. in a
+            # replay faster than real time)
+            self.process_flows(t)
+
+            # Calculating volume from the flow
+            self.pipeline.update_volume(t)
+
+            if self.pipeline.get_tare:
+                self.pipeline.tare(t)
+
+    def process_flows(self, until=math.inf):
+        """
+        Processes the flow samples of the queue read until the instant until, all of them by
+        default. Returns the instant of the last one processed, None if there was none.
+        """
+        last = None
+        while True:
+            if self.pending is None:
+                try:
+                    self.pending = self.flw_q.get_nowait()
+                except Empty:
+                    return last
+                self.flw_q.task_done()
+            if self.pending[0] > until:
+                return last
+            last = self.pending[0]
+            self.pipeline.add_flow(*self.pending)
+            self.pending = None
+
 class ControlPiston(QtCore.QObject):
     signal_piston = QtCore.pyqtSignal(bool)
     signal_cycle_data = QtCore.pyqtSignal(dict)
     signal_startup_error = QtCore.pyqtSignal(bool)
     signal_get_tare = QtCore.pyqtSignal(float)
     
-    def __init__(self, gui, flw_lifo_q, prs_lifo_q, vol_lifo_q, mode):
+    def __init__(self, settings, latest, mode, conf):
         super().__init__()
         # receives the piston instance from the call of this worker in the main window
         # assigns the instance to another with the same name.
-        self.piston = pneumatic_piston()
+        self.piston = hw.pneumatic_piston()
         self.stop = False
-        self.gui = gui
-        self.flw = flw_lifo_q
-        self.prs = prs_lifo_q
-        self.vol = vol_lifo_q
-        self.mode = 0
+        # Store with the snapshots of the settings published by the GUI, the control thread never
+        # touches the widgets
+        self.settings = settings
+        # Mailbox with the newest pressure, flow and volume processed by the pipeline
+        self.latest = latest
+        self.clock = system_clock
         self.pause = False
         self.pause_duration = 1
 
@@ -83,19 +196,38 @@ class ControlPiston(QtCore.QObject):
         # Dictionary that stores the cycle data, in order to create the pipeline, sending this info
         # to the interface.
         self.cd = {"started_up": False}
+        # State machine of the ventilation modes, shared with the simulation harness
+        self.controller = BreathController(self.piston, self.settings, self.cd, self.clock)
+        self.mode = mode
+
+        # The control runs with absolute deadlines every period and, optionally, as soon as the
+        # pipeline has a new sample
+        wake_event = self.latest.event if conf.getboolean("wake_on_sample", False) else None
+        self.scheduler = FixedRateScheduler(conf.getfloat("period", 0.05), self.clock, wake_event)
+        # The cycle data is sent to the GUI at most every gui_period and the statistics of the
+        # scheduler are printed every stats_interval seconds
+        self.gui_period = conf.getfloat("gui_period", 0.05)
+        self.stats_interval = conf.getfloat("stats_interval", 60.0)
+
+    @property
+    def mode(self):
+        return self.controller.mode
+
+    @mode.setter
+    def mode(self, mode):
+        self.controller.mode = mode
 
     def startup(self):
         """
         Starts the cycle until the piston moves to a known position
         """
         # Initializing the cycle data (cd) dictionary
+        # The peak pressure, tidal volume, PEEP and the other metrics of the breaths are sent by
+        # the data processing thread
         self.cd["started_up"] = False
-        self.cd["peak_pressure"] = 0
-        self.cd["tidal_volume"] = 0
         self.cd["inhale_duration"] = 0
         self.cd["exhale_duration"] = 0
         self.cd["IE_ratio"] = 1
-        self.cd["PEEP"] = 0
 
         to = 2  # Timeout
         startup_cycles = 0
@@ -140,239 +272,47 @@ class ControlPiston(QtCore.QObject):
     def piston_control(self):
         """
         Function that follows simple cycles to control the piston, based on live feedback from the
-        sensors and inputs from the interface.
+        sensors and inputs from the interface. The decisions are taken by the BreathController.
         """
         # At the beginning it is necessary to set some variables
-        t_last = 0  # time of the last cycle
-        inhale_end = time.time() - 1  # End of the last inhale
-        self.cd["exhale_duration"] = 1
-        self.cd["inhale_duration"] = 1
-        #now = time.time()
-        VCV_stage = 0
-        PCV_stage = 0
-        PSV_stage = 0
-        emergency_contained = False
+        self.controller.reset()
 
         # Gets the current volume and pressure before starting the cycles. If this doesn't work and 
         # takes too long, there is probably some problem with the sensors
-        t_P, P = (None, None)
-        t_V, V = (None, None)
         P_V_t_limit = 5
-        first_P_V = time.time()
-        while P == None and V == None:
-            if not self.prs.empty():
-                t_P, P = self.prs.get()
-            if not self.vol.empty():
-                t_V, V = self.vol.get()
-            if time.time() - first_P_V > P_V_t_limit:
-                print("Took too long to receive new values of P or V from the queues")
+        first_P_V = self.clock.time()
+        while self.latest.sample.seq == 0:
+            self.latest.event.wait(0.1)
+            if self.clock.time() - first_P_V > P_V_t_limit:
+                print("Took too long to receive new values of P or V from the pipeline")
                 # TODO Raise exception, error or return in this condition
 
+        self.scheduler.reset()
+        last_emit = last_stats = self.clock.monotonic()
         while True:
-            # Gets the newest data and empties que queues. If there was no data, uses the values of 
-            # pressure or volume that it already has
-            if not self.prs.empty():
-                t_P, P = self.prs.get()
-                while not self.prs.empty():  # Emptying the queue, only the most recent info is used
-                    dump = self.prs.get()
-
-            if not self.vol.empty():
-                t_V, V = self.vol.get()
-                while not self.vol.empty():  # Emptying the queue, only the most recent info is used
-                    dump = self.vol.get()
-
-            # TODO Needs to be obtained from the interface or defined in a configuration by the user
-            T_inh_max = 60. / self.gui["VCV_frequency_spb"].value() / 2
-
-            if self.mode == 1:  # 'VCV'
-                """
-                This mode has 3 stages:
-                0 - Wait
-                1 - Inhale
-                2 - Exhale
-                """
-                period = 60. / self.gui["VCV_frequency_spb"].value()
-                T_inh_max = period / 2
-                if VCV_stage == 0:  
-                    self.piston.stop()
-                    # If it's time for a new cycle, volume and pressure are within limits
-                    if (time.time() - t_last > period
-                        and V < self.gui["VCV_volume_spb"].value()
-                        and P < self.gui["VCV_pressure_max_spb"].value()):
-                        VCV_stage = 1
-                        inhale_start = time.time()
-                        # It is possible to calculate how long the last exhale took
-                        self.cd["exhale_duration"] = inhale_start - inhale_end
-
-                if VCV_stage == 1:
-                    # Checks if the current pressure is above P_max
-                    if P >= self.gui["VCV_pressure_max_spb"].value():
-                        print("Pressure is too high during VCV cycle!")
-                        self.piston.stop()
-                    # Checks if it reached the maximum inhale t
-                    elif time.time() - inhale_start >= T_inh_max:
-                        print(f"VCV cycle is too long: {time.time() - inhale_start:.2f} s")
-                        self.piston.stop()
-                        VCV_stage = 2
-                        inhale_end = time.time()
-                    # Checks whether the piston reached the bottom
-                    # TODO Define what happens in this case
-                    elif self.piston.piston_at_bottom:
-                        print("Reached max piston travel")
-                        self.piston.stop()
-                        VCV_stage = 2
-                        inhale_end = time.time()
-                    # Checks if the current volume is above target
-                    # TODO Implement margin in options
-                    elif V >= self.gui["VCV_volume_spb"].value() * 0.9:
-                        print("Reached target volume")
-                        self.piston.stop()
-                        VCV_stage = 2 
-                        inhale_end = time.time()
-                    # if none of the previous limitations occured, may move the piston
-                    else:
-                        self.piston.pst_down()
-
-                if VCV_stage == 2:
-                    # While the piston still hasn't reached the top
-                    # TODO Put timeout in piston raise time
-                    if not self.piston.piston_at_top and time.time() - t_last > period:
-                        self.piston.pst_up()
-                    else:
-                        self.piston.stop()
-                        VCV_stage = 0
-                        # Saves the last inhale start time to calculate when a new one should start
-                        t_last = inhale_start
-                        # It is possible to calculate how long the last inhale took
-                        self.cd["inhale_duration"] = inhale_end - inhale_start
-
-            elif self.mode == 2: # 'PCV'
-                """
-                This mode has 3 stages:
-                0 - Wait
-                1 - Inhale
-                2 - Exhale
-                """    
-                period = 60. / self.gui["PCV_frequency_spb"].value()
-                T_inh_max = period / 2
-                if PCV_stage == 0:  
-                    self.piston.stop()
-                    # If it's time for a new cycle, volume and pressure are within limits
-                    if (time.time() - t_last > period
-                        and V < self.gui["PCV_volume_max_spb"].value()
-                        and P < self.gui["PCV_pressure_spb"].value()):
-                        PCV_stage = 1
-                        inhale_start = time.time()
-                        # It is possible to calculate how long the last exhale took
-                        self.cd["exhale_duration"] = inhale_start - inhale_end
-
-                if PCV_stage == 1:
-                    # Checks if the current volume is above max
-                    if V >= self.gui["PCV_volume_max_spb"].value():
-                        print("Volume is too high during PCV cycle!")
-                        self.piston.stop()
-                    # Checks if it reached the maximum inhale t
-                    elif time.time() - inhale_start >= T_inh_max:
-                        print(f"PCV cycle is too long: {time.time() - inhale_start:.2f} s")
-                        self.piston.stop()
-                        PCV_stage = 2
-                        inhale_end = time.time()
-                    # Checks whether the piston reached the bottom
-                    elif self.piston.piston_at_bottom:
-                        print("Reached max piston travel")
-                        self.piston.stop()
-                        PCV_stage = 2
-                        inhale_end = time.time()
-                    # Checks if the current pressure is above target
-                    elif P >= self.gui["PCV_pressure_spb"].value():
-                        print("Reached target pressure")
-                        self.piston.stop()
-                        PCV_stage = 2 
-                        inhale_end = time.time()
-                    # if none of the previous limitations occured, may move the piston
-                    else:
-                        self.piston.pst_down()
-
-                if PCV_stage == 2:
-                    # While the piston still hasn't reached the top
-                    if not self.piston.piston_at_top and time.time() - t_last > period:
-                        self.piston.pst_up()
-                    else:
-                        self.piston.stop()
-                        PCV_stage = 0
-                        # Saves the last inhale start time to calculate when a new one should start
-                        t_last = inhale_start
-                        # It is possible to calculate how long the last inhale took
-                        self.cd["inhale_duration"] = inhale_end - inhale_start
-
-            elif self.mode == 3:  # 'PSV'
-                """
-                This mode has 3 stages:
-                0 - Wait for inhale, P < threshold
-                1 - Inhale
-                2 - Exhale
-                """
-                if PSV_stage == 0:
-                    self.piston.stop()
-                    # If the pressure is below the threshold, time to inhale
-                    if P < self.gui["PSV_sensitivity_spb"].value():
-                        PSV_stage = 1
-                        inhale_start = time.time()
-                        # It is possible to calculate how long the last exhale took
-                        self.cd["exhale_duration"] = inhale_start - inhale_end
-
-                if PSV_stage == 1:
-                    # Checks if the current pressure is close to P_target
-                    if P >= self.gui["PSV_pressure_spb"].value():
-                        print("Pressure reached target.")
-                        self.piston.stop()
-                        PSV_stage = 2
-                        inhale_end = time.time()
-                    elif self.piston.piston_at_bottom:
-                        print("Reached max piston travel.")
-                        self.piston.stop()
-                        PSV_stage = 2
-                        inhale_end = time.time()
-                    # if none of the previous limitations occured, may move the piston
-                    else:
-                        self.piston.pst_down()
-                        
-                if PSV_stage == 2:
-                    # While the piston still hasn't reached the top
-                    if not self.piston.piston_at_top:
-                        self.piston.pst_up()
-                    else:
-                        self.piston.stop()
-                        PSV_stage = 0
-                        # Saves the last inhale start time to calculate when a new one should start
-                        t_last = inhale_start
-                        # It is possible to calculate how long the last inhale took
-                        self.cd["inhale_duration"] = inhale_end - inhale_start
-
-            # Emergency mode
-            elif self.mode == 4:  # 'Emergency'
-                if not emergency_contained:
-                    self.piston.emergency()
-                    emergency_contained = True
-                else:
-                    self.piston.stop()
-
-
-            else:  # Stop
-                self.piston.stop()
-
-            # Finds the indexes of data from the last cycle for flow and pressure
-            # i_flw = np.where(time.time() - self.flw_data[0, :] < last_cycle_dur)[0]
-            # i_prs = np.where(time.time() - self.prs_data[0, :] < last_cycle_dur)[0]
-            
-            # Sends the maximum pressure and volume in the last cycle to the interface
-            self.cd["IE_ratio"] = self.cd["exhale_duration"] / self.cd["inhale_duration"]
-            # Saving the data for the GUI update
-            # self.cd["peak_pressure"] = peak_prs
-            # self.cd["tidal_volume"] = peak_vol
-            self.signal_cycle_data.emit(self.cd)
-
-            time.sleep(0.05)
+            now = self.scheduler.wait()
+            # Gets the newest data. If there was no new sample, it's the same of the last cycle
+            sample, age = self.latest.read()
+            self.controller.step(sample.pressure, sample.volume)
+            # How old were the values used in this cycle
+            self.cd["sample_age"] = age
+
+            if now - last_emit >= self.gui_period:
+                stats = self.scheduler.stats()
+                self.cd["control_period"] = stats["period"]
+                self.cd["control_jitter"] = stats["jitter"]
+                self.cd["control_overruns"] = stats["overruns"]
+                self.cd["control_skipped"] = stats["skipped"]
+                # Saving the data for the GUI update
+                self.signal_cycle_data.emit(self.cd)
+                last_emit = now
+            if now - last_stats >= self.stats_interval:
+                stats = self.scheduler.stats()
+                print(f"Control: period {1000 * stats['period']:.2f} ms, jitter "
+                      f"{1000 * stats['jitter']:.2f} ms, max late "
+                      f"{1000 * stats['late_max']:.2f} ms, {stats['overruns']} overruns, "
+                      f"{stats['skipped']} skipped, {stats['wakeups']} wake ups by samples")
+                last_stats = now
 
 class InterfaceControl(QtCore.QObject):
     """
@@ -387,7 +327,7 @@ class InterfaceControl(QtCore.QObject):
         super().__init__()
         # Classes that creates the instances of IO classes
         self.input_q = Queue()
-        self.btns = buttons(self.input_q)
+        self.btns = hw.buttons(self.input_q)
 
     def read_queue(self):
         key = None
@@ -509,7 +449,7 @@ class BuzBuzzer(QtCore.QObject):
     """
     def __init__(self):
         super().__init__()
-        self.buzzer = buzzer()
+        self.buzzer = hw.buzzer()
         
     def short_buzz(self):
         self.buzzer.beep_for(0.05)
@@ -523,7 +463,7 @@ class LEDControl(QtCore.QObject):
     """
     def __init__(self):
         super().__init__()
-        self.led = led()
+        self.led = hw.led()
         
     def blink(self):
         self.led.light_for(0.3)
@@ -536,9 +476,14 @@ class DesignerMainWindow(QtWidgets.QMainWindow):
     Class that corresponds to the programs main window. The init starts the interface and essential
     functions
     """
+    # Events of a replayed session, received from the replay thread
+    signal_replay_event = QtCore.pyqtSignal(dict)
+
     def __init__(self, parent=None):
         super(DesignerMainWindow, self).__init__(parent)
         uic.loadUi(os.path.join(os.getcwd(), "ui", "GUI_mainWindow.ui"), self)
+        # Time of the samples, the real time or the time of the replay, with the replay backend
+        self.clock = getattr(hw, "clock", system_clock)
         
         # Creates the error_window instance
         self.error_window = StartupErrorWindow()
@@ -555,9 +500,12 @@ class DesignerMainWindow(QtWidgets.QMainWindow):
 
         # Creates queues and lists to process the data read from the sensors
         self.create_data_structures()
+        # Data of the last cycle, received from the piston control thread
+        self.cd = {}
 
         # Starting the graphs and threads
         self.create_graphs()
+        self.create_trends()
         self.create_threads()
 
         # Creates a timer to update the graphs at a specific frequency
@@ -567,13 +515,6 @@ class DesignerMainWindow(QtWidgets.QMainWindow):
         self.gui_timer.start(gui_update_period)
         self.gui_timer.timeout.connect(self.update_graphs)
 
-        # Creates a timer to update the data at a specific frequency
-        self.data_timer = QtCore.QTimer()
-        data_update_frequency = 100  # Hz
-        data_update_period = 1000 / data_update_frequency  # period in ms
-        self.data_timer.start(data_update_period)
-        self.data_timer.timeout.connect(self.process_data)
-
         # Creates a timer to read the ambient temperature, pressure and humidity periodically
         # self.gme_timer = QtCore.QTimer()
         # gme_update_period = 500  # period in ms
@@ -708,130 +649,72 @@ class DesignerMainWindow(QtWidgets.QMainWindow):
         Creates the arrays and queues that will be used to control the piston and update the graphs
         """
         # Data storage arrays for time and measurement
-        # Create the array of zeros and preallocating
-        start_time = time.time()
+        # The ring buffers are preallocated and keep the samples ordered from the oldest to the
+        # newest, inserting a new sample doesn't copy the whole array
+        start_time = self.clock.time()
         # The number of data points has to be optimized
         self.data_points = 5000
-        # prs_data has three rows, 0 = time, 1 = pressure - tare, 2 = raw_pressure
-        self.prs_data = np.zeros([3, self.data_points])
-        self.prs_data[0, :] = start_time
-        # This queue receives data from the sensors and puts it in the graphs and sends to the 
-        # LifoQueue
+        # These queues receive data from the sensors, that is processed by the pipeline thread
         self.prs_q = Queue()
-        # The lifo queue is created to send the data to the piston control thread. The piston
-        # control will only read and use the last value, since only the most recent information
-        # matters
-        self.prs_lifo_q = LifoQueue()
-        self.prs_tare = 0
-        
-        self.flw_data = np.zeros([3, self.data_points])
-        self.flw_data[0, :] = start_time
         self.flw_q = Queue()
-        self.flw_lifo_q = LifoQueue()  # Read comment on the lifoqueue above
-        self.flw_tare = 0
-
-        self.vol_lifo_q = LifoQueue()  # Read comment on the lifoqueue above
-        self.vol_data = np.zeros([2, self.data_points])
-        self.vol_data[0, :] = start_time
+        # The pipeline owns the ring buffers, the GUI only reads them to update the graphs
+        # The piston control will only read and use the last values, since only the most recent
+        # information matters, they are published in the mailbox self.pipeline.latest
+        self.pipeline = SamplePipeline(
+            self.data_points, start_time,
+            volume_calibration=self.conf["Config"].getfloat("volume_calibration", 5.0),
+            volume_reset_timeout=self.conf["Config"].getfloat("volume_reset_timeout", 15.0),
+            breath_threshold=self.conf["Config"].getfloat("breath_flow_threshold", 2.0))
+        # prs_data and flw_data have three rows, 0 = time, 1 = value - tare, 2 = raw value
+        self.prs_data = self.pipeline.prs_data
+        self.flw_data = self.pipeline.flw_data
+        # vol_data has four rows, 0 = time, 1 = volume, 2 = inspired volume, 3 = expired volume
+        self.vol_data = self.pipeline.vol_data
+        # Every sample and event of the session is recorded to the disk
+        rec = self.conf["Recorder"]
+        if rec.getboolean("enabled", True) and getattr(hw, "RECORD_SESSION", True):
+            self.recorder = SessionRecorder(
+                rec.get("directory", "sessions"),
+                segment_records=rec.getint("segment_records", 2000000),
+                max_bytes=int(rec.getfloat("max_disk_mb", 1024) * 2 ** 20),
+                flush_interval=rec.getfloat("flush_interval", 1.0))
+            self.pipeline.recorder = self.recorder
+        else:
+            self.recorder = None
+        # Trends of the session, in buckets of 1 s, 10 s and 1 min, shown in the trends tab
+        self.trends = TrendStore(SAMPLE_SIGNALS)
+        self.breath_trends = TrendStore(BREATH_SIGNALS)
+        self.pipeline.add_sample_callback(self.add_trend_sample)
+        self.pipeline.metrics.add_metrics_callback(self.breath_trends.add_metrics)
         
-    def process_data(self):
-        """
-        This function receives data from the sensors via a queue, puts it into arrays for the graphs 
-        and also puts it into a LifoQueue for the piston control function.
-        """
-        # If both queues are empty, just wait
-        if self.prs_q.empty() and self.flw_q.empty():
-            time.sleep(0.01)
-            return
-
-        # while the pressure queue is not empty, get the data and append
-        new_prs_data = False
-        while not self.prs_q.empty():
-            t, pressure = self.prs_q.get()
-            # Puts the same data on the queue that is read by the piston control thread
-            self.prs_lifo_q.put([t, pressure])
-            # Rolls the array
-            self.prs_data = np.roll(self.prs_data, 1)
-            # inserts the new data in the current i position
-            self.prs_data[:, 0] = (t, pressure - self.prs_tare, pressure)
-            new_prs_data = True
-        if new_prs_data:
-            # Signals that it got all the data from the queue and the sensors can continue to put
-            # new data in the queue
-            self.prs_q.task_done()
-
-        # while the flow queue is not empty, get the data and append
-        new_flw_data = False
-        while not self.flw_q.empty():
-            t, flow = self.flw_q.get()
-            self.flw_lifo_q.put([t, flow])
-            # Rolls the array
-            self.flw_data = np.roll(self.flw_data, 1)
-            # inserts the new data in the current i position
-            self.flw_data[:, 0] = (t, flow - self.flw_tare, flow)
-            new_flw_data = True
-        if new_flw_data:
-            # Signals that it got all the data from the queue and the sensors can continue to put
-            # new data in the queue
-            self.flw_q.task_done()
-
-        # Calculating volume from the flow
-        now = time.time()
-        try:
-            last_inhale = now - self.cd["inhale_instant"]
-        except:
-            last_inhale = 3
-        # Gets the indexes of the data since the last breath
-        i_li = np.where(now - self.flw_data[0, :] < last_inhale)[0]
-        # volume = np.sum(self.flw_data[1, i_li]) / (60 * last_inhale)
-        # Integrating the flow with trapz to get accurate results, considering the dt is not 
-        # constant between samples. The time is negative, so needs to invert the signal
-        volume = -integrate.trapz(self.flw_data[1, i_li], self.flw_data[0, i_li])
-        # Converting the volume from L to mL and time from minute to second
-        volume = 1000 * volume / 60
-        # Calibration factor
-        calib = 5
-        volume = volume * calib
-        self.vol_lifo_q.put([t, volume])
-        self.vol_data = np.roll(self.vol_data, 1)
-        self.vol_data[:, 0] = (t, volume)
-
-
-        # Gets the tare of the pressure and flow sensors and updates the data 
-        if self.get_tare and self.worker_piston.mode == 0:
-            idxs_flw_tare = np.where(time.time() - self.flw_data[0, :] < self.tare_duration)[0]
-            self.flw_tare = np.mean(self.flw_data[2, idxs_flw_tare])
-            self.flw_data[1, :] = self.flw_data[2, :] - self.flw_tare
-            idxs_prs_tare = np.where(time.time() - self.prs_data[0, :] < self.tare_duration)[0]
-            self.prs_tare = np.mean(self.prs_data[2, idxs_prs_tare])
-            self.prs_data[1, :] = self.prs_data[2, :] - self.prs_tare
-            self.get_tare = False
-        if self.get_tare and self.worker_piston.mode != 0:
-            print("The respirator must be stopped before adjusting the tare.")
-            self.get_tare = False
-
     def create_graphs(self):
         # Definitions to create the graphs
+        # The plots are rendered in the GUI process (local) or in a second process (remote), which
+        # frees the GUI thread to handle the inputs, if there is a free core
+        remote = self.conf["Graph"].get("render_mode", "local") == "remote"
+        plot_widget = RemotePlotWidget if remote else pg.PlotWidget
         # creates the pressure plot widget 
-        self.prs_pw = pg.PlotWidget()
+        self.prs_pw = plot_widget()
         # Adds the widget to the layout created in qtdesigner
         self.pressure_graph_VBox.addWidget(self.prs_pw)
         
         # Creates the flow plot widget 
-        self.flw_pw = pg.PlotWidget()
+        self.flw_pw = plot_widget()
         self.flow_graph_VBox.addWidget(self.flw_pw)
         
         # Creates the volume plot widget and adds a label to it
-        self.vol_pw = pg.PlotWidget()
+        self.vol_pw = plot_widget()
         self.volume_graph_VBox.addWidget(self.vol_pw)
-        self.vol_lbl = pg.TextItem()
+        # The items of a remote plot must be created in its process
+        self.vol_lbl = self.vol_pw.pg.TextItem() if remote else pg.TextItem()
         self.vol_pw.addItem(self.vol_lbl, ignoreBounds=True) 
         
         # Plot settings
         bg_color = self.conf["Graph"].get("background_color")
         pen_color = self.conf["Graph"].get("line_color")
         font_size = self.conf["Graph"].get("font_size")
-        plot_pen = pg.mkPen(color=pen_color, width=3)
+        # The pen is a dictionary, a QPen can't be sent to the remote process
+        plot_pen = {"color": pen_color, "width": 3}
         # For some reason the color definition is different inside "styles"
         # Titles use 'size', while labels use 'font_size'
         self.lbl_style = {'color': pen_color, 'font-size': font_size}
@@ -839,6 +722,21 @@ class DesignerMainWindow(QtWidgets.QMainWindow):
         self.time_range = [self.conf["Graph"].getfloat("time_range_min"),
                            self.conf["Graph"].getfloat("time_range_max")]
         self.padding = 0.01
+        # The plots have fewer pixels than samples in the time range, each trace is reduced to the
+        # minimum and maximum of every pixel before setData
+        width = self.conf["Graph"].getint("plot_width", 800)
+        duration = self.time_range[1] - self.time_range[0]
+        if self.conf["Graph"].getboolean("decimate", True):
+            self.prs_decimator = MinMaxDecimator(self.prs_data, 1, duration, width)
+            self.flw_decimator = MinMaxDecimator(self.flw_data, 1, duration, width)
+            self.vol_decimator = MinMaxDecimator(self.vol_data, 1, duration, width)
+        else:
+            self.prs_decimator = self.flw_decimator = self.vol_decimator = None
+        # Each graph scrolls, with the newest sample at the right, or sweeps over a fixed time
+        # axis, like the bedside monitors (see SweepTrace)
+        self.prs_sweep = self.create_sweep("pressure", self.prs_data, duration, width)
+        self.flw_sweep = self.create_sweep("flow", self.flw_data, duration, width)
+        self.vol_sweep = self.create_sweep("volume", self.vol_data, duration, width)
 
         # Configuration of the pressure plot
         self.prs_pw.setBackground(bg_color) # Set the background color
@@ -847,8 +745,9 @@ class DesignerMainWindow(QtWidgets.QMainWindow):
         self.prs_pw.setTitle(self.conf["Graph"].get("title_pressure"), **self.ttl_style)
         self.prs_pw.showGrid(x=True, y=True)
         self.prs_pw.setLabel(axis='bottom', text='Tempo (s)', **self.lbl_style)
-        self.prs_pw.setXRange(self.time_range[0], self.time_range[1], self.padding)
-        self.prs_graph = self.prs_pw.plot(self.prs_data[0, :], self.prs_data[1, :], pen=plot_pen)
+        self.prs_pw.setXRange(*self.x_range(self.prs_sweep), self.padding)
+        self.prs_graph = self.prs_pw.plot(self.prs_data.view()[0], self.prs_data.view()[1],
+                                          pen=plot_pen, connect="finite")
         
         # Configuration of the flow plot
         self.flw_pw.setBackground(bg_color) # Set the background color
@@ -856,8 +755,9 @@ class DesignerMainWindow(QtWidgets.QMainWindow):
         # The title size doesn't change with the style
         self.flw_pw.setTitle(self.conf["Graph"].get("title_flow"), **self.ttl_style)
         self.flw_pw.showGrid(x=True, y=True)
-        self.flw_pw.setXRange(self.time_range[0], self.time_range[1], self.padding)
-        self.flw_graph = self.flw_pw.plot(self.flw_data[0, :], self.flw_data[1, :], pen=plot_pen)
+        self.flw_pw.setXRange(*self.x_range(self.flw_sweep), self.padding)
+        self.flw_graph = self.flw_pw.plot(self.flw_data.view()[0], self.flw_data.view()[1],
+                                          pen=plot_pen, connect="finite")
         
         # Configuration of the volume plot
         self.vol_pw.setBackground(bg_color) # Set the background color
@@ -865,8 +765,9 @@ class DesignerMainWindow(QtWidgets.QMainWindow):
         # The title size doesn't change with the style
         self.vol_pw.setTitle(self.conf["Graph"].get("title_volume"), **self.ttl_style)
         self.vol_pw.showGrid(x=True, y=True)
-        self.vol_pw.setXRange(self.time_range[0], self.time_range[1], self.padding)
-        self.vol_graph = self.vol_pw.plot(self.vol_data[0, :], self.vol_data[1, :], pen=plot_pen)
+        self.vol_pw.setXRange(*self.x_range(self.vol_sweep), self.padding)
+        self.vol_graph = self.vol_pw.plot(self.vol_data.view()[0], self.vol_data.view()[1],
+                                          pen=plot_pen, connect="finite")
         # Adding text inside the graph
         # self.vol_lbl.setText("TEST")
         # Anchor is the position to which the text will refer in setPos
@@ -874,7 +775,91 @@ class DesignerMainWindow(QtWidgets.QMainWindow):
         # This is the position of the anchor, in the coordinates of the graph
         # self.vol_lbl.setPos(0.0, 0.0)
         self.run_counter = 0
-        self.get_tare = False
+        self.frames_start = time.perf_counter()
+        self.frame_time = 0.0
+
+    def create_trends(self):
+        """
+        Creates the trends tab, with the pressure, flow and volume of the last minutes or hours.
+        Every bucket is drawn as a vertical line from its minimum to its maximum, with the mean
+        over it, and the metrics of the breaths as dashed lines
+        """
+        trd = self.conf["Trends"]
+        bg_color = self.conf["Graph"].get("background_color")
+        pen_color = self.conf["Graph"].get("line_color")
+        self.trends_tab = QtWidgets.QWidget()
+        layout = QtWidgets.QVBoxLayout(self.trends_tab)
+        # Time range of the trends, in minutes
+        self.trends_range_cmb = QtWidgets.QComboBox()
+        ranges = [float(value) for value in trd.get("ranges", "10, 60, 360, 1440").split(",")]
+        for minutes in ranges:
+            text = f"{minutes / 60:g} h" if minutes >= 60 else f"{minutes:g} min"
+            self.trends_range_cmb.addItem(text, 60 * minutes)
+        self.trends_range_cmb.currentIndexChanged.connect(self.update_trends)
+        layout.addWidget(self.trends_range_cmb)
+        # Plot, envelope and mean curves of each signal, and the curves of the metrics as
+        # (signal, curve) pairs
+        self.trend_plots = {}
+        self.trend_metric_curves = []
+        metrics = {"pressure": [("peak_pressure", "#FF8080"), ("PEEP", "#80FF80")],
+                   "flow": [],
+                   "volume": [("tidal_volume", "#FF8080")]}
+        for signal in SAMPLE_SIGNALS:
+            plot = pg.PlotWidget()
+            plot.setBackground(bg_color)
+            plot.setMenuEnabled(False)
+            plot.showGrid(x=True, y=True)
+            # Three plots share the height of a tab, the titles are smaller than in the graphs
+            plot.setTitle(self.conf["Graph"].get(f"title_{signal}"), color=pen_color, size="10pt")
+            envelope = plot.plot(pen={"color": pen_color, "width": 1}, connect="pairs")
+            mean = plot.plot(pen={"color": "#FFFF00", "width": 2}, connect="finite")
+            for metric, color in metrics[signal]:
+                self.trend_metric_curves.append(
+                    (metric, plot.plot(pen={"color": color, "width": 2,
+                                            "style": QtCore.Qt.DashLine}, connect="finite")))
+            self.trend_plots[signal] = (plot, envelope, mean)
+            layout.addWidget(plot)
+        plot.setLabel(axis='bottom', text='Tempo (min)', color=pen_color)
+        self.tabWidget.addTab(self.trends_tab, "Tendências")
+        self.tabWidget.currentChanged.connect(self.update_trends)
+        # The buckets of the finest level end every second, the tab is only drawn while it's shown
+        self.trends_timer = QtCore.QTimer()
+        self.trends_timer.start(int(1000 * trd.getfloat("update_interval", 1.0)))
+        self.trends_timer.timeout.connect(self.update_trends)
+
+    def add_trend_sample(self, t, pressure, flow):
+        """
+        Adds a sample to the trends, with the volume of the same instant (sample callback, called
+        by the pipeline thread)
+        """
+        self.trends.add(t, (pressure, flow, self.pipeline.integrator.volume))
+
+    def update_trends(self):
+        """
+        Draws the trends of the chosen time range, from the level of the TrendStore with about one
+        bucket per pixel, so 24 h take the same time as 10 min
+        """
+        if self.tabWidget.currentWidget() is not self.trends_tab:
+            return
+        duration = self.trends_range_cmb.currentData()
+        now = self.clock.time()
+        width = self.conf["Graph"].getint("plot_width", 800)
+        level, data = self.trends.window(duration, now, 2 * width)
+        # Minutes before now, at the center of the buckets
+        t = (data[0] + level.bucket / 2 - now) / 60
+        x = np.repeat(t, 2)
+        for signal, (plot, envelope, mean) in self.trend_plots.items():
+            # Pairs of points, minimum and maximum of each bucket
+            y = np.empty(x.size)
+            y[0::2] = data[self.trends.row(signal, "min")]
+            y[1::2] = data[self.trends.row(signal, "max")]
+            envelope.setData(x, y)
+            mean.setData(t, data[self.trends.row(signal, "mean")])
+            plot.setXRange(-duration / 60, 0, self.padding)
+        level, data = self.breath_trends.window(duration, now, 2 * width)
+        t = (data[0] + level.bucket / 2 - now) / 60
+        for metric, curve in self.trend_metric_curves:
+            curve.setData(t, data[self.breath_trends.row(metric, "mean")])
 
     def create_threads(self):
         """
@@ -907,20 +892,76 @@ class DesignerMainWindow(QtWidgets.QMainWindow):
                      "al_tidal_volume_max_spb":self.al_tidal_volume_max_spb,
                      "al_volume_minute_max_spb":self.al_volume_minute_max_spb,
                      "inhale_pause_spb":self.inhale_pause_spb}
+        # Alarm switches, also published in the settings
+        alarm_items = {"al_PEEP_chkBox":self.al_PEEP_chkBox,
+                       "al_apnea_chkBox":self.al_apnea_chkBox,
+                       "al_flow_chkBox":self.al_flow_chkBox,
+                       "al_frequency_chkBox":self.al_frequency_chkBox,
+                       "al_paw_chkBox":self.al_paw_chkBox,
+                       "al_plateau_pressure_chkBox":self.al_plateau_pressure_chkBox,
+                       "al_tidal_volume_chkBox":self.al_tidal_volume_chkBox,
+                       "al_volume_minute_chkBox":self.al_volume_minute_chkBox}
+
+        # The worker threads read the settings from immutable snapshots, a new one is published by
+        # the GUI thread every time a spinbox or alarm switch changes
+        values = {name: spb.value() for name, spb in gui_items.items()}
+        values.update({name: chk.isChecked() for name, chk in alarm_items.items()})
+        self.settings = SettingsStore(values)
+        for name, spb in gui_items.items():
+            spb.valueChanged.connect(lambda value, name=name: self.publish_setting(name, value))
+        for name, chk in alarm_items.items():
+            chk.toggled.connect(lambda checked, name=name: self.publish_setting(name, checked))
+
+        # The alarms are evaluated by the data processing thread, with every sample and at the
+        # end of every breath, with the limits of the Alarms tab
+        self.alarms = AlarmEngine(self.settings, self.clock,
+                                  latency_target=self.conf["Alarms"].getfloat("latency_target",
+                                                                              0.05))
+        self.pipeline.add_sample_callback(self.alarms.check_sample)
+        self.pipeline.add_breath_callback(self.alarms.breath_started)
+        self.pipeline.metrics.add_metrics_callback(self.alarms.check_breath)
+        if self.recorder is not None:
+            self.alarms.add_alarm_callback(
+                lambda alarms: self.recorder.add_event(
+                    self.clock.time(), "alarms",
+                    active=[alarm.name for alarm in alarms if alarm.active],
+                    latched=[alarm.name for alarm in alarms]))
+
+        # The replay backend sends the stages of the controller and the changes of the settings
+        # recorded in the session, before the sensors thread starts it
+        if hasattr(hw, "add_stage_callback"):
+            hw.add_stage_callback(self.pipeline.set_phase)
+            hw.add_event_callback(self.signal_replay_event.emit)
+            self.signal_replay_event.connect(self.replay_event)
 
         # Sensors thread
-        self.worker_sensors = ReadSensors(self.flw_q, self.prs_q)
+        self.worker_sensors = ReadSensors(self.flw_q, self.prs_q, self.conf["Sensors"])
         self.thread_sensors = QtCore.QThread()
         self.worker_sensors.moveToThread(self.thread_sensors)
         # Passing the arrays to the thread
         # self.worker_sensors.signal_sensors.connect(self.update_sensors)
         self.thread_sensors.started.connect(self.worker_sensors.work)
         self.thread_sensors.start()
+
+        # Data processing thread
+        self.worker_data = ProcessData(self.pipeline, self.flw_q, self.prs_q)
+        self.worker_data.signal_cycle_data.connect(self.update_interface)
+        self.alarms.add_alarm_callback(self.worker_data.signal_alarms.emit)
+        self.worker_data.signal_alarms.connect(self.update_alarms)
+        self.thread_data = QtCore.QThread()
+        self.worker_data.moveToThread(self.thread_data)
+        self.thread_data.started.connect(self.worker_data.work)
+        self.thread_data.start()
         
         # Piston control thread
         # self.worker_piston = ControlPiston(self.piston, gui_items, mode=0)
-        self.worker_piston = ControlPiston(gui_items, self.flw_lifo_q, self.prs_lifo_q,
-                                           self.vol_lifo_q, mode=0)
+        self.worker_piston = ControlPiston(self.settings, self.pipeline.latest, mode=0,
+                                           conf=self.conf["Control"])
+        # The breaths are segmented, and the volume integrated, with the stages of the control
+        self.worker_piston.controller.add_stage_callback(self.pipeline.set_phase)
+        if self.recorder is not None:
+            self.worker_piston.controller.add_stage_callback(self.recorder.set_phase)
+            self.recorder.piston = self.worker_piston.piston
         self.thread_piston = QtCore.QThread()
         self.worker_piston.moveToThread(self.thread_piston)
         # Another way of passing variables to threads
@@ -953,20 +994,95 @@ class DesignerMainWindow(QtWidgets.QMainWindow):
         self.thread_led = QtCore.QThread()
         self.worker_led.moveToThread(self.thread_led)
 
+        # The alarms are shown in the status bar, the button acknowledges them
+        self.alarm_lbl = QtWidgets.QLabel("")
+        self.statusBar().addWidget(self.alarm_lbl, 1)
+        self.alarm_ack_btn = QtWidgets.QPushButton("Silenciar")
+        self.alarm_ack_btn.clicked.connect(self.alarms.acknowledge)
+        self.statusBar().addPermanentWidget(self.alarm_ack_btn)
+        # Sound and light signal of the alarms that weren't acknowledged, once per second
+        self.alarm_ticks = 0
+        self.alarm_timer = QtCore.QTimer()
+        self.alarm_timer.start(1000)
+        self.alarm_timer.timeout.connect(self.annunciate_alarms)
+
+    def publish_setting(self, name, value):
+        """
+        Publishes the new value of a setting to the worker threads and records it
+        """
+        snapshot = self.settings.set(name, value)
+        if self.recorder is not None:
+            # In the time of the samples, which is the time of the replay with the replay backend
+            self.recorder.add_event(self.clock.time(), "setting", name=name, value=value,
+                                    version=snapshot.version)
+
+    def replay_event(self, event):
+        """
+        Applies a change of the settings recorded in the replayed session to its spinbox or
+        switch, which publishes it like a change made by the user
+        """
+        if event["kind"] == "setting":
+            widget = getattr(self, event["name"], None)
+            if isinstance(widget, QtWidgets.QCheckBox):
+                widget.setChecked(event["value"])
+            elif widget is not None:
+                widget.setValue(event["value"])
+        elif event["kind"] == "mode":
+            print(f"Replay: mode {event['mode']}")
+
     def set_tare_var(self, tare_duration):
         """
-        This function is used to set the variable "get_tare" that is accessed in "update graphs" to
-        calculate the tare of the pressure and flow. The tare duration corresponds to the time 
+        This function asks the data processing thread to calculate the tare of the pressure and 
+        flow. The tare duration corresponds to the time 
         interval used to obtain the mean value and consider it the tare.
         """
-        self.tare_duration = tare_duration
-        self.get_tare = True
+        if self.worker_piston.mode != 0:
+            print("The respirator must be stopped before adjusting the tare.")
+            return
+        if not getattr(hw, "TARE_SAMPLES", True):
+            print("The replayed samples already have the tare of the session.")
+            return
+        # The tare is calculated by the data processing thread
+        self.pipeline.request_tare(tare_duration)
         # beep and blink after 100 ms
         if self.cfg_beep_chkBox.isChecked():
             QtCore.QTimer.singleShot(100, lambda: self.worker_buzzer.long_buzz())
         if self.cfg_led_chkBox.isChecked():
             QtCore.QTimer.singleShot(100, lambda: self.worker_led.blink())
 
+    def create_sweep(self, name, buffer, duration, width):
+        """
+        Returns the SweepTrace of the graph if its display is "sweep" in the configuration, None if
+        it scrolls
+        """
+        if self.conf["Graph"].get(f"{name}_display", "scroll") != "sweep":
+            return None
+        return SweepTrace(buffer, 1, duration, width, self.conf["Graph"].getfloat("sweep_gap", 0.5))
+
+    def x_range(self, sweep):
+        """
+        Time axis of a graph, the time before now when it scrolls or fixed when it sweeps
+        """
+        if sweep is not None:
+            return 0, sweep.duration
+        return self.time_range[0], self.time_range[1]
+
+    def graph_data(self, buffer, decimator, now, sweep=None):
+        """
+        Returns the times, relative to now, and the values of the samples in the time range, or of
+        their decimation if the decimator isn't None. A sweep graph returns its fixed arrays, with
+        NaN in the gap.
+        """
+        if sweep is not None:
+            return sweep.update(now)
+        if decimator is not None:
+            t, values = decimator.update(now)
+        else:
+            data = buffer.window(self.time_range[1] - self.time_range[0], now,
+                                 self.data_points - 1)
+            t, values = data[0], data[1]
+        return t - now, values
+
     # try to use this funtion without having to create a new instance every cycle
     def update_graphs(self):
         """
@@ -975,34 +1091,41 @@ class DesignerMainWindow(QtWidgets.QMainWindow):
         profile_time = False
         if profile_time:
             start_time = time.time()
+        # Time spent in the GUI thread, shown with the frame rate of the graphs
+        frame_start = time.perf_counter()
 
         # Update the graph data with data only within the chosen time_range
-        now = time.time()
-        i_tr_prs = np.where(now - self.prs_data[0, :] < 
-                            self.time_range[1] - self.time_range[0])[0]
-        self.prs_graph.setData(self.prs_data[0, i_tr_prs] - now, self.prs_data[1, i_tr_prs])
+        # The buffers are ordered in time, so the samples inside the time range are the last ones
+        # and can be read as views, without copying, with a binary search for the oldest one. The
+        # pipeline thread writes the next sample over the oldest one, so the views are limited to
+        # data_points - 1 samples to never include it. By default they are decimated to the
+        # resolution of the plots
+        now = self.clock.time()
+        prs = self.graph_data(self.prs_data, self.prs_decimator, now,
+                              self.prs_sweep)
+        self.prs_graph.setData(*prs)
         # Updates the graph title
-        self.prs_pw.setTitle(f"Pressão: {self.prs_data[1, 0]:.1f} cmH2O", **self.ttl_style)
+        self.prs_pw.setTitle(f"Pressão: {self.prs_data.latest()[1]:.1f} cmH2O", **self.ttl_style)
 
         if profile_time == True:
             time_at_pressure = time.time()
             print(f"Until pressure graph: {time_at_pressure - start_time:.4f} s")
         
         # Update the graph data with data only within the chosen time_range
-        now = time.time()
-        i_tr_flw = np.where(now - self.flw_data[0, :] < 
-                            self.time_range[1] - self.time_range[0])[0]
-        self.flw_pw.setTitle(f"Fluxo: {self.flw_data[1, 0]:.1f} l/min", **self.ttl_style)
-        self.flw_graph.setData(self.flw_data[0, i_tr_flw] - now, self.flw_data[1, i_tr_flw])
+        now = self.clock.time()
+        flw = self.graph_data(self.flw_data, self.flw_decimator, now,
+                              self.flw_sweep)
+        self.flw_pw.setTitle(f"Fluxo: {self.flw_data.latest()[1]:.1f} l/min", **self.ttl_style)
+        self.flw_graph.setData(*flw)
 
         if profile_time == True:
             time_at_flow = time.time()
             print(f"Until flow graph: {time_at_flow - start_time:.4f} s")
 
-        i_tr_vol = np.where(now - self.vol_data[0, :] < 
-                    self.time_range[1] - self.time_range[0])[0]
-        self.vol_pw.setTitle(f"Volume: {self.vol_data[1, 0]:.0f} ml", **self.ttl_style)
-        self.vol_graph.setData(self.vol_data[0, i_tr_vol] - now, self.vol_data[1, i_tr_vol])
+        vol = self.graph_data(self.vol_data, self.vol_decimator, now,
+                              self.vol_sweep)
+        self.vol_pw.setTitle(f"Volume: {self.vol_data.latest()[1]:.0f} ml", **self.ttl_style)
+        self.vol_graph.setData(*vol)
 
         if profile_time == True:
             time_at_volume = time.time()
@@ -1017,7 +1140,7 @@ class DesignerMainWindow(QtWidgets.QMainWindow):
             min_range_vol = [-5, 50]
             # Tries to get the max and min from each data set 
             try:
-                range_vol = [np.min(self.vol_data[1, i_tr_vol]), np.max(self.vol_data[1, i_tr_vol])]
+                range_vol = [np.nanmin(vol[1]), np.nanmax(vol[1])]
              # Adjusts the minimum and maximum, if the measured values are outside the minimum range
                 self.vol_pw.setYRange(np.min([range_vol[0], min_range_vol[0]]), 
                                       np.max([range_vol[1], min_range_vol[1]]))
@@ -1025,7 +1148,7 @@ class DesignerMainWindow(QtWidgets.QMainWindow):
                 pass
             min_range_prs = [-0.2, 5]
             try:
-                range_prs = [np.min(self.prs_data[1, i_tr_prs]), np.max(self.prs_data[1, i_tr_prs])]
+                range_prs = [np.nanmin(prs[1]), np.nanmax(prs[1])]
                 self.prs_pw.setYRange(np.min([range_prs[0], min_range_prs[0]]), 
                                     np.max([range_prs[1], min_range_prs[1]]))
             except:
@@ -1033,22 +1156,35 @@ class DesignerMainWindow(QtWidgets.QMainWindow):
 
             min_range_flw = [-0.1, 1]
             try:
-                range_flw = [np.min(self.flw_data[1, i_tr_flw]), np.max(self.flw_data[1, i_tr_flw])]
+                range_flw = [np.nanmin(flw[1]), np.nanmax(flw[1])]
                 self.flw_pw.setYRange(np.min([range_flw[0], min_range_flw[0]]), 
                                     np.max([range_flw[1], min_range_flw[1]]))
             except:
                 pass
             mean_pts = 50
             try:
-                FPS = np.nan_to_num(1.0 / np.mean(self.vol_data[0, 0:mean_pts] - 
-                                    self.vol_data[0, 1:1+mean_pts]))
+                FPS = np.nan_to_num(1.0 / np.mean(np.diff(self.vol_data.view(mean_pts + 1)[0])))
             except:
                 FPS = 0
-            self.fps_lbl.setText(f"FPS: {FPS:.2f}")
+            # Frame rate of the graphs and time of the GUI thread per frame
+            gui_fps = N / (frame_start - self.frames_start)
+            frame_text = f"GUI: {gui_fps:.0f} FPS, {1000 * self.frame_time / N:.1f} ms"
+            self.frames_start = frame_start
+            self.frame_time = 0.0
+            if "control_period" in self.cd:
+                self.fps_lbl.setText(f"FPS: {FPS:.2f} | {frame_text} | Ctrl: "
+                                     f"{1000 * self.cd['control_period']:.1f} ± "
+                                     f"{1000 * self.cd['control_jitter']:.1f} ms, "
+                                     f"{self.cd['control_overruns']} overruns")
+            else:
+                self.fps_lbl.setText(f"FPS: {FPS:.2f} | {frame_text}")
             self.run_counter = 0
         self.run_counter += 1
+        self.frame_time += time.perf_counter() - frame_start
 
     def exit(self):
+        if self.recorder is not None:
+            self.recorder.close()
         sys.exit()
     
     def start_interface(self):
@@ -1141,6 +1277,9 @@ class DesignerMainWindow(QtWidgets.QMainWindow):
                           self.al_apnea_min_spb,
                           self.al_apnea_max_spb],
                        4:[self.cfg_tare_spb]}
+        # The tabs without spinboxes (trends) ignore the buttons
+        if c_tab not in tab_content:
+            return
         # By default will choose the first spinbox on the current tab.
         current_spb = tab_content[c_tab][0]
         # Going through the spinboxes of the current tab and checking whether they have the focus
@@ -1250,6 +1389,8 @@ class DesignerMainWindow(QtWidgets.QMainWindow):
         """
         # Sends the update to the piston worker
         self.worker_piston.mode = mode
+        if self.recorder is not None:
+            self.recorder.add_event(self.clock.time(), "mode", mode=mode)
         if mode == 1:  # 'VCV'
             self.VCV_start_btn.setEnabled(False)
             self.PCV_start_btn.setEnabled(True)
@@ -1289,14 +1430,44 @@ class DesignerMainWindow(QtWidgets.QMainWindow):
         Receives information about the last cycle in the form of a dict and updates the GUI based on
         that.
         """
-        # Creating a self.cd so that other methods can access it
-        self.cd = cd
-        self.inhale_time_val.setText(f"{self.cd['inhale_duration']:.1f} s")
-        self.exhale_time_val.setText(f"{self.cd['exhale_duration']:.1f} s")
-        self.IE_ratio_val.setText(f"1:{self.cd['IE_ratio']:.1f}")
-        self.peak_pressure_val.setText(f"{self.cd['peak_pressure']:.2f} cmH2O")
-        self.tidal_volume_val.setText(f"{self.cd['tidal_volume']:.0f} ml")
-        self.tidal_volume_val.setText(f"{self.cd['tidal_volume']:.0f} ml")
+        # Creating a self.cd so that other methods can access it. The cycle data comes from the
+        # piston control (durations of the cycle) and from the data processing (metrics of the
+        # breaths), each one updates its own values
+        self.cd.update(cd)
+        self.inhale_time_val.setText(f"{self.cd.get('inhale_duration', 0):.1f} s")
+        self.exhale_time_val.setText(f"{self.cd.get('exhale_duration', 0):.1f} s")
+        self.IE_ratio_val.setText(f"1:{self.cd.get('IE_ratio', 1):.1f}")
+        self.peak_pressure_val.setText(f"{self.cd.get('peak_pressure', 0):.2f} cmH2O")
+        self.tidal_volume_val.setText(f"{self.cd.get('tidal_volume', 0):.0f} ml")
+        self.peep_val.setText(f"{self.cd.get('PEEP', 0):.1f} cmH2O")
+
+    def update_alarms(self, alarms):
+        """
+        Receives the list of AlarmStatus of the latched alarms and shows them in the status bar,
+        the active ones in red and the ones that already cleared in parentheses
+        """
+        messages = []
+        for alarm in alarms:
+            message = alarm.message if alarm.active else f"({alarm.message})"
+            if alarm.active and not alarm.acknowledged:
+                message = f"<b>{message}</b>"
+            messages.append(message)
+        color = "red" if any(alarm.active for alarm in alarms) else "black"
+        self.alarm_lbl.setText(f"<span style='color: {color}'>{' | '.join(messages)}</span>")
+
+    def annunciate_alarms(self):
+        """
+        Beeps and blinks while there are alarms that weren't acknowledged: every second for the
+        high priority, every 3 seconds for the medium priority
+        """
+        self.alarm_ticks += 1
+        priority = self.alarms.annunciation()
+        if priority == HIGH:
+            QtCore.QTimer.singleShot(1, lambda: self.worker_buzzer.long_buzz())
+            QtCore.QTimer.singleShot(1, lambda: self.worker_led.long_blink())
+        elif priority == MEDIUM and self.alarm_ticks % 3 == 0:
+            QtCore.QTimer.singleShot(1, lambda: self.worker_buzzer.short_buzz())
+            QtCore.QTimer.singleShot(1, lambda: self.worker_led.blink())
 
     # def get_bme(self):
     #     sensor = bme()
@@ -0,0 +1,166 @@
+"""
+Respiratory metrics calculated for every breath
+"""
+from collections import deque
+import math
+import numpy as np
+
+class BreathMetrics():
+    """
+    Calculates the metrics of each breath with running reductions: every sample updates a few
+    sums, maxima and flags, and the BreathRecord of the segmenter closes the breath, so the
+    metrics are ready at the sample that ends the breath, without scanning the samples again.
+    Per breath:
+    - peak_pressure: maximum pressure (cm H2O) and peak_flow: maximum inspiratory flow (l/min)
+    - plateau_pressure: mean pressure during the end inspiratory pause, when the flow stays
+      between the thresholds after the inspiration and before the expiration. NaN without pause
+    - PEEP: mean pressure in the last peep_window seconds of the breath
+    - tidal_volume_insp, tidal_volume_exp: inspired and expired volumes (ml), tidal_volume is the
+      inspired one
+    - respiratory_rate (breaths/min) and minute_volume (l/min, expired), over the breaths that
+      ended in the last rate_window seconds
+    - breath_IE_ratio: expiratory / inspiratory time
+    - compliance (ml/cm H2O) and resistance (cm H2O/(l/s)): with a pause, the static compliance
+      VT / (plateau - PEEP) and the resistance (peak - plateau) / end inspiratory flow. Without
+      pause, least squares fit of the equation of motion P = V / C + R * F + P0 to all the samples
+      of the breath, accumulated as the sums of the normal equations
+    The callbacks receive a dictionary with the metrics, with the same names as the cycle data.
+    """
+    def __init__(self, threshold=2.0, peep_window=0.1, rate_window=60.0, settle_time=0.05):
+        self.threshold = threshold  # l/min, same as the segmentation
+        self.peep_window = peep_window
+        self.rate_window = rate_window
+        # Time for the pressure to settle at the start of the pause
+        self.settle_time = settle_time
+        self.metrics_callbacks = []
+        # (end, duration, expired volume) of the breaths in the rate window
+        self.history = deque()
+        # (instant, pressure) of the last peep_window seconds, to calculate the PEEP at any rate
+        self.recent = deque()
+        self.result = None
+        self.reset()
+
+    def add_metrics_callback(self, callback):
+        self.metrics_callbacks.append(callback)
+
+    def reset(self):
+        """
+        Starts the reductions of a new breath
+        """
+        self.peak = -math.inf
+        self.peak_flow = 0.0
+        self.inspiring = False
+        self.expired = False
+        self.end_insp_flow = math.nan
+        # Sum and number of samples of the pause, after the settling time
+        self.pause_start = None
+        self.pause_sum = 0.0
+        self.pause_n = 0
+        # Sums of the normal equations of the fit, with plain floats, that are faster than small
+        # arrays for one sample
+        self.s_vv = self.s_vf = self.s_ff = self.s_v = self.s_f = self.n = 0.0
+        self.s_pv = self.s_pf = self.s_p = 0.0
+
+    def add(self, t, pressure, flow, volume):
+        """
+        Adds one sample of the current breath: pressure (cm H2O), flow (l/min) and volume since
+        the start of the breath (ml)
+        """
+        if pressure > self.peak:
+            self.peak = pressure
+        if flow > self.peak_flow:
+            self.peak_flow = flow
+        recent = self.recent
+        recent.append((t, pressure))
+        # The breath ends at t or later, so older samples can't be in its PEEP window
+        while recent[0][0] < t - self.peep_window:
+            recent.popleft()
+        if flow > self.threshold:
+            if not self.expired:
+                self.inspiring = True
+                self.end_insp_flow = flow
+                # The flow rose again, the pause didn't start yet
+                self.pause_start = None
+                self.pause_sum = 0.0
+                self.pause_n = 0
+        elif flow < -self.threshold:
+            if self.inspiring:
+                self.expired = True
+        elif self.inspiring and not self.expired:
+            if self.pause_start is None:
+                self.pause_start = t
+            if t - self.pause_start >= self.settle_time:
+                self.pause_sum += pressure
+                self.pause_n += 1
+        # Fit of the equation of motion, flow in l/s
+        flow = flow / 60.0
+        self.s_vv += volume * volume
+        self.s_vf += volume * flow
+        self.s_ff += flow * flow
+        self.s_v += volume
+        self.s_f += flow
+        self.n += 1
+        self.s_pv += pressure * volume
+        self.s_pf += pressure * flow
+        self.s_p += pressure
+
+    def end_breath(self, record):
+        """
+        Finishes the metrics of the breath with the record of the segmenter, calls the callbacks
+        and starts the next breath. Returns the metrics.
+        """
+        peep_values = [p for t, p in self.recent if t >= record.end - self.peep_window]
+        peep = float(np.mean(peep_values)) if peep_values else math.nan
+        if self.pause_n > 0:
+            plateau = self.pause_sum / self.pause_n
+            method = "static"
+            compliance = (record.vt_insp / (plateau - peep) if plateau > peep else math.nan)
+            if self.end_insp_flow > 0:
+                resistance = (self.peak - plateau) / (self.end_insp_flow / 60.0)
+            else:
+                resistance = math.nan
+        else:
+            plateau = math.nan
+            method = "fit"
+            xx = [[self.s_vv, self.s_vf, self.s_v],
+                  [self.s_vf, self.s_ff, self.s_f],
+                  [self.s_v, self.s_f, self.n]]
+            try:
+                elastance, resistance, p0 = np.linalg.solve(xx, [self.s_pv, self.s_pf, self.s_p])
+                compliance = 1.0 / float(elastance) if elastance > 0 else math.nan
+                resistance = float(resistance)
+            except np.linalg.LinAlgError:
+                compliance = resistance = math.nan
+
+        # Rate and minute volume of the last breaths
+        self.history.append((record.end, record.end - record.start, record.vt_exp))
+        while self.history and self.history[0][0] < record.end - self.rate_window:
+            self.history.popleft()
+        duration = sum(h[1] for h in self.history)
+        if duration > 0:
+            rate = 60.0 * len(self.history) / duration
+            minute_volume = sum(h[2] for h in self.history) / duration * 60.0 / 1000.0
+        else:
+            rate = minute_volume = math.nan
+
+        self.result = {"breath_number": record.number,
+                       "breath_start": record.start,
+                       "breath_end": record.end,
+                       "peak_pressure": self.peak if self.peak > -math.inf else math.nan,
+                       "peak_flow": self.peak_flow,
+                       "plateau_pressure": plateau,
+                       "PEEP": peep,
+                       "tidal_volume": record.vt_insp,
+                       "tidal_volume_insp": record.vt_insp,
+                       "tidal_volume_exp": record.vt_exp,
+                       "minute_volume": minute_volume,
+                       "respiratory_rate": rate,
+                       "breath_IE_ratio": record.t_exp / record.t_insp if record.t_insp > 0
+                                          else math.nan,
+                       "compliance": compliance,
+                       "resistance": resistance,
+                       "mechanics_method": method}
+        self.reset()
+        for callback in self.metrics_callbacks:
+            callback(self.result)
+        return self.result
@@ -0,0 +1,146 @@
+"""
+Processing of the data read from the sensors: tare, buffering and volume integration
+"""
+from collections import deque
+import numpy as np
+from clock import system_clock
+from integrator import VolumeIntegrator
+from latest_sample import LatestSample
+from metrics import BreathMetrics
+from ring_buffer import RingBuffer
+from segmentation import BreathSegmenter
+
+class SamplePipeline():
+    """
+    Receives the samples of pressure and flow as soon as they are read from the sensors, stores
+    them in ring buffers and calculates the volume. The results are published separately: the
+    piston control reads only the newest values from the LatestSample mailbox, while the GUI reads
+    the ring buffers at its own frame rate, so a slow frame never delays a control decision.
+    """
+    def __init__(self, data_points, start_time, clock=system_clock, volume_calibration=5.0,
+                 volume_reset_timeout=15.0, breath_threshold=2.0):
+        # prs_data has three rows, 0 = time, 1 = pressure - tare, 2 = raw_pressure
+        self.prs_data = RingBuffer(3, data_points, fill=(start_time, 0, 0))
+        self.prs_tare = 0
+        # flw_data has three rows, 0 = time, 1 = flow - tare, 2 = raw_flow
+        self.flw_data = RingBuffer(3, data_points, fill=(start_time, 0, 0))
+        self.flw_tare = 0
+        # vol_data has four rows, 0 = time, 1 = volume, 2 = inspired volume, 3 = expired volume
+        self.vol_data = RingBuffer(4, data_points, fill=(start_time, 0, 0, 0))
+
+        # Newest pressure, flow and volume, read by the piston control thread. Its event is set
+        # when new values are available, the piston control can wait on it instead of polling
+        self.latest = LatestSample(clock)
+        # Newest raw values of the sensors
+        self.pressure = None
+        self.flow = None
+
+        # The volume is integrated since the start of the last breath, found by the segmenter
+        # with the stages of the piston control (set_phase) and the flow. If the ventilator is
+        # stopped, or the patient doesn't breathe, the integral restarts after
+        # volume_reset_timeout seconds, so the offset of the flow doesn't accumulate forever
+        self.integrator = VolumeIntegrator(volume_calibration)
+        self.segmenter = BreathSegmenter(self.integrator, breath_threshold,
+                                         reset_timeout=volume_reset_timeout)
+        self.inhale_instant = None
+        # Records of the last breaths, the consumers that need each breath should register a
+        # callback with add_breath_callback
+        self.breaths = deque(maxlen=100)
+        self.add_breath_callback(self.breaths.append)
+        # Metrics of each breath, finished by the record of the segmenter
+        self.metrics = BreathMetrics(breath_threshold)
+        self.add_breath_callback(self.metrics.end_breath)
+        # Functions called with every sample, see add_sample_callback
+        self.sample_callbacks = []
+        # SessionRecorder that receives every sample, with the raw values and the volume
+        self.recorder = None
+
+        # The tare is requested by other threads, but it's calculated by the pipeline, which is the
+        # only one that writes in the buffers
+        self.get_tare = False
+        self.tare_duration = 0
+
+    def add_pressure(self, t, pressure):
+        """
+        Stores a new pressure sample, sent to the piston control with the next volume
+        """
+        self.pressure = pressure
+        self.prs_data.append((t, pressure - self.prs_tare, pressure))
+
+    def add_flow(self, t, flow):
+        """
+        Stores a new flow sample, sent to the piston control with the next volume, and adds it to
+        the volume integral
+        """
+        self.flow = flow
+        self.flw_data.append((t, flow - self.flw_tare, flow))
+        self.segmenter.add(t, flow - self.flw_tare, self.flw_data.count - 1)
+        if self.pressure is not None:
+            pressure = self.pressure - self.prs_tare
+            flow = flow - self.flw_tare
+            self.metrics.add(t, pressure, flow, self.integrator.volume)
+            for callback in self.sample_callbacks:
+                callback(t, pressure, flow)
+            if self.recorder is not None:
+                self.recorder.add(t, self.pressure, pressure, self.flow, flow,
+                                  self.integrator.volume)
+
+    def add_breath_callback(self, callback):
+        """
+        The callback receives the BreathRecord of every breath when it ends, in the pipeline
+        thread, so it must be quick. The samples of the breath are in the ring buffers, e.g.
+        flw_data.view_range(record.i_start, record.i_end), until they are overwritten.
+        """
+        self.segmenter.add_breath_callback(callback)
+
+    def add_sample_callback(self, callback):
+        """
+        The callback receives the instant, pressure and flow, with the tare, of every flow sample,
+        in the pipeline thread, so it must be quicker than the period of the sensors
+        """
+        self.sample_callbacks.append(callback)
+
+    @property
+    def volume_calibration(self):
+        return self.integrator.calibration
+
+    @volume_calibration.setter
+    def volume_calibration(self, calibration):
+        self.integrator.calibration = calibration
+
+    def set_phase(self, stage, t):
+        """
+        Receives the stage of the breath from the piston control (stage callback of the
+        BreathController). The volume restarts from zero at the start of every inhale. It's called
+        by the control thread, the segmenter applies it in the pipeline thread with the next flow
+        sample.
+        """
+        if stage == 1:
+            self.inhale_instant = t
+        self.segmenter.set_phase(stage, t)
+
+    def update_volume(self, t):
+        """
+        Stores the volume integrated since the start of the last breath at the instant t
+        """
+        integrator = self.integrator
+        self.vol_data.append((t, integrator.volume, integrator.inspired, integrator.expired))
+        # Publishes the values as one consistent sample
+        self.latest.publish(t, self.pressure, self.flow, integrator.volume)
+
+    def request_tare(self, tare_duration):
+        """
+        Asks the pipeline to calculate the tare with the data of the last tare_duration seconds
+        """
+        self.tare_duration = tare_duration
+        self.get_tare = True
+
+    def tare(self, now):
+        """
+        Gets the tare of the pressure and flow sensors and updates the stored data
+        """
+        self.flw_tare = np.mean(self.flw_data.window(self.tare_duration, now)[2])
+        self.flw_data.set_row_offset(1, 2, self.flw_tare)
+        self.prs_tare = np.mean(self.prs_data.window(self.tare_duration, now)[2])
+        self.prs_data.set_row_offset(1, 2, self.prs_tare)
+        self.get_tare = False
@@ -0,0 +1,186 @@
+"""
+Model of the patient's lungs, the AMBU and the pneumatic piston, used as a stand-in for the real
+system when testing the control modes without compressed air.
+"""
+import math
+import threading
+
+class LungPlant():
+    """
+    Single compartment lung with compliance and airway resistance, inflated by an AMBU squeezed by
+    the piston, with a PEEP valve on the exhalation and a leak at the patient interface.
+    Units: volume in ml, pressure in cm H2O, resistance in cm H2O/(l/s), flow in l/min.
+
+    - Piston going down (command 1): the bag is squeezed with drive_pressure and the flow into the
+      lung is limited by the airway resistance and by the maximum speed of the piston. The piston
+      moves proportionally to the volume that left the bag, until the bottom.
+    - Piston going up (command -1) or stopped at the top: the exhalation valve is open, the lung
+      empties down to the PEEP. If the patient's effort overcomes the opening pressure of the
+      intake valve of the AMBU, it inhales from the bag. The piston goes up at constant speed,
+      until the top.
+    - Piston stopped in the middle of the stroke (command 0): the valve stays closed (plateau).
+
+    The flow and pressure are the ones seen by the sensors, between the AMBU and the patient, so the
+    leak is not included in the measured flow.
+    Inside each regime the volume follows dV/dt = a - b * V, which is integrated exactly with an
+    exponential, so steps of a few ms are accurate and the model runs many breaths per second.
+    The end stop callbacks are called with "down" or "up" when the piston reaches the bottom or the
+    top, like the interrupts of the position sensors.
+    """
+    def __init__(self, compliance=50.0, resistance=10.0, leak_resistance=float("inf"),
+                 peep=5.0, drive_pressure=40.0, stroke_volume=700.0, stroke_time_down=0.6,
+                 stroke_time_up=1.0, effort_pressure=0.0, effort_rate=0.0, effort_time=0.8,
+                 intake_pressure=1.0, position=0.5, max_step=0.002):
+        self.compliance = compliance  # ml/cm H2O
+        self.resistance = resistance / 1000.0  # cm H2O/(ml/s)
+        # Leak conductance in (ml/s)/cm H2O, zero if there is no leak
+        self.leak = 1000.0 / leak_resistance
+        self.peep = peep
+        self.drive_pressure = drive_pressure
+        # Volume pushed out of the AMBU by a full stroke of the piston
+        self.stroke_volume = stroke_volume
+        # Maximum flow (ml/s) and speed of return of the piston (stroke/s)
+        self.max_flow = stroke_volume / stroke_time_down
+        self.speed_up = 1.0 / stroke_time_up
+        # Spontaneous breathing: negative muscle pressure (half sine) effort_rate times per minute
+        self.effort_pressure = effort_pressure
+        self.effort_rate = effort_rate
+        self.effort_time = effort_time
+        # Opening pressure of the intake valve of the AMBU, the pressure drops below the atmospheric
+        # when the patient inhales from the bag, which triggers the PSV
+        self.intake_pressure = intake_pressure
+        self.max_step = max_step
+
+        # State
+        self.position = position  # 0 = top, 1 = bottom
+        self.command = 0  # 1 = going down, -1 = going up, 0 = stopped
+        # Volume above the functional residual capacity, starts at the PEEP
+        self.volume = peep * compliance
+        self.flow = 0.0  # ml/s, at the sensor
+        self.pressure = peep  # at the sensor
+        self.t = None
+        self.end_stop_callbacks = []
+        # The plant is read by the sensors thread and commanded by the control thread
+        self.lock = threading.RLock()
+
+    def add_end_stop_callback(self, callback):
+        self.end_stop_callbacks.append(callback)
+
+    def end_stop(self, sens):
+        for callback in self.end_stop_callbacks:
+            callback(sens)
+
+    def muscle_pressure(self, t):
+        """
+        Pressure generated by the patient's respiratory muscles at the instant t
+        """
+        if self.effort_rate <= 0 or self.effort_pressure == 0:
+            return 0.0
+        phase = t % (60.0 / self.effort_rate)
+        if phase > self.effort_time:
+            return 0.0
+        return -self.effort_pressure * math.sin(math.pi * phase / self.effort_time)
+
+    def set_command(self, command, t):
+        with self.lock:
+            self.advance(t)
+            self.command = command
+
+    def valve_coefficients(self, p_mus):
+        """
+        Returns (a, b) of the flow through the valves (ml/s) = a - b * volume, in the current regime
+        """
+        R = self.resistance
+        K = 1.0 / self.compliance
+        p_alv = K * self.volume + p_mus
+        if self.command == 1 and self.position < 1:
+            # Inhale, limited by the resistance or by the piston speed
+            if (self.drive_pressure - p_alv) / R > self.max_flow:
+                return self.max_flow, 0.0
+            if self.drive_pressure > p_alv:
+                return (self.drive_pressure - p_mus) / R, K / R
+            return 0.0, 0.0
+        if self.command == -1 or self.position <= 0:
+            # Exhalation valve open
+            if p_alv > self.peep:
+                return (self.peep - p_mus) / R, K / R
+            if p_alv < -self.intake_pressure:
+                # The patient inhales from the bag, through its intake valve
+                return (-self.intake_pressure - p_mus) / R, K / R
+        return 0.0, 0.0
+
+    def step(self, dt, t):
+        """
+        Advances the model by dt, with the muscle pressure of the instant t
+        """
+        p_mus = self.muscle_pressure(t)
+        K = 1.0 / self.compliance
+        a_v, b_v = self.valve_coefficients(p_mus)
+        # The leak takes leak * p_alv out of the lung
+        a = a_v - self.leak * p_mus
+        b = b_v + self.leak * K
+        V = self.volume
+        if b > 0:
+            V_inf = a / b
+            decay = math.exp(-b * dt)
+            V_new = V_inf + (V - V_inf) * decay
+            # Integral of V during the step
+            V_int = V_inf * dt + (V - V_inf) * (1.0 - decay) / b
+        else:
+            V_new = V + a * dt
+            V_int = (V + V_new) / 2 * dt
+        self.volume = V_new
+
+        # Movement of the piston
+        if self.command == 1 and self.position < 1:
+            pushed = a_v * dt - b_v * V_int
+            self.position = min(1.0, self.position + pushed / self.stroke_volume)
+            if self.position == 1:
+                self.end_stop("down")
+        elif self.command == -1 and self.position > 0:
+            self.position = max(0.0, self.position - self.speed_up * dt)
+            if self.position == 0:
+                self.end_stop("up")
+
+        # Values seen by the sensors at the end of the step
+        a_v, b_v = self.valve_coefficients(p_mus)
+        self.flow = a_v - b_v * V_new
+        self.pressure = K * V_new + p_mus + self.resistance * self.flow
+
+    def advance(self, t):
+        """
+        Advances the model until the instant t
+        """
+        with self.lock:
+            if self.t is None:
+                self.t = t
+            while self.t < t:
+                dt = min(self.max_step, t - self.t)
+                self.t += dt
+                self.step(dt, self.t)
+
+    def read(self, t):
+        """
+        Returns the pressure (cm H2O) and flow (l/min) at the sensors at the instant t
+        """
+        with self.lock:
+            self.advance(t)
+            return self.pressure, self.flow * 0.06
+
+    def run(self, duration, sample_rate):
+        """
+        Advances the model during duration seconds with the current command and returns the lists
+        of instants, pressures and flows sampled at sample_rate
+        """
+        if self.t is None:
+            self.t = 0.0
+        times, pressures, flows = [], [], []
+        n = int(round(duration * sample_rate))
+        t0 = self.t
+        for i in range(1, n + 1):
+            t = t0 + i / sample_rate
+            pressure, flow = self.read(t)
+            times.append(t)
+            pressures.append(pressure)
+            flows.append(flow)
+        return times, pressures, flows
@@ -0,0 +1,249 @@
+"""
+Recording of the session: every sample and event, in memory mapped files
+"""
+from collections import deque
+import glob
+import json
+import os
+import shutil
+import threading
+import time
+import numpy as np
+
+# Record of one sample, fixed width, little endian and without padding:
+# - t: instant of the sample (time.time(), s)
+# - pressure_raw, pressure: pressure without and with the tare (cm H2O)
+# - flow_raw, flow: flow without and with the tare (l/min)
+# - volume: volume since the start of the breath (ml)
+# - phase: stage of the BreathController (0 wait, 1 inhale, 2 exhale), -1 before the first one
+# - piston: outputs of the piston, bit 0 = down and bit 1 = up
+RECORD_DTYPE = np.dtype([("t", "<f8"), ("pressure_raw", "<f4"), ("pressure", "<f4"),
+                         ("flow_raw", "<f4"), ("flow", "<f4"), ("volume", "<f4"), ("phase", "i1"),
+                         ("piston", "u1")])
+
+# Header at the start of every segment file, 64 bytes:
+# - magic, version and record_size identify the format
+# - capacity: number of records preallocated in the file
+# - count: number of valid records, updated at every flush, after the records
+# - start: instant when the segment was created (s)
+# - index: number of the segment in the session
+HEADER_DTYPE = np.dtype([("magic", "S8"), ("version", "<u4"), ("record_size", "<u4"),
+                         ("capacity", "<u8"), ("count", "<u8"), ("start", "<f8"),
+                         ("index", "<u4"), ("reserved", "u1", (20,))])
+MAGIC = b"VENTREC"
+VERSION = 1
+# Extensions of the files of a segment, the records and the events (one JSON object per line)
+RECORDS_EXTENSION = ".vrec"
+EVENTS_EXTENSION = ".events.jsonl"
+
+class SessionRecorder():
+    """
+    Appends every sample of the pipeline to segment files in the directory, so the data of the
+    whole session can be read later (see session_reader.py). Each segment file has a header and
+    room for segment_records records, preallocated when it's created, so the disk can't run out in
+    the middle of a segment, and it's mapped in memory with np.memmap.
+    The pipeline thread (add) only copies the samples to a small batch in memory and hands the
+    full batches, and the partial one every flush_interval seconds, to a flusher thread, so a slow
+    disk never delays the processing of the samples. The flusher copies the batches to the mapped
+    file, writes the mapped pages to the disk and only then updates the count of the header, so a
+    crash, or a power failure, loses at most the last flush interval.
+    When a segment is full the next one is created, and the oldest segment files in the directory
+    (also of the previous sessions) are deleted to keep the total below max_bytes.
+    The events (changes of the settings, of the mode, alarms) are written by the flusher to a JSON
+    lines file next to each segment. They can be added by any thread.
+    """
+    def __init__(self, directory, segment_records=2000000, max_bytes=1024 * 2 ** 20,
+                 flush_interval=1.0, batch_size=256, log=print):
+        self.directory = directory
+        self.segment_records = segment_records
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.log = log
+        os.makedirs(directory, exist_ok=True)
+        # Name of the files of this session, followed by the index of the segment
+        self.prefix = os.path.join(directory, time.strftime("session_%Y%m%d_%H%M%S"))
+        self.batch = np.zeros(batch_size, RECORD_DTYPE)
+        self.n_batch = 0
+        # Batches handed to the flusher thread and events waiting to be written, the deques can be
+        # appended by one thread and emptied by another without a lock
+        self.batches = deque()
+        self.events = deque()
+        # Newest stage of the controller and the piston, whose outputs are read at every sample
+        self.phase = -1
+        self.piston = None
+        # Instant of the last hand over of a batch
+        self.last_flush = None
+        # The files are only used by the flusher thread
+        self.index = -1
+        self.header = None
+        self.records = None
+        self.count = 0
+        self.path = None
+        self.closed = False
+        self.stopping = False
+        self.wake = threading.Event()
+        self.flusher = threading.Thread(target=self.flush_loop, daemon=True)
+        self.flusher.start()
+
+    def segment_size(self):
+        return HEADER_DTYPE.itemsize + self.segment_records * RECORD_DTYPE.itemsize
+
+    def set_phase(self, stage, t):
+        """
+        Receives the stage of the BreathController (stage callback)
+        """
+        self.phase = stage
+
+    def add(self, t, pressure_raw, pressure, flow_raw, flow, volume):
+        """
+        Adds one sample, called by the pipeline thread
+        """
+        piston = self.piston
+        outputs = 0 if piston is None else piston.out_down | piston.out_up << 1
+        self.batch[self.n_batch] = (t, pressure_raw, pressure, flow_raw, flow, volume, self.phase,
+                                    outputs)
+        self.n_batch += 1
+        if self.last_flush is None:
+            self.last_flush = t
+        if self.n_batch == len(self.batch):
+            self.hand_over()
+        elif t - self.last_flush >= self.flush_interval:
+            self.hand_over()
+            self.last_flush = t
+            self.wake.set()
+
+    def hand_over(self):
+        """
+        Gives the samples of the batch to the flusher thread and starts a new batch
+        """
+        if self.n_batch:
+            self.batches.append(self.batch[:self.n_batch])
+            self.batch = np.zeros(self.batch_size, RECORD_DTYPE)
+            self.n_batch = 0
+
+    def add_event(self, t, kind, **data):
+        """
+        Adds an event of the instant t, e.g. add_event(t, "mode", mode=1), from any thread
+        """
+        self.events.append(dict(t=t, kind=kind, **data))
+
+    def flush_loop(self):
+        """
+        Flusher thread, writes the batches and the events every flush_interval seconds, or when the
+        pipeline thread hands over the partial batch
+        """
+        while not self.stopping:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            self.flush()
+        self.flush()
+        if self.records is not None:
+            self.close_segment()
+        self.closed = True
+
+    def write_batches(self):
+        """
+        Copies the batches to the mapped segment, creating the next segment when it's full
+        """
+        while self.batches:
+            batch = self.batches.popleft()
+            if self.closed:
+                continue
+            written = 0
+            while written < len(batch):
+                if self.records is None or self.count == self.segment_records:
+                    if not self.next_segment(batch[written]["t"]):
+                        break
+                n = min(len(batch) - written, self.segment_records - self.count)
+                self.records[self.count:self.count + n] = batch[written:written + n]
+                self.count += n
+                written += n
+
+    def flush(self):
+        """
+        Writes the batches, the mapped pages and then the count of valid records to the disk, and
+        the events to their file. Called by the flusher thread.
+        """
+        self.write_batches()
+        if self.records is not None:
+            self.sync()
+            events = []
+            while self.events:
+                events.append(self.events.popleft())
+            if events:
+                with open(self.path + EVENTS_EXTENSION, "a") as events_file:
+                    for event in events:
+                        events_file.write(json.dumps(event) + "\n")
+                    events_file.flush()
+                    os.fsync(events_file.fileno())
+
+    def sync(self):
+        # The records must reach the disk before the count that makes them valid
+        self.records.flush()
+        self.header[0]["count"] = self.count
+        self.header.flush()
+
+    def next_segment(self, t):
+        """
+        Closes the current segment and creates the next one. Returns False if there is no room for
+        it, in which case the recording stops.
+        """
+        if self.records is not None:
+            self.sync()
+            self.close_segment()
+        size = self.segment_size()
+        if not self.make_room(size):
+            self.log("Session recording stopped, there is no room for a new segment")
+            self.closed = True
+            return False
+        self.index += 1
+        self.path = f"{self.prefix}_{self.index:04d}"
+        with open(self.path + RECORDS_EXTENSION, "wb") as segment_file:
+            try:
+                # Allocates the blocks, a sparse file could fail to grow when the disk is full
+                os.posix_fallocate(segment_file.fileno(), 0, size)
+            except (AttributeError, OSError):
+                segment_file.truncate(size)
+        self.header = np.memmap(self.path + RECORDS_EXTENSION, HEADER_DTYPE, "r+", 0, (1,))
+        self.header[0] = (MAGIC, VERSION, RECORD_DTYPE.itemsize, self.segment_records, 0, t,
+                          self.index, 0)
+        self.header.flush()
+        self.records = np.memmap(self.path + RECORDS_EXTENSION, RECORD_DTYPE, "r+",
+                                 HEADER_DTYPE.itemsize, (self.segment_records,))
+        self.count = 0
+        return True
+
+    def make_room(self, size):
+        """
+        Deletes the oldest segments until a new one of size bytes fits in max_bytes and in the free
+        space of the disk. Returns whether it fits.
+        """
+        segments = sorted(glob.glob(os.path.join(self.directory, "*" + RECORDS_EXTENSION)))
+        sizes = [os.path.getsize(path) for path in segments]
+
+        def fits():
+            return (sum(sizes) + size <= self.max_bytes
+                    and shutil.disk_usage(self.directory).free >= size)
+
+        while segments and not fits():
+            path = segments.pop(0)
+            sizes.pop(0)
+            os.remove(path)
+            events = path[:-len(RECORDS_EXTENSION)] + EVENTS_EXTENSION
+            if os.path.exists(events):
+                os.remove(events)
+        return fits()
+
+    def close_segment(self):
+        self.header = None
+        self.records = None
+
+    def close(self):
+        """
+        Writes everything that is pending, closes the segment and stops the flusher thread
+        """
+        self.hand_over()
+        self.stopping = True
+        self.wake.set()
+        self.flusher.join()
@@ -0,0 +1,63 @@
+"""
+Plots rendered by a second process, see RemoteSpeedTest.py
+"""
+from pyqtgraph.widgets.RemoteGraphicsView import RemoteGraphicsView
+
+class RemoteCurve():
+    """
+    Curve of a RemotePlotWidget. The data is sent without waiting for the remote process, and if
+    it's still busy with the previous frame, the new one is dropped instead of piling up in the
+    pipe, so setData never blocks the GUI thread.
+    """
+    def __init__(self, curve):
+        self.curve = curve
+        # Without this, every access to curve.setData waits for the remote process
+        self.curve._setProxyOptions(deferGetattr=True)
+        self.request = None
+        self.frames = 0
+        self.dropped = 0
+
+    def setData(self, *args, **kwargs):
+        if self.request is not None and not self.request.hasResult():
+            self.dropped += 1
+            return
+        self.request = self.curve.setData(*args, _callSync="async", **kwargs)
+        self.frames += 1
+
+class RemotePlotWidget(RemoteGraphicsView):
+    """
+    Replacement for pg.PlotWidget with the same methods used by the interface, whose PlotItem lives
+    and is rendered in another process. The methods are forwarded to the remote PlotItem without
+    waiting for a reply (_callSync="off"), so the rendering runs in another core and the GUI
+    thread only sends the data and shows the image rendered in shared memory. The data of the
+    curves is sent with _callSync="async" instead, so a frame can be dropped while the previous
+    one is still pending (see RemoteCurve).
+    Items added to the plot must be created in the remote process, e.g. widget.pg.TextItem().
+    """
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.plotItem = self.pg.PlotItem()
+        # Speeds up the access to the methods of the remote PlotItem
+        self.plotItem._setProxyOptions(deferGetattr=True)
+        self.setCentralItem(self.plotItem)
+        self.rendered = 0
+
+    def __getattr__(self, name):
+        if name == "plotItem":
+            raise AttributeError(name)
+        method = getattr(self.plotItem, name)
+        return lambda *args, **kwargs: method(*args, _callSync="off", **kwargs)
+
+    def setBackground(self, background):
+        self._view.setBackground(background, _callSync="off")
+
+    def plot(self, *args, **kwargs):
+        """
+        Creates a curve in the remote process and returns its RemoteCurve
+        """
+        return RemoteCurve(self.plotItem.plot(*args, **kwargs))
+
+    def remoteSceneChanged(self, data):
+        # Counts the frames rendered by the remote process
+        self.rendered += 1
+        super().remoteSceneChanged(data)
@@ -0,0 +1,237 @@
+"""
+Replay backend: the IO classes of simulated.py, but the pressure gauge delivers the samples of a
+session recorded by the SessionRecorder, or of a CSV file (e.g. of a test bench), instead of
+reading the sensors. The pipeline, alarms, metrics and graphs run exactly as they did live.
+The source and the speed are read from the [Replay] section of the configuration file, or from
+the environment variables VENTILADOR_REPLAY and VENTILADOR_REPLAY_SPEED, which have priority:
+
+VENTILADOR_BACKEND=replay VENTILADOR_REPLAY=sessions VENTILADOR_REPLAY_SPEED=10 python main.py
+"""
+import configparser
+import math
+import os
+import threading
+import time
+import numpy as np
+from recorder import RECORD_DTYPE
+from session_reader import Session, parse_time
+from simulated import bme, buttons, buzzer, led
+
+# Environment variables that override the source (directory of the sessions, segment file or CSV
+# file) and the speed (1 = real time, N = N times faster, max = as fast as the processing allows)
+ENV_SOURCE = "VENTILADOR_REPLAY"
+ENV_SPEED = "VENTILADOR_REPLAY_SPEED"
+# The replayed session isn't recorded again
+RECORD_SESSION = False
+# The replayed pressure and flow already have the tare of the session, so they aren't tared again
+TARE_SAMPLES = False
+# Columns that a CSV file must have, the others of RECORD_DTYPE are optional
+CSV_COLUMNS = ("t", "pressure", "flow")
+
+def replay_settings(conf_file="config_file.conf"):
+    """
+    Returns the source, the speed (math.inf for max) and the start and end of the time range to
+    replay (see session_reader.parse_time), None for the whole session
+    """
+    conf = configparser.ConfigParser()
+    conf.read(conf_file)
+    section = conf["Replay"] if conf.has_section("Replay") else {}
+    source = os.environ.get(ENV_SOURCE) or section.get("source", "sessions")
+    speed = os.environ.get(ENV_SPEED) or section.get("speed", "1")
+    speed = math.inf if speed.strip().lower() == "max" else float(speed)
+    return source, speed, section.get("start") or None, section.get("end") or None
+
+def read_csv(path):
+    """
+    Reads a CSV file with a header, with the columns of RECORD_DTYPE (e.g. exported by
+    session_reader.py) or at least t (s), pressure (cm H2O) and flow (l/min). The missing phase is
+    -1, so the breaths are found by the flow.
+    """
+    data = np.atleast_1d(np.genfromtxt(path, delimiter=",", names=True))
+    missing = [name for name in CSV_COLUMNS if name not in data.dtype.names]
+    if missing:
+        raise ValueError(f"{path} doesn't have the columns {', '.join(missing)}")
+    records = np.zeros(len(data), RECORD_DTYPE)
+    records["phase"] = -1
+    for name in data.dtype.names:
+        if name in RECORD_DTYPE.names:
+            records[name] = data[name]
+    return records
+
+def open_source(source, start=None, end=None, chunk_size=65536):
+    """
+    Returns the chunks of records and the list of events of the source, from start to end
+    """
+    if source.lower().endswith(".csv"):
+        records = read_csv(source)
+        first = np.searchsorted(records["t"], start) if start is not None else 0
+        last = np.searchsorted(records["t"], end) if end is not None else len(records)
+        return [records[first:last]], []
+    session = Session.open(source)
+    start, end = parse_time(start, session), parse_time(end, session)
+    return session.chunks(start, end, chunk_size), session.events(start, end)
+
+class ReplayClock():
+    """
+    Time of the replay, used by the GUI and the alarms instead of the system clock: the instants of
+    the replayed samples are shifted to start at the start of the replay, and run speed times
+    faster than the real time. As fast as possible, it's the instant of the last sample sent.
+    """
+    def __init__(self):
+        self.speed = 1.0
+        self.origin = None
+        self.last = None
+
+    def start(self, speed):
+        self.speed = speed
+        self.origin = self.last = time.time()
+
+    def time(self):
+        if self.origin is None:
+            return time.time()
+        if math.isinf(self.speed):
+            return self.last
+        return self.origin + (time.time() - self.origin) * self.speed
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def sleep(self, duration):
+        time.sleep(duration)
+
+# Clock of the replay, shared by the gauge and the application
+clock = ReplayClock()
+# Functions called with the recorded stages of the controller, (stage, instant), and with the
+# recorded events, as dictionaries
+stage_callbacks = []
+event_callbacks = []
+
+def add_stage_callback(callback):
+    stage_callbacks.append(callback)
+
+def add_event_callback(callback):
+    event_callbacks.append(callback)
+
+class pressure_gauge():
+    """
+    Delivers the recorded samples through the callbacks of the continuous acquisition, with the
+    original intervals between them, so it only works with start_continuous. The pressure and flow
+    with the tare are replayed, so the application must not tare them again.
+    Before each sample, the recorded stage of the controller is sent to the stage callbacks when it
+    changes and the events of the session that happened until it to the event callbacks.
+    Faster than real time, the replay waits while the backlog (the number of samples waiting to be
+    processed, set by the reader) is longer than max_backlog, so the memory stays bounded, and
+    waits until it's empty before an event, so the event is applied at the right sample.
+    """
+    # The samples are delivered with their instants, like the conversion ready interrupts
+    continuous_only = True
+
+    def __init__(self, parent=None, density_period=10.0, density_max_age=60.0, driver="adafruit",
+                 data_rate=128, max_backlog=4096):
+        self.source, self.speed, self.start, self.end = replay_settings()
+        self.max_backlog = max_backlog
+        self.backlog = lambda: 0
+        self.acquisition = None
+        self.count = 0
+
+    def read_pressure(self):
+        raise RuntimeError("The replay only delivers the samples with start_continuous")
+
+    read_flow_from_dp = read_pressure
+
+    def tare_sensors(self, duration):
+        # The replayed samples already have the tare
+        pass
+
+    def start_continuous(self, prs_callback, flw_callback, data_rate=860,
+                         schedule=("flow", "pressure"), alert_pin=22):
+        chunks, events = open_source(self.source, self.start, self.end)
+        self.acquisition = threading.Event()
+        threading.Thread(target=self.work, args=(chunks, events, prs_callback, flw_callback),
+                         daemon=True).start()
+
+    def stop_continuous(self):
+        self.acquisition.set()
+
+    def wait_backlog(self, limit):
+        while self.backlog() > limit and not self.acquisition.is_set():
+            time.sleep(0.001)
+
+    def work(self, chunks, events, prs_callback, flw_callback):
+        """
+        Sends the samples, at the speed of the replay
+        """
+        print(f"Replaying {self.source} at {self.speed:g}x")
+        clock.start(self.speed)
+        paced = not math.isinf(self.speed)
+        offset = None
+        phase = -1
+        next_event = 0
+        for chunk in chunks:
+            # Python floats are faster than numpy scalars one at a time
+            for t, pressure, flow, stage in zip(chunk["t"].tolist(), chunk["pressure"].tolist(),
+                                                chunk["flow"].tolist(), chunk["phase"].tolist()):
+                if self.acquisition.is_set():
+                    return
+                if offset is None:
+                    offset = clock.origin - t
+                while next_event < len(events) and events[next_event]["t"] <= t:
+                    if self.speed > 1:
+                        self.wait_backlog(0)
+                    event = dict(events[next_event], t=events[next_event]["t"] + offset)
+                    for callback in event_callbacks:
+                        callback(event)
+                    next_event += 1
+                t += offset
+                if paced:
+                    wait = clock.origin + (t - clock.origin) / self.speed - time.time()
+                    if wait > 0.001:
+                        time.sleep(wait)
+                if not paced or self.speed > 1:
+                    if self.count % 256 == 0:
+                        self.wait_backlog(self.max_backlog)
+                if stage != phase:
+                    phase = stage
+                    if stage >= 0:
+                        for callback in stage_callbacks:
+                            callback(stage, t)
+                clock.last = t
+                # Same order as the sensors, the flow and then the pressure of the same reading
+                flw_callback(t, flow)
+                prs_callback(t, pressure)
+                self.count += 1
+        print(f"Replay finished, {self.count} samples")
+
+class pneumatic_piston():
+    """
+    Same interface as the real piston, without moving anything. The end switches follow the last
+    movement at once, starting at the bottom, so the startup of ControlPiston finishes as it does
+    live. The stages of the replay come from the session, so the modes shouldn't be started during
+    a replay.
+    """
+    def __init__(self, parent=None):
+        self.out_up = 0
+        self.out_down = 0
+        self.timeout = 10000  # ms
+        self.piston_at_bottom = True
+        self.piston_at_top = False
+
+    def set_outputs(self, up, down):
+        self.out_up = up
+        self.out_down = down
+
+    def emergency(self):
+        self.set_outputs(0, 0)
+
+    def stop(self):
+        self.set_outputs(0, 0)
+
+    def pst_down(self):
+        self.set_outputs(0, 1)
+        self.piston_at_bottom = True
+        self.piston_at_top = False
+
+    def pst_up(self):
+        self.set_outputs(1, 0)
+        self.piston_at_bottom = False
+        self.piston_at_top = True
@@ -0,0 +1,121 @@
+"""
+Preallocated circular buffer used to store the data read from the sensors
+"""
+import numpy as np
+
+class RingBuffer():
+    """
+    Stores the last "capacity" samples of a signal with several rows (usually row 0 is the time and
+    the others are measurements). Every sample is written twice, at the head position and at
+    head + capacity, so that the most recent samples can always be read as a contiguous view,
+    ordered from the oldest to the newest, without copying the data.
+    Appending costs O(1), unlike np.roll, that copies the whole array for every new sample.
+    The dtype can be changed to np.float32 to halve the memory, but in this case the time row
+    should be stored relative to a reference instant, since float32 can't represent time.time()
+    with less than ~100 s of resolution.
+    One thread can append while others read: the position of the newest sample is derived from
+    count, which is updated with a single assignment after the sample is written, so a reader that
+    takes count once always gets a consistent state.
+    """
+    def __init__(self, rows, capacity, fill=0.0, dtype=np.float64):
+        self.rows = rows
+        self.capacity = capacity
+        # The storage has twice the capacity, the second half mirrors the first one
+        self.data = np.empty([rows, 2 * capacity], dtype=dtype)
+        # fill can be a single value or one value per row
+        self.data[:, :] = np.reshape(np.asarray(fill, dtype=dtype), (-1, 1))
+        # Total number of samples appended since the buffer was created
+        self.count = 0
+
+    @property
+    def head(self):
+        """
+        Position where the next sample will be written
+        """
+        return self.count % self.capacity
+
+    def end(self, count):
+        """
+        Position after the newest sample in the storage when count samples were appended, the
+        samples before it are contiguous
+        """
+        return count % self.capacity + self.capacity
+
+    def append(self, values):
+        """
+        Inserts one sample (one value per row) after the newest one, overwriting the oldest
+        """
+        count = self.count
+        head = count % self.capacity
+        self.data[:, head] = values
+        self.data[:, head + self.capacity] = values
+        # Publishes the sample once it's written
+        self.count = count + 1
+
+    def view(self, n=None):
+        """
+        Returns a view with the last n samples (all of them by default), ordered in time from the
+        oldest to the newest. The view shares memory with the buffer, so it must not be stored
+        for long, since it will be overwritten by the next samples.
+        """
+        if n is None or n > self.capacity:
+            n = self.capacity
+        end = self.end(self.count)
+        return self.data[:, end - n:end]
+
+    def view_range(self, start, stop=None):
+        """
+        Returns a view of the samples with indexes start to stop - 1, where the index of a sample is
+        the value of count before it was appended, i.e. 0 for the first sample ever appended.
+        Returns None if the oldest one was already overwritten.
+        The view is located from stop, so a reader can pass the count it read before.
+        """
+        count = self.count
+        if stop is None:
+            stop = count
+        if start < count - self.capacity or stop > count or start > stop:
+            return None
+        end = self.end(stop)
+        return self.data[:, end - (stop - start):end]
+
+    def searchsorted(self, t, side="left", row=0, count=None):
+        """
+        Returns the index (as in view_range) of the first stored sample with time >= t, or > t with
+        side="right", with a binary search, O(log capacity). The time row must be in increasing
+        order, which is true when it's filled with the time of the samples (or with a constant).
+        The search is done in the samples until count, by default all of them.
+        """
+        if count is None:
+            count = self.count
+        end = self.end(count)
+        times = self.data[row, end - self.capacity:end]
+        return count - self.capacity + int(np.searchsorted(times, t, side=side))
+
+    def window(self, duration, now=None, limit=None, row=0):
+        """
+        Returns a view with the samples of the last duration seconds before now (by default the
+        time of the newest sample), i.e. now - t < duration, limited to the last limit samples.
+        The boundary is found with a binary search, so the cost depends on the number of samples
+        in the window and not on the capacity, and nothing is allocated besides the view.
+        """
+        end = self.end(self.count)
+        times = self.data[row, end - self.capacity:end]
+        if now is None:
+            now = times[-1]
+        n = self.capacity - int(np.searchsorted(times, now - duration, side="right"))
+        if limit is not None:
+            n = min(n, limit)
+        return self.data[:, end - n:end]
+
+    def latest(self):
+        """
+        Returns a view of the newest sample, with one value per row
+        """
+        return self.data[:, self.end(self.count) - 1]
+
+    def set_row_offset(self, row, src_row, offset):
+        """
+        Recalculates a whole row from another one minus an offset, e.g. to apply a new tare to all
+        the stored samples. Works on the full storage, so the mirrored halves stay consistent.
+        """
+        np.subtract(self.data[src_row], offset, out=self.data[row])
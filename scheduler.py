@@ -0,0 +1,102 @@
+"""
+Scheduler of the control loop, with a fixed rate and absolute deadlines
+"""
+from collections import deque
+import numpy as np
+from clock import system_clock
+
+class FixedRateScheduler():
+    """
+    Runs a loop at a fixed rate. The deadlines are absolute (start + n * period, in the monotonic
+    clock), so the time spent in each cycle and the latency of the sleep don't accumulate, as they
+    do with a sleep of the period at the end of each cycle.
+    If a cycle ends after the next deadline there was an overrun. If it ends more than one period
+    late, the deadlines that passed are skipped, the loop doesn't try to catch up by running several
+    cycles in a row.
+    With a wake event (threading.Event set by the producer of the samples), the loop also runs as
+    soon as a new sample arrives, without waiting for the deadline. The deadlines still guarantee
+    the minimum rate if the samples stop.
+    The statistics are calculated over the last stats_window cycles.
+    """
+    def __init__(self, period=0.05, clock=system_clock, wake_event=None, stats_window=200):
+        self.period = period
+        self.clock = clock
+        self.wake_event = wake_event
+        # Instants when the last cycles started and how late they were relative to the deadline
+        self.starts = deque(maxlen=stats_window)
+        self.lateness = deque(maxlen=stats_window)
+        self.reset()
+
+    def reset(self):
+        self.next_deadline = None
+        self.cycles = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.wakeups = 0
+        self.starts.clear()
+        self.lateness.clear()
+
+    def wait(self):
+        """
+        Waits until the next deadline, or until a new sample arrives if there is a wake event, and
+        returns the current instant of the monotonic clock
+        """
+        now = self.clock.monotonic()
+        if self.next_deadline is None:
+            # First cycle, runs immediately
+            self.next_deadline = now
+        elif now > self.next_deadline:
+            # The cycle took longer than the time left until the deadline
+            self.overruns += 1
+            missed = int((now - self.next_deadline) // self.period)
+            if missed > 0:
+                self.skipped += missed
+                self.next_deadline += missed * self.period
+        else:
+            remaining = self.next_deadline - now
+            if self.wake_event is not None:
+                woken = self.wake_event.wait(remaining)
+                self.wake_event.clear()
+                if woken and self.clock.monotonic() < self.next_deadline:
+                    # New sample before the deadline, the deadline stays the same
+                    self.wakeups += 1
+                    return self.start_cycle(None)
+            else:
+                self.clock.sleep(remaining)
+        deadline = self.next_deadline
+        self.next_deadline += self.period
+        return self.start_cycle(deadline)
+
+    def start_cycle(self, deadline):
+        now = self.clock.monotonic()
+        self.cycles += 1
+        self.starts.append(now)
+        if deadline is not None:
+            self.lateness.append(now - deadline)
+        return now
+
+    def stats(self):
+        """
+        Returns a dictionary with the mean period achieved, the jitter (standard deviation of the
+        period), the mean and maximum lateness relative to the deadlines and the counters
+        """
+        if len(self.starts) > 1:
+            intervals = np.diff(np.asarray(self.starts))
+            period = float(np.mean(intervals))
+            jitter = float(np.std(intervals))
+        else:
+            period = jitter = 0.0
+        if self.lateness:
+            lateness = np.asarray(self.lateness)
+            late_mean = float(np.mean(lateness))
+            late_max = float(np.max(lateness))
+        else:
+            late_mean = late_max = 0.0
+        return {"period": period,
+                "jitter": jitter,
+                "late_mean": late_mean,
+                "late_max": late_max,
+                "cycles": self.cycles,
+                "overruns": self.overruns,
+                "skipped": self.skipped,
+                "wakeups": self.wakeups}
@@ -0,0 +1,130 @@
+"""
+Segmentation of the stream of samples in breaths
+"""
+from collections import deque, namedtuple
+
+# Record of one complete breath:
+# - number: sequential number of the breath
+# - start, end: instants of the start of the inspiration and of the next one (s)
+# - t_insp, t_exp: inspiratory and expiratory times (s), the inspiration ends when the flow
+#   reverses (it includes the pause), or at the end of the inhale of the controller if the flow
+#   doesn't reverse
+# - i_start, i_end: indexes of the first flow sample of the breath and of the next breath in the
+#   flow RingBuffer (see RingBuffer.view_range)
+# - vt_insp, vt_exp: inspired and expired volumes (ml)
+# - source: "control" if the breath was started by the piston control, "flow" if it was detected
+#   by the flow only, e.g. a spontaneous breath with the ventilator stopped
+BreathRecord = namedtuple("BreathRecord", ["number", "start", "end", "t_insp", "t_exp", "i_start",
+                                           "i_end", "vt_insp", "vt_exp", "source"])
+
+class BreathSegmenter():
+    """
+    Finds the start and end of each breath while the samples arrive, and calls the breath
+    callbacks with a BreathRecord when a breath ends, i.e. when the next one starts.
+    It combines two sources:
+    - the stages of the BreathController (set_phase), the start of an inhale starts a breath
+    - the flow, with hysteresis: the inspiration starts when the flow goes above threshold and
+      the expiration when it goes below -threshold. A new inspiration only starts a breath if the
+      current one has already expired, and a start of the controller that arrives less than
+      merge_window after a breath detected by the flow (e.g. the patient triggered the PSV) is
+      the same breath.
+    It's fed by the pipeline thread with every flow sample (add), the phases come from the control
+    thread and are queued until the pipeline reaches their instant. The volume integrator is reset
+    at the start of every breath, or after reset_timeout seconds without a breath.
+    Only the instants, indexes and volumes are stored, the samples stay in the ring buffers.
+    """
+    def __init__(self, integrator, threshold=2.0, merge_window=0.3, reset_timeout=15.0):
+        self.integrator = integrator
+        self.threshold = threshold  # l/min
+        self.merge_window = merge_window
+        self.reset_timeout = reset_timeout
+        # Phases received from the control thread, (stage, instant)
+        self.pending = deque()
+        self.breath_callbacks = []
+        self.number = 0
+        # State of the flow, with hysteresis
+        self.inspiring = False
+        self.last_reset = None
+        self.start_breath(None, None, None)
+
+    def add_breath_callback(self, callback):
+        self.breath_callbacks.append(callback)
+
+    def set_phase(self, stage, t):
+        """
+        Receives the stage of the BreathController (stage callback), from any thread
+        """
+        self.pending.append((stage, t))
+
+    def start_breath(self, t, index, source):
+        # Current breath
+        self.start = t
+        self.i_start = index
+        self.source = source
+        # Instants when the flow reversed and when the controller ended the inhale
+        self.flow_insp_end = None
+        self.control_insp_end = None
+        # Whether the flow of this breath already went above and below the thresholds
+        self.has_inspired = False
+        self.has_expired = False
+
+    def new_breath(self, t, index, source):
+        """
+        Ends the current breath, if there is one, and starts a new one at the instant t
+        """
+        record = None
+        if self.start is not None:
+            insp_end = self.flow_insp_end
+            if insp_end is None:
+                insp_end = self.control_insp_end if self.control_insp_end is not None else t
+            self.number += 1
+            record = BreathRecord(self.number, self.start, t, insp_end - self.start,
+                                  t - insp_end, self.i_start, index, self.integrator.inspired,
+                                  self.integrator.expired, self.source)
+        self.start_breath(t, index, source)
+        self.integrator.reset()
+        self.last_reset = t
+        if record is not None:
+            for callback in self.breath_callbacks:
+                callback(record)
+        return record
+
+    def add(self, t, flow, index):
+        """
+        Processes a new flow sample (l/min) of the instant t, stored at the index of the flow
+        buffer, and adds it to the volume. Returns the record of the breath that ended, if any.
+        """
+        record = None
+        # Phases of the controller until this sample
+        while self.pending and self.pending[0][1] <= t:
+            stage, t_phase = self.pending.popleft()
+            if stage == 1:
+                if (self.source == "flow" and not self.has_expired
+                        and t_phase - self.start < self.merge_window):
+                    # The controller followed the breath that the flow detected
+                    self.source = "control"
+                else:
+                    record = self.new_breath(t_phase, index, "control")
+            elif stage == 2 and self.start is not None:
+                self.control_insp_end = t_phase
+
+        # Flow with hysteresis
+        if not self.inspiring and flow > self.threshold:
+            self.inspiring = True
+            if self.start is None or self.has_expired:
+                record = self.new_breath(t, index, "flow")
+            self.has_inspired = True
+        elif self.inspiring and flow < -self.threshold:
+            self.inspiring = False
+            if self.has_inspired and not self.has_expired:
+                self.has_expired = True
+                self.flow_insp_end = t
+
+        if self.last_reset is None:
+            self.last_reset = t
+        elif t - self.last_reset > self.reset_timeout:
+            # No breath for a long time, the offset of the flow must not accumulate
+            self.integrator.reset()
+            self.last_reset = t
+        self.integrator.add(t, flow)
+        return record
@@ -0,0 +1,336 @@
+"""
+Reading of the sessions recorded by the SessionRecorder, with a command line interface to export
+a time range and summarize the breaths:
+
+python session_reader.py sessions --list
+python session_reader.py sessions --start 03:12 --duration 30 --csv window.csv
+python session_reader.py sessions/session_20260101_120000_0000.vrec --breaths
+"""
+import argparse
+import bisect
+import configparser
+import datetime
+import glob
+import json
+import math
+import os
+import re
+import numpy as np
+from integrator import VolumeIntegrator
+from metrics import BreathMetrics
+from recorder import (EVENTS_EXTENSION, HEADER_DTYPE, MAGIC, RECORD_DTYPE, RECORDS_EXTENSION,
+                      VERSION)
+from segmentation import BreathSegmenter
+
+# Name of the segment files: session prefix and index of the segment
+SEGMENT_NAME = re.compile(r"(.*session_\d{8}_\d{6})_(\d{4})" + re.escape(RECORDS_EXTENSION) + "$")
+
+class Segment():
+    """
+    One segment file, mapped read only. Only the records counted in the header are valid, the
+    segment that is still being recorded can be read, up to its last flush.
+    The sparse index has the time of one record out of index_stride, so a time is found with a
+    binary search in the index and then in a block of index_stride records, touching a few pages
+    of the file instead of reading it.
+    """
+    def __init__(self, path, index_stride=1024):
+        self.path = path
+        header = np.fromfile(path, HEADER_DTYPE, 1)
+        if len(header) == 0 or header[0]["magic"] != MAGIC:
+            raise ValueError(f"{path} isn't a session segment")
+        self.header = header[0]
+        if self.header["version"] != VERSION or self.header["record_size"] != RECORD_DTYPE.itemsize:
+            raise ValueError(f"{path} has an unknown version of the records")
+        self.count = int(self.header["count"])
+        self.records = (np.memmap(path, RECORD_DTYPE, "r", HEADER_DTYPE.itemsize, (self.count,))
+                        if self.count > 0 else np.empty(0, RECORD_DTYPE))
+        self.index_stride = index_stride
+        self.index_times = np.array(self.records["t"][::index_stride])
+        self.start = self.records["t"][0] if self.count else math.nan
+        self.end = self.records["t"][-1] if self.count else math.nan
+
+    def search(self, t, side="left"):
+        """
+        Returns the position of the first record with time >= t (> t with side="right")
+        """
+        block = bisect.bisect_left(self.index_times, t) if side == "left" else \
+            bisect.bisect_right(self.index_times, t)
+        # The record is in the block before the index entry found
+        low = max(block - 1, 0) * self.index_stride
+        high = min(block * self.index_stride + 1, self.count)
+        return low + int(np.searchsorted(self.records["t"][low:high], t, side=side))
+
+    def events_path(self):
+        return self.path[:-len(RECORDS_EXTENSION)] + EVENTS_EXTENSION
+
+class Session():
+    """
+    The segments of one recorded session, in order. The ranges are returned as views of the
+    mapped files (read, chunks), without copying, except when a range crosses segments.
+    The records have the layout of RECORD_DTYPE, and rows() arranges them like the live buffers of
+    the SamplePipeline.
+    """
+    def __init__(self, paths, index_stride=1024):
+        self.segments = [segment for segment in (Segment(path, index_stride)
+                                                 for path in sorted(paths)) if segment.count]
+        self.starts = [segment.start for segment in self.segments]
+        self.start = self.segments[0].start if self.segments else math.nan
+        self.end = self.segments[-1].end if self.segments else math.nan
+
+    @classmethod
+    def open(cls, path, index_stride=1024):
+        """
+        Opens the session of a segment file, or the last session recorded in a directory
+        """
+        if os.path.isdir(path):
+            sessions = list_sessions(path)
+            if not sessions:
+                raise ValueError(f"There are no sessions in {path}")
+            prefix = sessions[-1]
+        else:
+            match = SEGMENT_NAME.match(path)
+            if match is None:
+                raise ValueError(f"{path} isn't a session segment")
+            prefix = match.group(1)
+        return cls(glob.glob(prefix + "_[0-9][0-9][0-9][0-9]" + RECORDS_EXTENSION), index_stride)
+
+    @property
+    def count(self):
+        return sum(segment.count for segment in self.segments)
+
+    def locate(self, t, side="left"):
+        """
+        Returns (segment, position) of the first record with time >= t (> t with side="right"),
+        with binary searches, O(log n)
+        """
+        i = max(bisect.bisect_right(self.starts, t) - 1, 0)
+        position = self.segments[i].search(t, side)
+        if position == self.segments[i].count and i + 1 < len(self.segments):
+            return i + 1, 0
+        return i, position
+
+    def ranges(self, start=None, end=None):
+        """
+        Returns the views of each segment with the records from start (inclusive) to end
+        (exclusive)
+        """
+        if not self.segments:
+            return []
+        first, first_position = self.locate(start) if start is not None else (0, 0)
+        if end is not None:
+            last, last_position = self.locate(end)
+        else:
+            last, last_position = len(self.segments) - 1, self.segments[-1].count
+        views = []
+        for i in range(first, last + 1):
+            low = first_position if i == first else 0
+            high = last_position if i == last else self.segments[i].count
+            if high > low:
+                views.append(self.segments[i].records[low:high])
+        return views
+
+    def read(self, start=None, end=None):
+        """
+        Returns the records from start to end, a view of the file if they are in one segment and a
+        copy if they cross segments
+        """
+        views = self.ranges(start, end)
+        if len(views) == 1:
+            return views[0]
+        if not views:
+            return np.empty(0, RECORD_DTYPE)
+        return np.concatenate(views)
+
+    def chunks(self, start=None, end=None, chunk_size=65536):
+        """
+        Yields views of at most chunk_size records from start to end, so a long range can be
+        processed without loading it in memory
+        """
+        for view in self.ranges(start, end):
+            for low in range(0, len(view), chunk_size):
+                yield view[low:low + chunk_size]
+
+    def events(self, start=None, end=None):
+        """
+        Returns the events recorded from start to end, as dictionaries
+        """
+        events = []
+        for segment in self.segments:
+            if not os.path.exists(segment.events_path()):
+                continue
+            with open(segment.events_path()) as events_file:
+                for line in events_file:
+                    event = json.loads(line)
+                    if ((start is None or event["t"] >= start)
+                            and (end is None or event["t"] < end)):
+                        events.append(event)
+        return events
+
+def rows(records, signal):
+    """
+    Returns the records of a signal, "pressure" or "flow", arranged like the prs_data and flw_data
+    buffers of the SamplePipeline: row 0 is the time, 1 the value minus the tare and 2 the raw
+    value. It's a copy.
+    """
+    return np.vstack((records["t"], records[signal], records[signal + "_raw"]))
+
+def list_sessions(directory):
+    """
+    Returns the prefixes of the sessions recorded in the directory, from the oldest to the newest
+    """
+    prefixes = set()
+    for path in glob.glob(os.path.join(directory, "*" + RECORDS_EXTENSION)):
+        match = SEGMENT_NAME.match(path)
+        if match is not None:
+            prefixes.add(match.group(1))
+    return sorted(prefixes)
+
+def breath_metrics(chunks, volume_calibration=5.0, threshold=2.0, sample_callbacks=(),
+                   breath_callbacks=()):
+    """
+    Segments the recorded samples in breaths and yields the metrics of each one, with the same
+    BreathSegmenter and BreathMetrics of the pipeline, so the results are the same as the live
+    ones. The phases recorded with the samples are the stages of the controller. The volume is
+    integrated again from the flow, since the segmenter restarts it at every breath.
+    The sample callbacks receive the instant, pressure and flow of every sample and the breath
+    callbacks the BreathRecord of every breath, in the same order as the callbacks of the
+    SamplePipeline.
+    """
+    integrator = VolumeIntegrator(volume_calibration)
+    segmenter = BreathSegmenter(integrator, threshold)
+    metrics = BreathMetrics(threshold)
+    segmenter.add_breath_callback(metrics.end_breath)
+    for callback in breath_callbacks:
+        segmenter.add_breath_callback(callback)
+    results = []
+    metrics.add_metrics_callback(results.append)
+    phase = -1
+    index = 0
+    for chunk in chunks:
+        # Python floats are faster than numpy scalars one at a time
+        for t, pressure, flow, stage in zip(chunk["t"].tolist(), chunk["pressure"].tolist(),
+                                            chunk["flow"].tolist(), chunk["phase"].tolist()):
+            if stage != phase:
+                phase = stage
+                if stage >= 0:
+                    segmenter.set_phase(stage, t)
+            segmenter.add(t, flow, index)
+            metrics.add(t, pressure, flow, integrator.volume)
+            for callback in sample_callbacks:
+                callback(t, pressure, flow)
+            index += 1
+            if results:
+                yield from results
+                results.clear()
+
+def parse_time(text, session):
+    """
+    Reads an instant: seconds since the epoch, +seconds since the start of the session, an ISO date
+    and time or a time of the day (HH:MM[:SS]) of the day when the session started, local time
+    """
+    if text is None:
+        return None
+    if text.startswith("+"):
+        return session.start + float(text[1:])
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    match = re.fullmatch(r"(\d{1,2}):(\d{2})(?::(\d{2}(?:\.\d*)?))?", text)
+    if match:
+        midnight = datetime.datetime.combine(datetime.date.fromtimestamp(session.start),
+                                             datetime.time())
+        t = (midnight.timestamp() + 3600 * int(match.group(1)) + 60 * int(match.group(2))
+             + float(match.group(3) or 0))
+        if t < session.start:
+            # The session crossed midnight
+            t += 24 * 3600
+        return t
+    return datetime.datetime.fromisoformat(text).timestamp()
+
+def format_time(t):
+    return datetime.datetime.fromtimestamp(t).isoformat(sep=" ", timespec="milliseconds")
+
+def export_csv(session, start, end, path):
+    with open(path, "w") as csv_file:
+        csv_file.write(",".join(RECORD_DTYPE.names) + "\n")
+        for chunk in session.chunks(start, end):
+            np.savetxt(csv_file, chunk, delimiter=",",
+                       fmt=["%.6f"] + ["%.4f"] * 5 + ["%d", "%d"])
+
+def export_npz(session, start, end, path):
+    """
+    Saves each field of the records and also prs_data and flw_data, the pressure and flow with the
+    layout of the live buffers (see rows)
+    """
+    records = session.read(start, end)
+    np.savez(path, prs_data=rows(records, "pressure"), flw_data=rows(records, "flow"),
+             **{name: records[name] for name in RECORD_DTYPE.names})
+
+def print_breaths(session, start, end, volume_calibration, threshold):
+    print(f"{'breath':>6} {'start':>23} {'dur s':>6} {'VTi ml':>7} {'VTe ml':>7} {'Ppk':>5} "
+          f"{'Pplat':>5} {'PEEP':>5} {'RR':>5} {'C':>6} {'R':>6}")
+    for m in breath_metrics(session.chunks(start, end), volume_calibration, threshold):
+        print(f"{m['breath_number']:6d} {format_time(m['breath_start']):>23} "
+              f"{m['breath_end'] - m['breath_start']:6.2f} {m['tidal_volume_insp']:7.0f} "
+              f"{m['tidal_volume_exp']:7.0f} {m['peak_pressure']:5.1f} "
+              f"{m['plateau_pressure']:5.1f} {m['PEEP']:5.1f} {m['respiratory_rate']:5.1f} "
+              f"{m['compliance']:6.1f} {m['resistance']:6.1f}")
+
+def main(argv=None):
+    conf = configparser.ConfigParser()
+    conf.read("config_file.conf")
+    if not conf.has_section("Config"):
+        conf.add_section("Config")
+    parser = argparse.ArgumentParser(description="Reads the sessions recorded by the ventilator")
+    parser.add_argument("path", help="directory of the sessions (the last one is read) or a "
+                                     "segment file of the session")
+    parser.add_argument("--list", action="store_true", help="lists the sessions of the directory")
+    parser.add_argument("--start", help="start of the range: seconds since the epoch, +seconds "
+                                        "since the start of the session, ISO date or HH:MM[:SS]")
+    parser.add_argument("--end", help="end of the range, same formats as --start")
+    parser.add_argument("--duration", type=float,
+                        help="duration of the range (s), instead of --end")
+    parser.add_argument("--csv", help="exports the samples of the range to a CSV file")
+    parser.add_argument("--npz", help="exports the samples of the range to a NPZ file, also with "
+                                      "the layout of prs_data and flw_data")
+    parser.add_argument("--events", action="store_true", help="prints the events of the range")
+    parser.add_argument("--breaths", action="store_true", help="prints the metrics of each breath")
+    parser.add_argument("--volume-calibration", type=float,
+                        default=conf["Config"].getfloat("volume_calibration", 5.0))
+    parser.add_argument("--breath-threshold", type=float,
+                        default=conf["Config"].getfloat("breath_flow_threshold", 2.0))
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for prefix in list_sessions(args.path):
+            session = Session(glob.glob(prefix + "_[0-9][0-9][0-9][0-9]" + RECORDS_EXTENSION))
+            if session.segments:
+                print(f"{os.path.basename(prefix)}: {format_time(session.start)} to "
+                      f"{format_time(session.end)}, {session.count} samples, "
+                      f"{len(session.segments)} segments")
+        return
+
+    session = Session.open(args.path)
+    if not session.segments:
+        print("The session has no samples")
+        return
+    start = parse_time(args.start, session)
+    end = parse_time(args.end, session)
+    if args.duration is not None:
+        end = (start if start is not None else session.start) + args.duration
+    print(f"Session from {format_time(session.start)} to {format_time(session.end)}, "
+          f"{session.count} samples")
+    if args.csv:
+        export_csv(session, start, end, args.csv)
+    if args.npz:
+        export_npz(session, start, end, args.npz)
+    if args.events:
+        for event in session.events(start, end):
+            data = {key: value for key, value in event.items() if key not in ("t", "kind")}
+            print(f"{format_time(event['t'])} {event['kind']}: {data}")
+    if args.breaths:
+        print_breaths(session, start, end, args.volume_calibration, args.breath_threshold)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Settings of the ventilation shared between the GUI and the worker threads
+"""
+from types import MappingProxyType
+import threading
+import time
+
+class SettingsSnapshot():
+    """
+    Immutable set of settings (name: value) with a version number. A new snapshot is created for
+    every change, so a thread that holds a snapshot sees a consistent set of values for as long
+    as it wants, even if the user changes the settings in the meantime.
+    The names are the same as the keys of gui_items in main.py, e.g. "VCV_volume_spb".
+    """
+    __slots__ = ("_values", "version", "timestamp")
+
+    def __init__(self, values, version=0, timestamp=None):
+        object.__setattr__(self, "_values", MappingProxyType(dict(values)))
+        object.__setattr__(self, "version", version)
+        object.__setattr__(self, "timestamp", time.time() if timestamp is None else timestamp)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("The settings snapshot can't be changed, use SettingsStore.update")
+
+    def __getitem__(self, name):
+        return self._values[name]
+
+    def __contains__(self, name):
+        return name in self._values
+
+    def get(self, name, default=None):
+        return self._values.get(name, default)
+
+    def items(self):
+        return self._values.items()
+
+    def replace(self, changes):
+        """
+        Returns a new snapshot with the changes applied and the next version
+        """
+        values = dict(self._values)
+        values.update(changes)
+        return SettingsSnapshot(values, self.version + 1)
+
+class SettingsStore():
+    """
+    Holds the current snapshot. The GUI publishes a new snapshot whenever a setting changes and the
+    other threads read store.current, which is a single reference read (atomic in Python), without
+    locks and without touching the Qt widgets from outside the GUI thread.
+    The lock only serializes the writers, so no change is lost if two are published at once.
+    """
+    def __init__(self, values=None):
+        self.current = SettingsSnapshot(values or {})
+        self.lock = threading.Lock()
+
+    def update(self, changes):
+        """
+        Publishes a new snapshot with the changes (name: value) and returns it
+        """
+        with self.lock:
+            self.current = self.current.replace(changes)
+            return self.current
+
+    def set(self, name, value):
+        return self.update({name: value})
+
+    @property
+    def version(self):
+        return self.current.version
+
+def parse_assignments(items):
+    """
+    Converts a list of "name=value", e.g. the --set arguments of the command line tools, in a
+    dictionary of floats
+    """
+    values = {}
+    for item in items:
+        name, value = item.split("=", 1)
+        values[name.strip()] = float(value)
+    return values
@@ -0,0 +1,184 @@
+"""
+Simulated backend with the same IO classes as hardware.py: pressure_gauge, bme, pneumatic_piston,
+buttons, buzzer and led. It doesn't import any driver of the RPi, so the whole application can run
+on a development computer. The timing is deterministic: the sensors are read at fixed instants and
+the piston moves at constant speed.
+The pressure gauge and the piston share a plant, which receives the piston commands and produces
+the pressure and flow. By default it's the lung and AMBU model of plant.py, set_plant() replaces 
+it, e.g. by a LungPlant with other parameters.
+"""
+from air_density import humid_air_density
+from clock import system_clock
+from plant import LungPlant
+import threading
+import time
+
+# Plant shared by the simulated piston and pressure gauge
+plant = LungPlant()
+
+def set_plant(new_plant):
+    """
+    Replaces the plant used by the IO classes created after this call
+    """
+    global plant
+    plant = new_plant
+
+class pressure_gauge():
+    """
+    Reads the pressure and flow from the plant. Each reading takes the same time as a single shot
+    conversion of the ADS1115 at the chosen data rate, on a fixed schedule, so the sample rate is
+    the same at every run.
+    """
+    def __init__(self, parent=None, density_period=10.0, density_max_age=60.0, driver="adafruit",
+                 data_rate=128):
+        self.plant = plant
+        self.read_time = 1.0 / data_rate
+        self.next_read = time.time()
+        self.acquisition = None
+
+    def wait_next_read(self):
+        """
+        Waits until the end of the next conversion and returns its instant
+        """
+        self.next_read += self.read_time
+        now = time.time()
+        if self.next_read > now:
+            time.sleep(self.next_read - now)
+        else:
+            # Too late, restarts the schedule from now
+            self.next_read = now
+        return self.next_read
+
+    def read_pressure(self):
+        return self.plant.read(self.wait_next_read())[0]
+
+    def read_flow_from_dp(self):
+        return self.plant.read(self.wait_next_read())[1]
+
+    def tare_sensors(self, duration):
+        # The simulated sensors have no offset
+        time.sleep(duration)
+
+    def start_continuous(self, prs_callback, flw_callback, data_rate=860,
+                         schedule=("flow", "pressure"), alert_pin=22):
+        """
+        Same as the continuous acquisition of the real gauge: the callbacks are called from another
+        thread at every conversion, following the schedule
+        """
+        self.read_time = 1.0 / data_rate
+        callbacks = {"pressure": lambda t: prs_callback(t, self.plant.read(t)[0]),
+                     "flow": lambda t: flw_callback(t, self.plant.read(t)[1])}
+        self.acquisition = threading.Event()
+
+        def work():
+            slot = 0
+            self.next_read = time.time()
+            while not self.acquisition.is_set():
+                t = self.wait_next_read()
+                callbacks[schedule[slot]](t)
+                slot = (slot + 1) % len(schedule)
+
+        threading.Thread(target=work, daemon=True).start()
+
+    def stop_continuous(self):
+        self.acquisition.set()
+
+class bme():
+    """
+    Ambient conditions are constant
+    """
+    def __init__(self, temperature=22.0, pressure=1013.25, humidity=50.0):
+        self.temperature = temperature  # °C
+        self.pressure = pressure  # mbar
+        self.humidity = humidity  # %
+
+    def get_air_density(self):
+        return humid_air_density(self.temperature, self.pressure, self.humidity)
+
+class pneumatic_piston():
+    """
+    Same interface as the real piston, the solenoids command the plant
+    """
+    def __init__(self, parent=None, clock=system_clock):
+        self.plant = plant
+        # Real time in the GUI, virtual time in the simulation harness
+        self.clock = clock
+        # State of the outputs, as the pins of the real piston
+        self.out_up = 0
+        self.out_down = 0
+        self.timeout = 10000  # ms
+
+        # Variables that register the piston position
+        self.piston_at_bottom = False
+        self.piston_at_top = False
+        self.plant.add_end_stop_callback(self.position_sensor)
+
+    def set_outputs(self, up, down):
+        self.out_up = up
+        self.out_down = down
+        self.plant.set_command(down - up, self.clock.time())
+
+    def emergency(self):
+        """
+        Moves the piston up in an emergency
+        """
+        self.set_outputs(1, 0)
+        self.clock.sleep(10)
+        self.set_outputs(0, 0)
+
+    def stop(self):
+        self.set_outputs(0, 0)
+
+    def pst_down(self):
+        self.set_outputs(0, 1)
+        self.piston_at_top = False  # If the piston is going down, its not at the top
+
+    def pst_up(self):
+        self.set_outputs(1, 0)
+        self.piston_at_bottom = False  # If the piston is going up, it's not at the bottom
+
+    def position_sensor(self, sens):
+        """
+        Function called by the plant to define the position of the piston.
+        """
+        if sens == "down":
+            self.piston_at_bottom = True
+            self.piston_at_top = False
+        else:
+            self.piston_at_bottom = False
+            self.piston_at_top = True
+
+class buttons():
+    """
+    There are no physical buttons, press() puts an input in the queue as the interrupts would
+    """
+    def __init__(self, input_q):
+        self.input_q = input_q
+
+    def press(self, key):
+        self.queue_input(key)
+
+    def queue_input(self, key):
+        self.input_q.put([key, time.time()])
+
+class buzzer():
+    def __init__(self):
+        self.on = False
+
+    def beep_for(self, duration):
+        self.on = True
+        threading.Timer(duration, self.off).start()
+
+    def off(self):
+        self.on = False
+
+class led():
+    def __init__(self):
+        self.on = False
+
+    def light_for(self, duration):
+        self.on = True
+        threading.Timer(duration, self.off).start()
+
+    def off(self):
+        self.on = False
@@ -0,0 +1,339 @@
+"""
+Harness that runs the control loop, the sample pipeline and the lung plant in virtual time, to test
+the ventilation modes much faster than real time and without the hardware.
+Usage examples:
+    python simulation.py --mode VCV --breaths 1000
+    python simulation.py --mode PCV --set PCV_pressure_spb=15 --plant compliance=30
+    python simulation.py --mode VCV --sweep VCV_volume_spb=300,400,500 --sweep resistance=5,20
+"""
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+import time
+import numpy as np
+from clock import VirtualClock
+from controller import BreathController
+from pipeline import SamplePipeline
+from plant import LungPlant
+from scheduler import FixedRateScheduler
+from settings import SettingsStore, parse_assignments
+import simulated
+
+# Mode name: number used by the controller
+MODES = {"VCV": 1, "PCV": 2, "PSV": 3}
+
+# Settings used when they are not given, the same as the defaults of config_file.conf
+DEFAULT_SETTINGS = {"VCV_frequency_spb": 12,
+                    "VCV_volume_spb": 400,
+                    "VCV_pressure_max_spb": 25,
+                    "PCV_frequency_spb": 12,
+                    "PCV_pressure_spb": 20,
+                    "PCV_volume_max_spb": 400,
+                    "PSV_pressure_spb": 20,
+                    "PSV_sensitivity_spb": -0.5}
+
+# Spontaneous effort of the patient in PSV, when the plant parameters don't give one, since the
+# plant doesn't breathe by default and PSV only starts the inhales triggered by the patient. The
+# effort must take the pressure from the PEEP (5 cm H2O) below the sensitivity.
+DEFAULT_PSV_EFFORT = {"effort_pressure": 8.0, "effort_rate": 15.0}
+
+# Parameters of LungPlant that can be changed with --plant and --sweep
+PLANT_PARAMETERS = ("compliance", "resistance", "leak_resistance", "peep", "drive_pressure",
+                    "stroke_volume", "stroke_time_down", "stroke_time_up", "effort_pressure",
+                    "effort_rate", "effort_time", "intake_pressure", "max_step")
+
+def run_simulation(mode="VCV", settings=None, plant_params=None, breaths=100, sample_rate=64.0,
+                   control_period=0.05, wake_on_sample=False, volume_calibration=1.0,
+                   data_points=1000, tolerance=None, max_duration=None, verbose=False):
+    """
+    Ventilates the plant during the given number of breaths, in virtual time, and returns a
+    dictionary with the summary and the list of breaths.
+    The pressure and flow are sampled at sample_rate and processed by the SamplePipeline, as by
+    the sensors and data threads of the GUI, and the BreathController is driven by the
+    FixedRateScheduler, as in the control thread: every control_period and, with wake_on_sample,
+    also after every sample. The waits of the scheduler advance the virtual time, reading the
+    sensors on the way.
+    The simulated flow is exact, so the volume calibration of the pipeline is 1 by default.
+    In PSV, the plant breathes with DEFAULT_PSV_EFFORT unless plant_params set effort_pressure and
+    effort_rate, without effort there are no breaths.
+    For each breath it reports:
+    - tidal volume delivered to the plant (vt) and measured by the pipeline (vt_measured), and the
+      error of the delivered volume relative to the target (VCV only)
+    - start_error: delay of the inhale start relative to its schedule (start of the last inhale +
+      period in VCV and PCV, instant when the plant pressure crossed the sensitivity in PSV)
+    - end_error: delay of the inhale end relative to the instant when the plant reached the target
+      (90 % of the volume in VCV, pressure in PCV and PSV) or the maximum inhale duration
+    A deadline is missed when one of these delays is longer than the tolerance, by default one
+    control period plus two sample periods. The summary also has the cycles of the scheduler and
+    its wake ups by samples.
+    """
+    settings = dict(DEFAULT_SETTINGS, **(settings or {}))
+    store = SettingsStore(settings)
+    if tolerance is None:
+        tolerance = control_period + 2.0 / sample_rate
+    if mode == "PSV":
+        period = None
+    else:
+        period = 60. / settings[f"{mode}_frequency_spb"]
+    if max_duration is None:
+        max_duration = 20.0 * breaths if period is None else 3.0 * period * breaths + 10.0
+
+    clock = VirtualClock()
+    plant_params = dict(plant_params or {})
+    if mode == "PSV" and not ("effort_pressure" in plant_params or "effort_rate" in plant_params):
+        plant_params.update(DEFAULT_PSV_EFFORT)
+    model = LungPlant(**plant_params)
+    simulated.set_plant(model)
+    piston = simulated.pneumatic_piston(clock=clock)
+    pipeline = SamplePipeline(data_points, clock.time(), clock, volume_calibration)
+    log = print if verbose else (lambda message: None)
+    controller = BreathController(piston, store, clock=clock, log=log)
+
+    sample_period = 1.0 / sample_rate
+    next_sample = [sample_period]
+    # State of the breath being measured
+    current = {}
+    records = []
+
+    def inhale_target_reached():
+        if mode == "VCV":
+            return model.volume - current["volume_start"] >= 0.9 * settings["VCV_volume_spb"]
+        return model.pressure >= settings[f"{mode}_pressure_spb"]
+
+    def sample(t):
+        """
+        Reads the sensors at the instant t and observes the plant
+        """
+        pressure, flow = model.read(t)
+        pipeline.add_pressure(t, pressure)
+        pipeline.add_flow(t, flow)
+        pipeline.update_volume(t)
+        stage = controller.stage
+        if stage == 1:
+            current["peak_pressure"] = max(current.get("peak_pressure", pressure), pressure)
+            if "target_time" not in current and inhale_target_reached():
+                current["target_time"] = t
+        elif (stage == 0 and controller.mode and mode == "PSV" and "trigger_time" not in current
+              and pressure < settings["PSV_sensitivity_spb"]):
+            current["trigger_time"] = t
+
+    def control():
+        sample, age = pipeline.latest.read()
+        controller.step(sample.pressure, sample.volume)
+
+    def sleep(duration):
+        """
+        Advances the virtual time, sampling the sensors on the way
+        """
+        end = clock.time() + duration
+        while next_sample[0] <= end:
+            clock.set(next_sample[0])
+            sample(next_sample[0])
+            next_sample[0] += sample_period
+        clock.set(end)
+
+    class SchedulerClock():
+        """
+        Clock of the scheduler: sleeping advances the virtual time, sampling the sensors
+        """
+        time = clock.time
+        monotonic = clock.monotonic
+
+        def sleep(self, duration):
+            sleep(duration)
+
+    class SampleEvent():
+        """
+        Wake event of the scheduler, set by every sample like the event of the LatestSample:
+        waiting advances the virtual time until the next sample or the timeout
+        """
+        def wait(self, timeout):
+            now = clock.time()
+            if next_sample[0] <= now + timeout:
+                sleep(next_sample[0] - now)
+                return True
+            sleep(timeout)
+            return False
+
+        def clear(self):
+            pass
+
+    def stage_changed(stage, now):
+        if stage in (1, 2) and "inhale_start" not in current:
+            current["inhale_start"] = controller.inhale_start
+            current["volume_start"] = model.volume
+        if stage == 2:
+            current["vt"] = model.volume - current["volume_start"]
+            # The pipeline integrates the volume since the start of the inhale
+            current["vt_measured"] = pipeline.vol_data.latest()[1]
+        elif stage == 0:
+            records.append(breath_record(current, controller))
+            current.clear()
+
+    def breath_record(breath, controller):
+        inhale_start = breath["inhale_start"]
+        inhale_end = controller.inhale_end
+        inhale_duration = inhale_end - inhale_start
+        record = {"start": inhale_start,
+                  "settings_version": controller.cd["settings_version"],
+                  "inhale_duration": inhale_duration,
+                  "vt": breath["vt"],
+                  "vt_measured": breath["vt_measured"],
+                  "peak_pressure": breath.get("peak_pressure", float("nan"))}
+        if mode == "VCV":
+            record["vt_error"] = breath["vt"] - settings["VCV_volume_spb"]
+        else:
+            record["vt_error"] = float("nan")
+        # Start of the inhale relative to its schedule
+        if mode == "PSV":
+            record["start_error"] = inhale_start - breath.get("trigger_time", inhale_start)
+        elif records:
+            record["start_error"] = inhale_start - (records[-1]["start"] + period)
+        else:
+            record["start_error"] = float("nan")
+        # End of the inhale relative to the target or to the maximum duration
+        if "target_time" in breath:
+            record["end_error"] = inhale_end - breath["target_time"]
+        elif period is not None and inhale_duration >= period / 2:
+            record["end_error"] = inhale_duration - period / 2
+        else:
+            record["end_error"] = float("nan")
+        if records:
+            records[-1]["exhale_duration"] = inhale_start - (records[-1]["start"]
+                                                             + records[-1]["inhale_duration"])
+        record["exhale_duration"] = float("nan")
+        return record
+
+    controller.add_stage_callback(pipeline.set_phase)
+    controller.add_stage_callback(stage_changed)
+
+    wall_start = time.perf_counter()
+    # Startup, the piston goes to the top
+    while not piston.piston_at_top and clock.time() < 10:
+        piston.pst_up()
+        sleep(control_period)
+    piston.stop()
+
+    scheduler = FixedRateScheduler(control_period, SchedulerClock(),
+                                   SampleEvent() if wake_on_sample else None)
+    controller.reset()
+    controller.mode = MODES[mode]
+    while len(records) < breaths and clock.time() < max_duration:
+        scheduler.wait()
+        control()
+    wall_time = time.perf_counter() - wall_start
+    summary = summarize(records, tolerance, clock.time(), wall_time)
+    summary["control_cycles"] = scheduler.cycles
+    summary["wakeups"] = scheduler.wakeups
+    return {"mode": mode, "settings": settings, "plant": plant_params,
+            "summary": summary, "breaths": records}
+
+def summarize(records, tolerance, duration, wall_time):
+    """
+    Statistics of the breaths of one simulation
+    """
+    def stats(key):
+        values = np.array([r[key] for r in records], dtype=np.float64)
+        values = values[np.isfinite(values)]
+        if len(values) == 0:
+            return float("nan"), float("nan")
+        return float(np.mean(values)), float(np.max(np.abs(values)))
+
+    summary = {"breaths": len(records),
+               "virtual_time": duration,
+               "wall_time": wall_time,
+               "speedup": duration / wall_time if wall_time > 0 else float("inf")}
+    for key in ("vt", "vt_measured", "vt_error", "start_error", "end_error", "inhale_duration",
+                "exhale_duration", "peak_pressure"):
+        summary[f"{key}_mean"], summary[f"{key}_max"] = stats(key)
+    summary["missed_deadlines"] = sum(1 for r in records for key in ("start_error", "end_error")
+                                      if r[key] > tolerance)
+    return summary
+
+def run_case(case):
+    """
+    Runs one case of a sweep, the case is a dictionary with the arguments of run_simulation
+    """
+    result = run_simulation(**case)
+    # Only the summary goes back to the main process
+    del result["breaths"]
+    return result
+
+def sweep(mode, settings, plant_params, grid, breaths=100, workers=None, **kwargs):
+    """
+    Runs a simulation for every combination of the values in the grid (name: list of values) in a
+    process pool and returns the results in the order of the combinations. The names can be
+    settings or parameters of the plant.
+    """
+    names = list(grid)
+    cases = []
+    for values in itertools.product(*(grid[name] for name in names)):
+        case_settings = dict(settings)
+        case_plant = dict(plant_params)
+        for name, value in zip(names, values):
+            if name in PLANT_PARAMETERS:
+                case_plant[name] = value
+            else:
+                case_settings[name] = value
+        cases.append(dict(kwargs, mode=mode, settings=case_settings, plant_params=case_plant,
+                          breaths=breaths))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(run_case, cases))
+
+def print_summary(result, columns):
+    summary = result["summary"]
+    case = ", ".join(f"{name}={dict(result['settings'], **result['plant'])[name]:g}"
+                     for name in columns)
+    print(f"{result['mode']} {case}".strip())
+    print(f"  {summary['breaths']} breaths, {summary['virtual_time']:.0f} s in "
+          f"{summary['wall_time']:.2f} s ({summary['speedup']:.0f}x real time)")
+    print(f"  VT delivered {summary['vt_mean']:.0f} ml, measured "
+          f"{summary['vt_measured_mean']:.0f} ml, error mean {summary['vt_error_mean']:.1f} ml, "
+          f"max {summary['vt_error_max']:.1f} ml")
+    print(f"  Inhale {summary['inhale_duration_mean']:.2f} s, exhale "
+          f"{summary['exhale_duration_mean']:.2f} s, peak pressure "
+          f"{summary['peak_pressure_mean']:.1f} cm H2O")
+    print(f"  Start error mean {1000 * summary['start_error_mean']:.0f} ms, max "
+          f"{1000 * summary['start_error_max']:.0f} ms, end error mean "
+          f"{1000 * summary['end_error_mean']:.0f} ms, max "
+          f"{1000 * summary['end_error_max']:.0f} ms")
+    print(f"  Missed deadlines: {summary['missed_deadlines']} | scheduler: "
+          f"{summary['control_cycles']} cycles, {summary['wakeups']} wake ups by samples")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs the control loop with a simulated lung")
+    parser.add_argument("--mode", choices=list(MODES), default="VCV")
+    parser.add_argument("--breaths", type=int, default=100)
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE",
+                        help="setting of the GUI, e.g. VCV_volume_spb=450")
+    parser.add_argument("--plant", action="append", default=[], metavar="NAME=VALUE",
+                        help=f"parameter of the plant: {', '.join(PLANT_PARAMETERS)}")
+    parser.add_argument("--sweep", action="append", default=[], metavar="NAME=V1,V2,...",
+                        help="setting or plant parameter to sweep, runs every combination")
+    parser.add_argument("--workers", type=int, default=None, help="processes of the sweep")
+    parser.add_argument("--sample-rate", type=float, default=64.0)
+    parser.add_argument("--control-period", type=float, default=0.05)
+    parser.add_argument("--wake-on-sample", action="store_true",
+                        help="runs the control after every sample too")
+    parser.add_argument("--verbose", action="store_true", help="prints the controller messages")
+    args = parser.parse_args()
+
+    settings = parse_assignments(args.set)
+    plant_params = parse_assignments(args.plant)
+    common = {"sample_rate": args.sample_rate, "control_period": args.control_period,
+              "wake_on_sample": args.wake_on_sample}
+    if args.sweep:
+        grid = {}
+        for item in args.sweep:
+            name, values = item.split("=", 1)
+            grid[name.strip()] = [float(value) for value in values.split(",")]
+        start = time.perf_counter()
+        results = sweep(args.mode, settings, plant_params, grid, breaths=args.breaths,
+                        workers=args.workers, **common)
+        for result in results:
+            print_summary(result, list(grid))
+        print(f"{len(results)} cases in {time.perf_counter() - start:.1f} s")
+    else:
+        result = run_simulation(args.mode, settings, plant_params, breaths=args.breaths,
+                                verbose=args.verbose, **common)
+        print_summary(result, [])
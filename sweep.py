@@ -0,0 +1,91 @@
+"""
+Sweep display of the graphs, like the bedside monitors
+"""
+import numpy as np
+
+class SweepTrace():
+    """
+    Draws one row of a RingBuffer on a fixed time axis, from 0 to duration: a cursor moves from the
+    left to the right at the speed of the time and overwrites the old trace, with a gap of gap
+    seconds after it. The x array never changes and the y array is preallocated, each update only
+    writes the slots of the samples that arrived since the last one, instead of creating the
+    arrays of the whole time range again.
+    There is one slot per horizontal pixel, drawn as the minimum and maximum of its samples, so the
+    peaks are never lost. The slots without data, the gap and the slots that were skipped, are NaN
+    and the curve must be drawn with connect="finite".
+    """
+    def __init__(self, buffer, row, duration, width=800, gap=0.5):
+        self.buffer = buffer
+        self.row = row
+        self.duration = duration
+        self.width = width
+        self.bucket = duration / width
+        self.gap = max(1, int(round(gap / self.bucket)))
+        # Two points (minimum and maximum) per slot, at the center of the slot
+        self.x = np.repeat((np.arange(width) + 0.5) * self.bucket, 2)
+        self.y = np.full(2 * width, np.nan)
+        # Slot of the cursor, counted since the epoch, and index (see RingBuffer.view_range) of the
+        # next sample
+        self.cursor = None
+        self.next = None
+
+    def update(self, now):
+        """
+        Writes the new samples and returns the x and y arrays, the same arrays in every call
+        """
+        buffer = self.buffer
+        # Everything is read up to this count, the pipeline thread can append more meanwhile
+        count = buffer.count
+        # The oldest sample can be overwritten by the pipeline thread while it's read
+        first = max(buffer.searchsorted(now - self.duration, side="right", count=count),
+                    count - buffer.capacity + 1)
+        if self.next is None or self.next < first:
+            # First update, or the GUI fell behind: draws the whole time range again
+            self.next = first
+            self.cursor = None
+            self.y[:] = np.nan
+        samples = buffer.view_range(self.next, count)
+        if samples is None:
+            # Overwritten while it was read, starts again in the next frame
+            self.next = None
+            return self.x, self.y
+        if samples.shape[1] == 0:
+            return self.x, self.y
+        ids = np.floor(samples[0] / self.bucket).astype(np.int64)
+        values = samples[self.row]
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(ids)) + 1))
+        slots = ids[starts]
+        minimum = np.minimum.reduceat(values, starts)
+        maximum = np.maximum.reduceat(values, starts)
+        y = self.y
+        if self.cursor is not None:
+            if slots[0] == self.cursor:
+                # The slot of the cursor already has samples of the last update
+                minimum[0] = np.fmin(minimum[0], y[2 * (self.cursor % self.width)])
+                maximum[0] = np.fmax(maximum[0], y[2 * (self.cursor % self.width) + 1])
+            # The slots skipped since the cursor are cleared, the new ones are written below
+            self.clear(self.cursor + 1, slots[-1])
+        if len(slots) > self.width:
+            slots = slots[-self.width:]
+            minimum = minimum[-self.width:]
+            maximum = maximum[-self.width:]
+        positions = 2 * (slots % self.width)
+        y[positions] = minimum
+        y[positions + 1] = maximum
+        self.cursor = int(slots[-1])
+        self.clear(self.cursor + 1, self.cursor + self.gap)
+        self.next = count
+        return self.x, self.y
+
+    def clear(self, start, stop):
+        """
+        Sets the slots start to stop (inclusive, counted since the epoch) to NaN
+        """
+        if stop < start:
+            return
+        if stop - start + 1 >= self.width:
+            self.y[:] = np.nan
+            return
+        positions = 2 * (np.arange(start, stop + 1) % self.width)
+        self.y[positions] = np.nan
+        self.y[positions + 1] = np.nan
@@ -0,0 +1,157 @@
+"""
+Trends of the signals and of the metrics of the breaths over hours, with bounded memory
+"""
+import math
+from ring_buffer import RingBuffer
+
+# Statistics of every bucket, in the order of the rows of each signal
+STATS = ("min", "max", "mean", "count")
+# Resolutions of the cascade: bucket duration (s) and number of buckets kept. 1 hour of 1 s
+# buckets, 24 hours of 10 s buckets and 7 days of 1 min buckets
+LEVELS = ((1.0, 3600), (10.0, 8640), (60.0, 10080))
+# Signals of the samples, sample callback of the SamplePipeline plus the volume
+SAMPLE_SIGNALS = ("pressure", "flow", "volume")
+# Metrics of the breaths (see BreathMetrics), one value per breath
+BREATH_SIGNALS = ("peak_pressure", "plateau_pressure", "PEEP", "tidal_volume", "minute_volume",
+                  "respiratory_rate")
+
+class TrendLevel():
+    """
+    One resolution of a TrendStore: the finished buckets, in a RingBuffer with the start time of
+    the bucket in row 0 and the statistics of signal i in rows 1 + 4 * i to 4 + 4 * i (see STATS),
+    and the running statistics of the open bucket, in plain floats
+    """
+    def __init__(self, bucket, capacity, n_signals):
+        self.bucket = bucket
+        self.capacity = capacity
+        self.n_signals = n_signals
+        # The time row must be increasing for the binary searches, the statistics start as NaN
+        fill = [0.0] + [math.nan, math.nan, math.nan, 0.0] * n_signals
+        self.data = RingBuffer(1 + 4 * n_signals, capacity, fill=fill)
+        # Bucket number (start time / bucket) of the open bucket, None before the first sample
+        self.id = None
+        self.reset()
+
+    def reset(self):
+        n = self.n_signals
+        self.minimum = [math.inf] * n
+        self.maximum = [-math.inf] * n
+        self.total = [0.0] * n
+        self.count = [0] * n
+
+    def row(self):
+        """
+        Returns the row of the open bucket, with its start time and statistics
+        """
+        values = [self.id * self.bucket]
+        for i in range(self.n_signals):
+            n = self.count[i]
+            if n:
+                values += [self.minimum[i], self.maximum[i], self.total[i] / n, n]
+            else:
+                values += [math.nan, math.nan, math.nan, 0]
+        return values
+
+class TrendStore():
+    """
+    Downsampling cascade of several signals: every sample updates the minimum, maximum, sum and
+    count of the open bucket of the finest level, and when a bucket ends it's stored in the ring
+    buffer of its level and merged into the open bucket of the next one, whose buckets are
+    multiples of it (all the buckets are aligned to the epoch). The cost is O(1) per sample, since
+    a bucket of the next level is only updated once per bucket of the previous one, and the memory
+    is fixed by the capacity of each level.
+    NaN values are ignored, so the count of a bucket is the number of valid values of each signal,
+    e.g. the breaths without a plateau. A bucket without any sample isn't stored.
+    The levels are written by the thread that adds the samples and read by the GUI with window,
+    as views, like the ring buffers of the pipeline. The open buckets aren't in the views.
+    """
+    def __init__(self, signals, levels=LEVELS):
+        self.signals = tuple(signals)
+        self.levels = [TrendLevel(bucket, capacity, len(self.signals))
+                       for bucket, capacity in levels]
+        self.rows = {name: 1 + 4 * i for i, name in enumerate(self.signals)}
+
+    def row(self, signal, stat="mean"):
+        """
+        Returns the row of the statistic ("min", "max", "mean" or "count") of the signal in the
+        views of the levels
+        """
+        return self.rows[signal] + STATS.index(stat)
+
+    def add(self, t, values):
+        """
+        Adds one value per signal at the instant t (s)
+        """
+        level = self.levels[0]
+        bucket_id = math.floor(t / level.bucket)
+        if bucket_id != level.id:
+            self.close(0, bucket_id)
+        minimum, maximum, total, count = level.minimum, level.maximum, level.total, level.count
+        for i, value in enumerate(values):
+            # NaN is the only value different from itself
+            if value != value:
+                continue
+            if value < minimum[i]:
+                minimum[i] = value
+            if value > maximum[i]:
+                maximum[i] = value
+            total[i] += value
+            count[i] += 1
+
+    def add_metrics(self, metrics):
+        """
+        Adds the metrics of a breath at its end (metrics callback of BreathMetrics), the signals
+        must be names of metrics
+        """
+        self.add(metrics["breath_end"], [metrics[name] for name in self.signals])
+
+    def close(self, index, bucket_id):
+        """
+        Stores the open bucket of the level index, merges it into the next level and opens the
+        bucket bucket_id
+        """
+        level = self.levels[index]
+        if level.id is not None:
+            level.data.append(level.row())
+            if index + 1 < len(self.levels):
+                self.merge(level, index + 1)
+        level.id = bucket_id
+        level.reset()
+
+    def merge(self, level, index):
+        """
+        Adds the statistics of the bucket that ended in level to the open bucket of the level index
+        """
+        parent = self.levels[index]
+        bucket_id = math.floor(level.id * level.bucket / parent.bucket)
+        if bucket_id != parent.id:
+            self.close(index, bucket_id)
+        for i in range(level.n_signals):
+            n = level.count[i]
+            if not n:
+                continue
+            if level.minimum[i] < parent.minimum[i]:
+                parent.minimum[i] = level.minimum[i]
+            if level.maximum[i] > parent.maximum[i]:
+                parent.maximum[i] = level.maximum[i]
+            parent.total[i] += level.total[i]
+            parent.count[i] += n
+
+    def level_for(self, duration, max_points=2000):
+        """
+        Returns the finest level that covers duration seconds with at most max_points buckets, or
+        the coarsest one if none does
+        """
+        for level in self.levels:
+            if level.bucket * level.capacity >= duration and duration / level.bucket <= max_points:
+                return level
+        return self.levels[-1]
+
+    def window(self, duration, now, max_points=2000):
+        """
+        Returns the level chosen by level_for and a view of its buckets that started in the last
+        duration seconds before now. The view excludes the oldest bucket of the storage, that can
+        be overwritten while it's read.
+        """
+        level = self.level_for(duration, max_points)
+        return level, level.data.window(duration, now, level.capacity - 1)